@@ -161,24 +161,22 @@ def send_request_complete_email(*, amendment: models.Amendment) -> None:
 
 def apply_online_refund(*, amendment: models.Amendment, user: User) -> None:
     """Automatically creates fee lines for an online refund"""
-    # Subtract cash
-    finance_services.insert_ledger(
-        account_code=Accounts.CASH,
-        finance_code=amendment.enrolment.module.finance_code,
-        narrative=amendment.narrative,
-        amount=amendment.amount,
-        type_id=TransactionTypes.ONLINE,
-        enrolment_id=amendment.enrolment.id,
-        user=user,
-    )
-    # Writeoff fee
-    finance_services.insert_ledger(
-        account_code=Accounts.TUITION,
-        finance_code=amendment.enrolment.module.finance_code,
-        narrative=amendment.narrative,
-        amount=-amendment.amount,
-        type_id=TransactionTypes.WRITEOFF,
-        enrolment_id=amendment.enrolment.id,
+    common = {
+        'finance_code': amendment.enrolment.module.finance_code,
+        'narrative': amendment.narrative,
+        'enrolment_id': amendment.enrolment.id,
+    }
+    finance_services.post_transactions(
+        [
+            # Subtract cash
+            finance_services.Posting.single(
+                account_code=Accounts.CASH, amount=amendment.amount, type_id=TransactionTypes.ONLINE, **common
+            ),
+            # Writeoff fee
+            finance_services.Posting.single(
+                account_code=Accounts.TUITION, amount=-amendment.amount, type_id=TransactionTypes.WRITEOFF, **common
+            ),
+        ],
         user=user,
     )
 
@@ -2,7 +2,7 @@ from django import forms
 
 from apps.module.models import Module
 
-from . import models
+from . import models, services
 
 
 class AccommodationForm(forms.ModelForm):
@@ -10,6 +10,13 @@ class AccommodationForm(forms.ModelForm):
         model = models.Accommodation
         fields = ['type', 'note', 'limit']
 
+    def save(self, commit: bool = True) -> models.Accommodation:
+        # Saved by the service, which keeps the module's count of rooms booked in step
+        accommodation = super().save(commit=False)
+        if commit:
+            services.save_accommodation(accommodation)
+        return accommodation
+
 
 class CateringForm(forms.ModelForm):
     class Meta:
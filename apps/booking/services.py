@@ -0,0 +1,31 @@
+from django.db import transaction
+
+from apps.module import services as module_services
+
+from . import models
+
+
+def _adjust_bookings(accommodation: models.Accommodation, change: int) -> None:
+    module_services.adjust_capacity(
+        accommodation.enrolment.module_id, **{module_services.BOOKING_COUNTS[accommodation.type]: change}
+    )
+
+
+@transaction.atomic
+def save_accommodation(accommodation: models.Accommodation) -> None:
+    """Save a new or changed accommodation booking, keeping its module's count of rooms booked in step"""
+    previous = (
+        models.Accommodation.objects.select_related('enrolment').get(pk=accommodation.pk) if accommodation.pk else None
+    )
+    accommodation.save()
+    if previous:
+        if (previous.type, previous.enrolment.module_id) == (accommodation.type, accommodation.enrolment.module_id):
+            return
+        _adjust_bookings(previous, -1)
+    _adjust_bookings(accommodation, 1)
+
+
+@transaction.atomic
+def delete_accommodation(accommodation: models.Accommodation) -> None:
+    accommodation.delete()
+    _adjust_bookings(accommodation, -1)
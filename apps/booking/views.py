@@ -12,7 +12,7 @@ from django.views import generic
 from apps.core.utils.views import AutoTimestampMixin, PageTitleMixin
 from apps.enrolment.models import Enrolment
 
-from . import datatables, forms, models
+from . import datatables, forms, models, services
 
 
 class LimitSearch(LoginRequiredMixin, PageTitleMixin, tables.SingleTableMixin, FilterView):
@@ -91,6 +91,11 @@ class DeleteAccommodation(LoginRequiredMixin, PageTitleMixin, generic.DeleteView
     template_name = 'core/delete_form.html'
     subtitle_object = False
 
+    def delete(self, request, *args, **kwargs) -> http.HttpResponse:
+        self.object = self.get_object()
+        services.delete_accommodation(self.object)
+        return http.HttpResponseRedirect(self.get_success_url())
+
     def get_success_url(self) -> str:
         messages.success(self.request, 'Accommodation removed')
         return self.object.enrolment.get_absolute_url() + '#accommodation'
@@ -6,8 +6,6 @@ from typing import Type
 
 import django_tables2 as tables
 from django_filters.views import FilterView
-from weasyprint import CSS, HTML
-from weasyprint.fonts import FontConfiguration
 
 from django import http
 from django.conf import settings
@@ -23,6 +21,7 @@ from django.urls import reverse
 from django.views import generic
 from django.views.generic.detail import SingleObjectMixin
 
+from apps.core.utils.html_pdf import render_pdf
 from apps.core.utils.strings import normalize
 from apps.core.utils.views import AutoTimestampMixin, PageTitleMixin
 from apps.tutor.models import TutorModule
@@ -138,14 +137,11 @@ class PDF(PermissionRequiredMixin, generic.View):
         contract = get_object_or_404(models.Contract, pk=pk)
         html_doc = self.render_document(contract=contract)
 
-        font_config = FontConfiguration()  # Makes @font-face and google fonts @import work
-        output = HTML(
-            string=html_doc,
+        output = render_pdf(
+            html_doc,
+            stylesheets=[Path(__file__).parent / 'static/css/tutor_contract.css'],
             # Used fetch static images.  Could be done with system file paths, but this'll work for HTML or PDF
             base_url=settings.CANONICAL_URL,
-        ).write_pdf(
-            stylesheets=[CSS(Path(__file__).parent / 'static/css/tutor_contract.css', font_config=font_config)],
-            font_config=font_config,
         )
         filename = normalize(f"contract_{contract.options['full_name']}_{contract.tutor_module.module.code}.pdf")
         return http.HttpResponse(
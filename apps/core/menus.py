@@ -102,6 +102,12 @@ Menu.add_item("main", MenuItem("Tutors", '#', children=tutor_children))
 
 finance_children = [
     MenuItem("Invoices", reverse("invoice:search"), icon="file-invoice-dollar"),
+    MenuItem(
+        "Print invoices",
+        reverse("invoice:print-batch"),
+        icon="print",
+        check=lambda request: request.user.has_perm('invoice.print_invoice'),
+    ),
     MenuItem(
         "Change requests",
         '#',
@@ -1,14 +1,22 @@
+import io
+import pickle
+import tempfile
+import threading
 from contextlib import suppress
 from datetime import date
+from pathlib import Path
+from unittest.mock import patch
 
 import django_tables2 as tables
+from lxml import etree
 from parameterized import parameterized
 
 from django import http
 from django.core import mail
-from django.test import RequestFactory, SimpleTestCase
+from django.test import RequestFactory, SimpleTestCase, override_settings
 
-from ..utils import celery, datatables, dates, urls, widgets
+from ..utils import celery, datatables, dates, db, html_pdf, urls, widgets, xml
+from ..utils.legacy import fpdf
 
 
 class TestAcademicYear(SimpleTestCase):
@@ -22,6 +30,36 @@ class TestAcademicYear(SimpleTestCase):
         self.assertIsInstance(dates.academic_year(), int)
 
 
+@override_settings(SEQUENCE_BLOCK_SIZES={'cached_sequence': 10})
+@patch('apps.core.utils.db.next_range_in_sequence', side_effect=lambda name, size: range(1, 1 + size))
+class TestSequenceAllocation(SimpleTestCase):
+    def setUp(self):
+        db._discard_reserved()
+        self.addCleanup(db._discard_reserved)
+
+    def test_values_served_from_block(self, next_range):
+        self.assertEqual(db.next_values_in_sequence('cached_sequence', 3), [1, 2, 3])
+        self.assertEqual(db.next_in_sequence('cached_sequence'), 4)
+        self.assertEqual(db.next_values_in_sequence('cached_sequence', 6), [5, 6, 7, 8, 9, 10])
+        next_range.assert_called_once_with('cached_sequence', 10)
+
+    def test_block_extended_for_large_requests(self, next_range):
+        db.next_values_in_sequence('cached_sequence', 8)
+        self.assertEqual(db.next_values_in_sequence('cached_sequence', 15), [9, 10, *range(1, 14)])
+        next_range.assert_called_with('cached_sequence', 13)
+
+    def test_strict_sequence_not_cached(self, next_range):
+        self.assertEqual(db.next_values_in_sequence('strict_sequence', 2), [1, 2])
+        self.assertEqual(db.next_values_in_sequence('strict_sequence', 2), [1, 2])  # i.e. reserved again
+        self.assertEqual(next_range.call_count, 2)
+
+    def test_forked_process_discards_block(self, next_range):
+        db.next_in_sequence('cached_sequence')
+        db._discard_reserved()  # as registered to run after a fork
+        db.next_in_sequence('cached_sequence')
+        self.assertEqual(next_range.call_count, 2)
+
+
 class TestLinkColumns(SimpleTestCase):
     """Check that our custom link columns access the correct properties on an object"""
 
@@ -118,3 +156,155 @@ class TestNextURLIfSafe(SimpleTestCase):
         request = http.HttpRequest()
         request.GET['next'] = url
         self.assertEqual(urls.next_url_if_safe(request), expected)
+
+
+class TestStreamingXML(SimpleTestCase):
+    """Check that incrementally written xml matches lxml's pretty-printed output"""
+
+    class Node:
+        def __init__(self, element_name, values, children=()):
+            self.element_name = element_name
+            self.values = values
+            self._children = children
+
+        def children(self):
+            return [self._children]
+
+    @staticmethod
+    def field_nodes(node):
+        elements = []
+        for key, value in node.values.items():
+            element = etree.Element(key)
+            element.text = value
+            elements.append(element)
+        return elements
+
+    def to_tree(self, node):
+        element = etree.Element(node.element_name)
+        element.extend(self.field_nodes(node))
+        for child in node.children()[0]:
+            element.append(self.to_tree(child))
+        return element
+
+    def setUp(self):
+        self.model = self.Node(
+            'Parent',
+            {'NAME': 'Éżraç & <co>', 'EMPTY': None, 'BLANK': ''},
+            [
+                self.Node('Child', {'ID': '1'}, [self.Node('Grandchild', {'ID': '2'})]),
+                self.Node('Leaf', {}),
+            ],
+        )
+
+    def test_matches_pretty_print(self):
+        output = io.BytesIO()
+        xml.write_document(output, self.model, field_nodes=self.field_nodes)
+        self.assertEqual(output.getvalue(), etree.tostring(self.to_tree(self.model), pretty_print=True))
+
+    def test_root_element(self):
+        root = etree.Element('Root')
+        root.append(self.to_tree(self.model))
+
+        output = io.BytesIO()
+        xml.write_document(output, self.model, field_nodes=self.field_nodes, root_element='Root')
+        self.assertEqual(output.getvalue(), etree.tostring(root, pretty_print=True))
+
+
+class TestFontRegistry(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.cache_dir = Path(directory.name)
+        cache_dir = override_settings(FPDF_FONT_CACHE_DIR=self.cache_dir)
+        cache_dir.enable()
+        self.addCleanup(cache_dir.disable)
+        for memo in [fpdf._font_metrics, fpdf._font_widths]:
+            patcher = patch.dict(memo, clear=True)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.path = str(Path(fpdf.MODULE_DIRECTORY) / 'fonts' / 'LiberationSans-Regular.ttf')
+
+    def test_parsed_once_per_process(self):
+        with patch.object(fpdf, '_parse_font_metrics', wraps=fpdf._parse_font_metrics) as parse:
+            fpdf.ContedPDF().output(dest='S')
+            fpdf.ContedPDF().output(dest='S')
+        parse.assert_called_once_with(self.path)
+
+    def test_cache_shared_between_processes(self):
+        metrics = fpdf.font_metrics(self.path)
+        fpdf._font_metrics.clear()  # as in a new process
+        with patch.object(fpdf, '_parse_font_metrics') as parse:
+            self.assertEqual(fpdf.font_metrics(self.path), metrics)
+        parse.assert_not_called()
+
+    def test_mismatched_cache_rebuilt(self):
+        fpdf.font_metrics(self.path)
+        (cache_path,) = self.cache_dir.iterdir()
+        with open(cache_path, 'wb') as file:
+            pickle.dump({'sha256': 'another font', 'metrics': {}}, file)
+        fpdf._font_metrics.clear()
+        self.assertTrue(fpdf.font_metrics(self.path)['cw'])
+        with open(cache_path, 'rb') as file:
+            self.assertNotEqual(pickle.load(file)['sha256'], 'another font')
+
+    def test_only_used_fonts_embedded(self):
+        pdf = fpdf.ContedPDF()
+        pdf.set_font('arial_ttf', 'B', 10)
+        self.assertEqual(set(pdf.fonts), {'arial_ttf', 'arial_ttfB'})
+
+
+class FakeHTML:
+    """Stands in for WeasyPrint's HTML, "rendering" a document to its own markup"""
+
+    def __init__(self, *, string, base_url):
+        self.string = string
+
+    def write_pdf(self, *, stylesheets, font_config):
+        return self.string.encode()
+
+
+class TestHTMLPDF(SimpleTestCase):
+    def setUp(self):
+        for patcher in [
+            patch.object(html_pdf, '_parsed', html_pdf._Parsed()),
+            patch.object(html_pdf, 'CSS'),
+            # A new object for each configuration, so sharing can be checked
+            patch.object(html_pdf, 'FontConfiguration', side_effect=object),
+        ]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_stylesheets_parsed_once_per_thread(self):
+        html_pdf.render_pdf('<p>One</p>', stylesheets=['contract.css'])
+        html_pdf.render_pdf('<p>Two</p>', stylesheets=[Path('contract.css')])
+        html_pdf.CSS.assert_called_once_with(filename='contract.css', font_config=html_pdf.font_config())
+
+    def test_font_config_shared(self):
+        self.assertIs(html_pdf.font_config(), html_pdf.font_config())
+        html_pdf.FontConfiguration.assert_called_once_with()
+
+    def test_concurrent_renders_share_nothing(self):
+        barrier = threading.Barrier(4)
+
+        def render():
+            barrier.wait()  # All render at once
+            html_pdf.render_pdf('<p>Text</p>', stylesheets=['contract.css'])
+
+        threads = [threading.Thread(target=render) for _ in range(4)]
+        with patch.object(html_pdf, 'HTML') as html:
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        # Each thread lays out with its own font configuration, and stylesheets parsed with it
+        configs = {id(call.kwargs['font_config']) for call in html.return_value.write_pdf.call_args_list}
+        self.assertEqual(len(configs), 4)
+        self.assertEqual({id(call.kwargs['font_config']) for call in html_pdf.CSS.call_args_list}, configs)
+
+    @parameterized.expand([(1,), (2,)])
+    def test_render_many_in_order(self, processes):
+        documents = [html_pdf.Document(html=f'<p>{number}</p>') for number in range(5)]
+        with patch.object(html_pdf, 'HTML', FakeHTML):
+            rendered = list(html_pdf.render_many(documents, processes=processes))
+        self.assertEqual(rendered, [f'<p>{number}</p>'.encode() for number in range(5)])
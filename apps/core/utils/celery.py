@@ -1,6 +1,9 @@
 import socket
+from contextlib import contextmanager
 from functools import wraps
-from typing import Callable, TypeVar
+from typing import Callable, Iterable, Iterator, TypeVar
+
+import billiard
 
 from django.conf import settings
 from django.core.mail import send_mail
@@ -34,3 +37,29 @@ def mail_on_failure(func: Callable[..., ReturnType]) -> Callable[..., ReturnType
             raise
 
     return wrapper
+
+
+@contextmanager
+def process_map(processes: int) -> Iterator[Callable[[Callable, Iterable], Iterator]]:
+    """A function like map(), which runs in a pool of `processes` processes if that's more than 1.
+
+    The pool is billiard's (Celery's fork of multiprocessing), as concurrent.futures and multiprocessing can't start
+    processes from Celery's prefork workers, which are daemonic.  Functions and items must be picklable
+    """
+    if processes <= 1:
+        yield map
+        return
+
+    pool = billiard.Pool(processes)
+
+    def pool_map(function: Callable, items: Iterable) -> Iterator:
+        # A task per item, rather than imap(), whose results billiard credits to a single worker, so the others wait
+        #  (up to 30 seconds) at exit for results they sent to be acknowledged
+        results = [pool.apply_async(function, (item,)) for item in items]
+        return (result.get() for result in results)
+
+    try:
+        yield pool_map
+    finally:
+        pool.terminate()
+        pool.join()
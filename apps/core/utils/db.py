@@ -1,7 +1,68 @@
+import os
+import threading
+
+from django.conf import settings
 from django.db import connection
 
+# Values reserved by this process but not yet handed out: {sequence_name: [values]}
+_reserved: dict[str, list[int]] = {}
+_lock = threading.Lock()
+
+
+def _discard_reserved() -> None:
+    # A forked process (e.g. a gunicorn or celery worker) mustn't hand out the same values as its parent
+    _reserved.clear()
+
+
+os.register_at_fork(after_in_child=_discard_reserved)
+
+
+def _block_size(sequence_name: str) -> int:
+    return settings.SEQUENCE_BLOCK_SIZES.get(sequence_name, 0)
+
+
+def next_range_in_sequence(sequence_name: str, size: int) -> range:
+    """Reserve `size` consecutive values from a sequence in a single round trip, bypassing any cached block.
+
+    Values are reserved atomically by the database, so no two processes can receive the same value
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            SET NOCOUNT ON;
+            DECLARE @first sql_variant;
+            EXEC sys.sp_sequence_get_range @sequence_name = %s, @range_size = %s, @range_first_value = @first OUTPUT;
+            SELECT CAST(@first AS bigint);
+            """,
+            [sequence_name, size],
+        )
+        first = cursor.fetchone()[0]
+    # Our sequences all increment by 1
+    return range(first, first + size)
+
+
+def next_values_in_sequence(sequence_name: str, count: int) -> list[int]:
+    """Get `count` unused values from a sequence, in ascending order but not necessarily consecutive.
+
+    Sequences with a block size in settings.SEQUENCE_BLOCK_SIZES are served from a block of values reserved by this
+    process, only going to the database when the block runs out.  Other sequences reserve exactly `count` values,
+    so never leave gaps (other than from rolled back transactions)
+    """
+    block_size = _block_size(sequence_name)
+    if not block_size:
+        return list(next_range_in_sequence(sequence_name, count))
+
+    with _lock:
+        reserved = _reserved.setdefault(sequence_name, [])
+        if len(reserved) < count:
+            reserved.extend(next_range_in_sequence(sequence_name, max(block_size, count - len(reserved))))
+        values, reserved[:] = reserved[:count], reserved[count:]
+    return values
+
 
 def next_in_sequence(sequence_name: str) -> int:
+    if _block_size(sequence_name):
+        return next_values_in_sequence(sequence_name, 1)[0]
     with connection.cursor() as cursor:
         cursor.execute(f"SELECT NEXT VALUE FOR {sequence_name}")
         row = cursor.fetchone()
@@ -0,0 +1,90 @@
+"""Rendering of HTML documents (contracts, feedback reports, etc.) to PDF with WeasyPrint.
+
+Parsing a stylesheet, and loading the fonts its @font-face rules refer to, can take longer than laying out a short
+document, so each thread parses a stylesheet once, and every render in a thread shares one font configuration.  They're
+kept per thread, not per process, as WeasyPrint and Pango don't support sharing them between threads (e.g. uWSGI's
+request threads).  Batches of documents can be rendered with `render_many()`, which spreads them over a pool of
+processes.
+"""
+from __future__ import annotations
+
+import os
+import threading
+from pathlib import Path
+from typing import Iterable, Iterator, NamedTuple, Optional, Union
+
+from weasyprint import CSS, HTML
+from weasyprint.fonts import FontConfiguration
+
+from django.conf import settings
+
+from .celery import process_map
+
+
+class _Parsed(threading.local):
+    """A thread's parsed stylesheets, by path, and the font configuration they were parsed with"""
+
+    def __init__(self):
+        self.stylesheets: dict[str, CSS] = {}
+        self.font_config: Optional[FontConfiguration] = None
+
+
+_parsed = _Parsed()
+
+
+def _discard_parsed() -> None:
+    # A forked process (e.g. a Celery or pool worker) mustn't share its parent's fontconfig state, so starts afresh
+    global _parsed
+    _parsed = _Parsed()
+
+
+os.register_at_fork(after_in_child=_discard_parsed)
+
+
+class Document(NamedTuple):
+    """An HTML document to be rendered, with the paths of its stylesheets.
+
+    `base_url` is used to resolve relative links (e.g. to static images) in the HTML
+    """
+
+    html: str
+    stylesheets: tuple[Union[str, Path], ...] = ()
+    base_url: Optional[str] = None
+
+
+def font_config() -> FontConfiguration:
+    """This thread's font configuration, which makes @font-face (and google fonts @import) work"""
+    if _parsed.font_config is None:
+        _parsed.font_config = FontConfiguration()
+    return _parsed.font_config
+
+
+def stylesheet(path: Union[str, Path]) -> CSS:
+    """A stylesheet, parsed on the first use in this thread"""
+    key = str(path)
+    if key not in _parsed.stylesheets:
+        _parsed.stylesheets[key] = CSS(filename=key, font_config=font_config())
+    return _parsed.stylesheets[key]
+
+
+def render_pdf(html: str, *, stylesheets: Iterable[Union[str, Path]] = (), base_url: Optional[str] = None) -> bytes:
+    return HTML(string=html, base_url=base_url).write_pdf(
+        stylesheets=[stylesheet(path) for path in stylesheets],
+        font_config=font_config(),
+    )
+
+
+def _render(document: Document) -> bytes:
+    # Module-level, so the pool can pickle it
+    return render_pdf(document.html, stylesheets=document.stylesheets, base_url=document.base_url)
+
+
+def render_many(documents: Iterable[Document], *, processes: Optional[int] = None) -> Iterator[bytes]:
+    """Yield each document rendered to PDF, in order.
+
+    Documents are rendered in a pool of `processes` processes (settings.PDF_RENDER_PROCESSES by default) if that's
+    more than 1, each of which parses the stylesheets once
+    """
+    processes = settings.PDF_RENDER_PROCESSES if processes is None else processes
+    with process_map(processes) as render:
+        yield from render(_render, documents)
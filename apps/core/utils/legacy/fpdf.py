@@ -1,11 +1,101 @@
 # flake8: noqa
 
+import hashlib
+import logging
 import os
+import pickle
+import re
+import tempfile
+import threading
+from pathlib import Path
 
 from fpdf import FPDF
+from fpdf.ttfonts import TTFontFile
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
 
 MODULE_DIRECTORY = os.path.dirname(__file__)
 
+# Fonts added to every ContedPDF: (family, style, filename in ./fonts)
+CONTED_FONTS = [
+    ('arial_ttf', '', 'LiberationSans-Regular.ttf'),
+    ('arial_ttf', 'B', 'LiberationSans-Bold.ttf'),
+    ('roboto_ttf', '', 'Roboto-Light.ttf'),
+    ('roboto_ttf', 'B', 'Roboto-Bold.ttf'),
+    ('roboto_ttf', 'I', 'Roboto-LightItalic.ttf'),
+]
+
+# Font metrics already read by this process: {ttf path: metrics}.  These are shared by every document, so never modified
+_font_metrics: dict[str, dict] = {}
+# Fonts' PDF width arrays already built by this process: {(ttf path, max unicode, characters beyond latin-1): array}
+_font_widths: dict[tuple, str] = {}
+_font_lock = threading.Lock()
+
+
+def _parse_font_metrics(path: str) -> dict:
+    """Read a TrueType font's metrics, as fpdf's add_font() does"""
+    ttf = TTFontFile()
+    ttf.getMetrics(path)
+    return {
+        'name': re.sub('[ ()]', '', ttf.fullName),
+        'type': 'TTF',
+        'desc': {
+            'Ascent': int(round(ttf.ascent, 0)),
+            'Descent': int(round(ttf.descent, 0)),
+            'CapHeight': int(round(ttf.capHeight, 0)),
+            'Flags': ttf.flags,
+            'FontBBox': '[%s %s %s %s]' % tuple(int(round(value, 0)) for value in ttf.bbox[:4]),
+            'ItalicAngle': int(ttf.italicAngle),
+            'StemV': int(round(ttf.stemV, 0)),
+            'MissingWidth': int(round(ttf.defaultWidth, 0)),
+        },
+        'up': round(ttf.underlinePosition),
+        'ut': round(ttf.underlineThickness),
+        'originalsize': os.stat(path).st_size,
+        'cw': ttf.charWidths,
+    }
+
+
+def _cache_path(path: str, digest: str) -> Path:
+    return Path(settings.FPDF_FONT_CACHE_DIR) / f'{Path(path).stem}-{digest[:16]}.pkl'
+
+
+def _load_font_metrics(path: str) -> dict:
+    """Read a font's metrics from the cache directory, after checking they were built from this exact file.
+    Otherwise parse the font, and try to cache the result for other processes
+    """
+    with open(path, 'rb') as file:
+        digest = hashlib.sha256(file.read()).hexdigest()
+    cache_path = _cache_path(path, digest)
+    try:
+        with open(cache_path, 'rb') as file:
+            cached = pickle.load(file)
+        if cached['sha256'] == digest:
+            return cached['metrics']
+    except (OSError, pickle.UnpicklingError, EOFError, KeyError, TypeError):
+        pass
+
+    metrics = _parse_font_metrics(path)
+    try:
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        # Written to a temporary file and then moved into place, so other processes never read a partial cache
+        with tempfile.NamedTemporaryFile('wb', dir=cache_path.parent, delete=False) as file:
+            pickle.dump({'sha256': digest, 'metrics': metrics}, file)
+        os.replace(file.name, cache_path)
+    except OSError:
+        logger.warning('Could not write font metrics cache %s', cache_path, exc_info=True)
+    return metrics
+
+
+def font_metrics(path: str) -> dict:
+    """A font's metrics, read at most once per process"""
+    with _font_lock:
+        if path not in _font_metrics:
+            _font_metrics[path] = _load_font_metrics(path)
+        return _font_metrics[path]
+
 
 class ExtendedFPDF(FPDF):  # pragma: no cover
     """A legacy tool from the php days, translated into python to support old pdf document generators
@@ -17,6 +107,42 @@ class ExtendedFPDF(FPDF):  # pragma: no cover
         self.aligns = None
         super(ExtendedFPDF, self).__init__()
 
+    def add_cached_font(self, family: str, style: str, path: str):
+        """Equivalent to add_font(family, style, path, uni=True), but with the font's metrics from font_metrics()"""
+        fontkey = family.lower() + style.upper()
+        if fontkey in self.fonts:
+            return
+        metrics = font_metrics(path)
+        self.fonts[fontkey] = {
+            'i': len(self.fonts) + 1,
+            'type': metrics['type'],
+            'name': metrics['name'],
+            'desc': metrics['desc'],
+            'up': metrics['up'],
+            'ut': metrics['ut'],
+            'cw': metrics['cw'],
+            'ttffile': path,
+            'fontkey': fontkey,
+            'subset': list(range(0, 57)) if hasattr(self, 'str_alias_nb_pages') else list(range(0, 32)),
+            'unifilename': None,
+        }
+        self.font_files[fontkey] = {'length1': metrics['originalsize'], 'type': 'TTF', 'ttffile': path}
+        self.font_files[path] = {'type': 'TTF'}
+
+    def _putTTfontwidths(self, font, maxUni):
+        # fpdf checks the width of every character in the font for every document, but the result only depends on the
+        #  font and which characters beyond latin-1 are used, so is built once per process
+        key = (font['ttffile'], maxUni, tuple(sorted(cid for cid in font['subset'] if cid > 255)))
+        if key not in _font_widths:
+            lines = []
+            out, self._out = self._out, lines.append
+            try:
+                super()._putTTfontwidths(font, maxUni)
+            finally:
+                self._out = out
+            _font_widths[key] = ''.join(lines)
+        self._out(_font_widths[key])
+
     def basic_table(self, header, data, col_widths, borders, font_type, cell_type):
         """# *************************************************************************
         *Basic table
@@ -433,17 +559,27 @@ class ContedPDF(ExtendedFPDF):  # pragma: no cover
         # (NB: Any font needs to be placed in the fpdf folder within the web2py source: .../gluon/contrib/fpdf/font)
         super(ContedPDF, self).__init__()
 
-        self.add_font('arial_ttf', '', os.path.join(MODULE_DIRECTORY, 'fonts', 'LiberationSans-Regular.ttf'), uni=True)
-        self.add_font('arial_ttf', 'B', os.path.join(MODULE_DIRECTORY, 'fonts', 'LiberationSans-Bold.ttf'), uni=True)
-        self.add_font('roboto_ttf', '', os.path.join(MODULE_DIRECTORY, 'fonts', 'Roboto-Light.ttf'), uni=True)
-        self.add_font('roboto_ttf', 'B', os.path.join(MODULE_DIRECTORY, 'fonts', 'Roboto-Bold.ttf'), uni=True)
-        self.add_font('roboto_ttf', 'I', os.path.join(MODULE_DIRECTORY, 'fonts', 'Roboto-LightItalic.ttf'), uni=True)
+        self.add_fonts()
         self.set_font('arial_ttf')
         self.set_margins(20, 20)
         self.set_auto_page_break(True, margin=28)  # Gives us the bottom margin for the footer
         self.alias_nb_pages()
         self.add_page()
 
+    def add_fonts(self):
+        # Metrics are read once per process, rather than parsed (or unpickled) again for every document.  Fonts are only
+        #  added once set_font() first selects them, so unused fonts aren't subset and embedded in every document
+        self.font_paths = {
+            family + style: (family, style, os.path.join(MODULE_DIRECTORY, 'fonts', filename))
+            for family, style, filename in CONTED_FONTS
+        }
+
+    def set_font(self, family, style='', size=0):
+        fontkey = (family.lower() or self.font_family) + ''.join(sorted(style.upper().replace('U', '')))
+        if fontkey in getattr(self, 'font_paths', {}):
+            self.add_cached_font(*self.font_paths[fontkey])
+        super().set_font(family, style, size)
+
     def header(self):
         # Header is automatically included onto the top of every page
         # Logo
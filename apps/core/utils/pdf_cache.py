@@ -0,0 +1,107 @@
+"""Caching of rendered PDF documents (invoices, statements and receipts), with conditional GET support.
+
+A document is cached under its kind and id, plus a version made of:
+ - the latest change to the rows it's rendered from (its ledger, invoice or address rows), passed in by the view
+ - a generation, replaced by `invalidate()` when a service changes those rows in a way that leaves no timestamp behind
+   (e.g. deleting ledger lines, or updating balances in bulk), once the change is committed
+ - for documents printed with the current date (statements and receipts), the date, so they're rendered again daily
+
+The same version is sent as the response's ETag, so a client's repeat fetch of an unchanged document gets a 304
+without the document being rendered or even read from the cache.
+"""
+from __future__ import annotations
+
+import hashlib
+import time
+from datetime import date, datetime
+from functools import partial
+from typing import Callable, Iterable, Optional
+
+from django import http
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+
+INVOICE = 'invoice'
+STATEMENT = 'statement'
+RECEIPT = 'receipt'
+# Kinds printed with the date they're rendered on
+DATED_KINDS = {STATEMENT, RECEIPT}
+
+
+def _generation_key(kind: str, document_id: int) -> str:
+    return f'pdf-generation:{kind}:{document_id}'
+
+
+def _generation(kind: str, document_id: int) -> int:
+    # A missing (never invalidated, or evicted) generation is replaced with a new one, so an evicted generation can't
+    #  bring back a document cached before the last invalidation
+    return cache.get_or_set(_generation_key(kind, document_id), time.time_ns, settings.PDF_CACHE_TIMEOUT)
+
+
+def _replace_generations(kind: str, document_ids: list[int]) -> None:
+    generation = time.time_ns()
+    cache.set_many(
+        {_generation_key(kind, document_id): generation for document_id in document_ids},
+        settings.PDF_CACHE_TIMEOUT,
+    )
+
+
+def invalidate(kind: str, document_ids: Iterable[int]) -> None:
+    """Mark any cached copies of some documents as stale, so they're rendered again on their next request.
+
+    The generations are replaced once the current transaction commits (or immediately, outside one), so a concurrent
+    request can't cache a rendering of the uncommitted rows under the new generation
+    """
+    transaction.on_commit(partial(_replace_generations, kind, list(document_ids)))
+
+
+def latest(*timestamps: Optional[datetime]) -> Optional[datetime]:
+    """The latest of some modification times, ignoring any which are missing"""
+    return max((timestamp for timestamp in timestamps if timestamp), default=None)
+
+
+def pdf_response(
+    request: http.HttpRequest,
+    *,
+    kind: str,
+    document_id: int,
+    last_modified: Optional[datetime],
+    render: Callable[[], bytes],
+    filename: str,
+    variant: str = '',
+) -> http.HttpResponse:
+    """Respond with a document from the cache, rendering it with `render()` if it isn't cached at this version.
+
+    `variant` distinguishes different renderings of one document (e.g. a receipt addressed to different students),
+    which are invalidated together.  Requests with a matching If-None-Match or If-Modified-Since header get a 304
+    """
+    generation = _generation(kind, document_id)
+    if kind in DATED_KINDS:
+        # The printed date changes at midnight, which counts as a modification
+        today = date.today()
+        variant = f'{variant}:{today.isoformat()}'
+        last_modified = latest(last_modified, datetime.combine(today, datetime.min.time()))
+    timestamp = last_modified.isoformat() if last_modified else ''
+    version = f'{kind}:{document_id}:{variant}:{generation}:{timestamp}'
+    etag = quote_etag(hashlib.sha1(version.encode()).hexdigest())
+    # An invalidation counts as a modification, for clients which only send If-Modified-Since
+    modified = max(generation // 1_000_000_000, int(last_modified.timestamp()) if last_modified else 0)
+
+    response = get_conditional_response(request, etag=etag, last_modified=modified)
+    if response is None:
+        key = f'pdf:{version}'
+        document = cache.get(key)
+        if document is None:
+            document = render()
+            cache.set(key, document, settings.PDF_CACHE_TIMEOUT)
+        response = http.HttpResponse(
+            document, content_type='application/pdf', headers={'Content-Disposition': f'inline;filename={filename}'}
+        )
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(modified)
+    # Clients may keep a copy, but must check it's still current before using it
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
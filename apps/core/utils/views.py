@@ -85,7 +85,7 @@ class DeletionFailedMessageMixin:
     def delete(self, request, *args, **kwargs) -> http.HttpResponse:
         try:
             self.object = self.get_object()
-            self.object.delete()
+            self.delete_object()
         except models.ProtectedError as e:
             protected_class = e.protected_objects.pop()._meta.verbose_name
             messages.error(
@@ -95,6 +95,10 @@ class DeletionFailedMessageMixin:
         else:
             return self.on_success()
 
+    def delete_object(self) -> None:
+        """Override to delete the object some other way (e.g. through a service)"""
+        self.object.delete()
+
     def on_success(self) -> http.HttpResponse:
         """Override to add custom behaviour when the delete succeeds (e.g. a message)"""
         success_url = self.get_success_url()
@@ -0,0 +1,98 @@
+"""Utilities for serializing large documents (e.g. HESA returns) built from XMLStagingModels
+
+Writing with etree.xmlfile lets us stream nodes to disk as they're produced, rather than building the entire tree
+in memory and serializing it in one go.  Indentation is written by hand to match etree.tostring(pretty_print=True)
+"""
+from __future__ import annotations
+
+import itertools
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Any, BinaryIO, Callable, Iterable, Iterator
+
+from lxml import etree
+
+from django.db.models import Model, QuerySet
+
+INDENT = '  '
+
+FieldNodes = Callable[[Any], Iterable[etree._Element]]
+
+
+def _children(model: Any) -> Iterator[Any]:
+    return itertools.chain.from_iterable(model.children())
+
+
+def write_node(xf: etree.xmlfile, model: Any, *, field_nodes: FieldNodes, depth: int = 0) -> None:
+    """Recursively write an XMLStagingModel and its children to an open xmlfile
+
+    `field_nodes` converts a model into its list of value elements, which are written before any child nodes
+    """
+    fields = list(field_nodes(model))
+    children = _children(model)
+    first_child = next(children, None)
+
+    if not fields and first_child is None:
+        # An empty element is self-closing when pretty-printed
+        xf.write(etree.Element(model.element_name))
+        return
+
+    with xf.element(model.element_name):
+        for field in fields:
+            xf.write('\n' + INDENT * (depth + 1))
+            xf.write(field)
+        if first_child is not None:
+            for child in itertools.chain([first_child], children):
+                xf.write('\n' + INDENT * (depth + 1))
+                write_node(xf, child, field_nodes=field_nodes, depth=depth + 1)
+        xf.write('\n' + INDENT * depth)
+
+
+def write_document(output: BinaryIO, model: Any, *, field_nodes: FieldNodes, root_element: str | None = None) -> None:
+    """Stream a model tree to a binary file, optionally wrapped in a root element.
+
+    The output is byte-identical to etree.tostring(tree, pretty_print=True) for the same tree
+    """
+    with etree.xmlfile(output) as xf:
+        if root_element:
+            with xf.element(root_element):
+                xf.write('\n' + INDENT)
+                write_node(xf, model, field_nodes=field_nodes, depth=1)
+                xf.write('\n')
+        else:
+            write_node(xf, model, field_nodes=field_nodes)
+    output.write(b'\n')
+
+
+@dataclass
+class ChildRelation:
+    """Child nodes of `parent` are the rows of `queryset` whose `child_field` matches the parent's `parent_field`"""
+
+    parent: type[Model]
+    queryset: QuerySet
+    parent_field: str
+    child_field: str
+
+
+def load_graph(root: Model, relations: Iterable[ChildRelation]) -> None:
+    """Read a batch's staging tables into memory, so that children() resolves from an index rather than a query
+    per parent row.
+
+    Each table is read in a single query, and every row is given a list of its children (`_loaded_children`), in
+    the order of its relations.  Relations must be ordered so that a parent's rows are loaded before its children's.
+    """
+    loaded: dict[type[Model], list[Model]] = {type(root): [root]}
+    root._loaded_children = []  # type: ignore
+    for relation in relations:
+        model = relation.queryset.model
+        if model not in loaded:
+            loaded[model] = list(relation.queryset.order_by('pk'))
+            for row in loaded[model]:
+                row._loaded_children = []  # type: ignore
+
+        index = defaultdict(list)
+        for row in loaded[model]:
+            index[getattr(row, relation.child_field)].append(row)
+
+        for parent in loaded[relation.parent]:
+            parent._loaded_children.append(index.get(getattr(parent, relation.parent_field), []))  # type: ignore
@@ -10,7 +10,7 @@ from apps.module.models import Module
 from apps.qualification_aim.models import QualificationAim
 from apps.student.models import Student
 
-from . import models
+from . import models, services
 
 
 class ModuleChoiceField(forms.ModelChoiceField):
@@ -52,7 +52,7 @@ class CreateForm(forms.Form):
         # Disallow enrolling on full 'weekly classes' (portfolio=32) programs. Other workflows are more forgiving.
         # TODO: replace with portfolio flags
         module = self.cleaned_data.get('module')
-        if module and module.portfolio_id == 32 and module.is_full():
+        if module and module.portfolio_id == 32 and module.is_full(exact=True):
             self.add_error('module', 'Module is full')
 
 
@@ -72,3 +72,10 @@ class EditForm(forms.ModelForm):
         if not self.instance.qa.programme.qualification.is_postgraduate:
             # Todo: consider whether module level is a better check
             del self.fields['mark']
+
+    def save(self, commit: bool = True) -> models.Enrolment:
+        # Saved by the service, which keeps the module's count of places taken in step
+        enrolment = super().save(commit=False)
+        if commit:
+            services.update_enrolment(enrolment)
+        return enrolment
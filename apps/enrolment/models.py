@@ -4,7 +4,7 @@ from django.db import models
 from django.urls import reverse
 
 from apps.core.models import SignatureModel
-from apps.finance.models import Accounts
+from apps.finance.models import Accounts, EnrolmentBalance
 
 
 class Results(models.TextChoices):
@@ -32,7 +32,13 @@ class EnrolmentQuerySet(models.QuerySet):
         return self.with_balance().filter(balance__gt=0)
 
     def with_balance(self) -> models.QuerySet:
-        """Add an outstanding `balance` attribute to each row.
+        """Add an outstanding `balance` attribute to each row, from the maintained balance table.
+        Enrolments without any fees or payments have a balance of None
+        """
+        return self.annotate(balance=models.F('debtor_balance__balance'))
+
+    def with_ledger_balance(self) -> models.QuerySet:
+        """Add an outstanding `balance` attribute to each row, by aggregating the ledger.
         If the ledger items are filtered in another way (e.g. connected to a given invoice),
         the balance will reflect that filtered set
         """
@@ -107,8 +113,9 @@ class Enrolment(SignatureModel):
         super().save(*args, **kwargs)
 
     def get_balance(self) -> Decimal:
-        ledger_balance = self.ledger_set.debts().total()
-        return ledger_balance or Decimal(0)
+        # Queried rather than using the `debtor_balance` relation, which would be cached on the instance
+        balance = EnrolmentBalance.objects.filter(enrolment=self).values_list('balance', flat=True).first()
+        return balance or Decimal(0)
 
     # todo: implement as a column (take logic out of status, removing values 11 & 90)
     @property
@@ -1,13 +1,17 @@
 from __future__ import annotations
 
+from collections import Counter
+
 from django.conf import settings
 from django.core import mail
+from django.db import transaction
 from django.template.loader import render_to_string
 
 import apps.invoice.pdfs as invoice_pdfs
 from apps.core.models import User
 from apps.core.utils.dates import academic_year
 from apps.invoice.models import Invoice
+from apps.module import services as module_services
 from apps.module.models import Module
 from apps.qualification_aim.models import QualificationAim
 from apps.student.models import Student
@@ -16,6 +20,7 @@ from apps.student.services import next_husid
 from . import models
 
 
+@transaction.atomic
 def create_enrolment(
     *, qa: QualificationAim, module: Module, status: models.EnrolmentStatus, user: User
 ) -> models.Enrolment:
@@ -36,13 +41,44 @@ def create_enrolment(
         qa.start_date = module.start_date
         qa.save()
 
-    return models.Enrolment.objects.create(
+    enrolment = models.Enrolment.objects.create(
         qa=qa,
         module=module,
         status=status,
         created_by=user.username,
         modified_by=user.username,
     )
+    module_services.adjust_capacity(module.id, places=int(status.takes_place))
+    return enrolment
+
+
+@transaction.atomic
+def update_enrolment(enrolment: models.Enrolment) -> None:
+    """Save changes to an enrolment, keeping its module's count of places taken in step with any change of status"""
+    previous = models.Enrolment.objects.select_related('status').get(pk=enrolment.pk)
+    enrolment.save()
+    if previous.module_id == enrolment.module_id:
+        module_services.adjust_capacity(
+            enrolment.module_id, places=enrolment.status.takes_place - previous.status.takes_place
+        )
+    else:
+        # Moved to another module, taking any accommodation bookings with it
+        bookings = Counter(
+            module_services.BOOKING_COUNTS[booking_type]
+            for booking_type in enrolment.accommodation.values_list('type', flat=True)
+        )
+        module_services.adjust_capacity(
+            previous.module_id,
+            places=-previous.status.takes_place,
+            **{count: -bookings[count] for count in bookings},
+        )
+        module_services.adjust_capacity(enrolment.module_id, places=int(enrolment.status.takes_place), **bookings)
+
+
+@transaction.atomic
+def delete_enrolment(enrolment: models.Enrolment) -> None:
+    enrolment.delete()
+    module_services.adjust_capacity(enrolment.module_id, places=-enrolment.status.takes_place)
 
 
 def send_confirmation_email(
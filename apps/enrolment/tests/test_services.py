@@ -2,6 +2,8 @@ from datetime import date
 
 from django import test
 
+from apps.booking.models import Accommodation
+from apps.booking.services import delete_accommodation, save_accommodation
 from apps.core.utils.tests import LoggedInMixin
 from apps.module.tests.factories import ModuleFactory
 from apps.qualification_aim.tests.factories import QualificationAimFactory
@@ -30,3 +32,59 @@ class TestCreateEnrolment(LoggedInMixin, test.TestCase):
         self.qa.refresh_from_db()
         self.assertEqual(self.qa.start_date, self.module.start_date)
         self.assertIsInstance(self.qa.student.husid, int)
+
+
+class TestCapacityCounts(LoggedInMixin, test.TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.module, cls.other_module = ModuleFactory.create_batch(2, max_size=1, single_places=2, twin_places=2)
+        cls.enrolment = services.create_enrolment(
+            qa=QualificationAimFactory(),
+            module=cls.module,
+            status=models.EnrolmentStatus.objects.get(pk=models.Statuses.CONFIRMED),
+            user=cls.user,
+        )
+
+    def test_places_taken(self):
+        self.module.refresh_from_db()
+        self.assertEqual(self.module.places_taken(), 1)
+        self.assertTrue(self.module.is_full())
+
+        self.enrolment.status_id = models.Statuses.WITHDRAWN_UP_TO_3_WEEKS
+        services.update_enrolment(self.enrolment)
+        self.module.refresh_from_db()
+        self.assertEqual(self.module.places_taken(), 0)
+
+        self.enrolment.status_id = models.Statuses.PROVISIONAL
+        services.update_enrolment(self.enrolment)
+        services.delete_enrolment(self.enrolment)
+        self.module.refresh_from_db()
+        self.assertEqual(self.module.places_taken(), 0)
+        self.assertEqual(self.module.places_taken(exact=True), 0)
+
+    def test_bookings_move_with_enrolment(self):
+        save_accommodation(Accommodation(enrolment=self.enrolment, type=Accommodation.Types.SINGLE))
+        self.enrolment.module = self.other_module
+        services.update_enrolment(self.enrolment)
+
+        self.module.refresh_from_db()
+        self.assertEqual((self.module.places_taken(), self.module.get_singles_left()), (0, 2))
+        self.other_module.refresh_from_db()
+        self.assertEqual((self.other_module.places_taken(), self.other_module.get_singles_left()), (1, 1))
+
+    def test_bookings(self):
+        booking = Accommodation(enrolment=self.enrolment, type=Accommodation.Types.SINGLE)
+        save_accommodation(booking)
+        self.module.refresh_from_db()
+        self.assertEqual((self.module.get_singles_left(), self.module.get_twins_left()), (1, 2))
+
+        booking.type = Accommodation.Types.TWIN
+        save_accommodation(booking)
+        self.module.refresh_from_db()
+        self.assertEqual((self.module.get_singles_left(), self.module.get_twins_left()), (2, 1))
+        self.assertEqual(self.module.get_twins_left(exact=True), 1)
+
+        delete_accommodation(booking)
+        self.module.refresh_from_db()
+        self.assertEqual((self.module.get_singles_left(), self.module.get_twins_left()), (2, 2))
@@ -139,9 +139,12 @@ class Edit(LoginRequiredMixin, PageTitleMixin, SuccessMessageMixin, AutoTimestam
         return {**kwargs, 'edit_mark': edit_mark}
 
     def form_valid(self, form):
+        response = super().form_valid(form)
         # Update module, in case it is now full/not-full
-        form.instance.module.update_status()
-        return super().form_valid(form)
+        module = self.object.module
+        module.refresh_from_db(fields=['taken_places'])
+        module.update_status()
+        return response
 
 
 class Delete(LoginRequiredMixin, PageTitleMixin, DeletionFailedMessageMixin, generic.DeleteView):
@@ -149,6 +152,9 @@ class Delete(LoginRequiredMixin, PageTitleMixin, DeletionFailedMessageMixin, gen
     template_name = 'core/delete_form.html'
     success_message = 'Enrolment deleted'
 
+    def delete_object(self) -> None:
+        services.delete_enrolment(self.object)
+
     def on_success(self):
         messages.success(self.request, self.success_message)  # DeleteViews don't do this automatically
         return super().on_success()
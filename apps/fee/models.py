@@ -3,6 +3,7 @@ from django.db import models
 from django.urls import reverse
 
 from apps.core.models import SignatureModel
+from apps.module import page_cache
 
 
 class FeeTypes(models.IntegerChoices):
@@ -74,6 +75,14 @@ class Fee(SignatureModel):
     def __str__(self):
         return str(self.description)
 
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        page_cache.invalidate([self.module_id])
+
+    def delete(self, *args, **kwargs):
+        page_cache.invalidate([self.module_id])
+        return super().delete(*args, **kwargs)
+
     def get_absolute_url(self):
         return reverse('fee:edit', args=[self.pk])
 
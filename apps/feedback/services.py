@@ -2,7 +2,6 @@ import datetime
 from pathlib import Path
 
 import xlwt
-from weasyprint import CSS, HTML
 
 from django.conf import settings
 from django.core import mail
@@ -13,6 +12,7 @@ from django.template.loader import render_to_string
 from django.utils.html import strip_tags
 from django.utils.text import slugify
 
+from apps.core.utils.html_pdf import render_pdf
 from apps.enrolment.models import CONFIRMED_STATUSES
 from apps.feedback.models import Feedback
 from apps.module.models import Module
@@ -197,6 +197,8 @@ def email_tutor_report(module: Module, tutor_ids: list) -> None:
         .prefetch_related('emails')
     )
     pdf_file_name = f"Feedback-report-{module.code}-{slugify(module.title)}.pdf"
+    # Every tutor gets the same report, so it's rendered (at most) once
+    content = None
 
     for tutor in tutors:
         tutor_firstname = tutor.firstname
@@ -225,12 +227,13 @@ def email_tutor_report(module: Module, tutor_ids: list) -> None:
             )
             email.content_subtype = 'html'
 
-            content = make_pdf(module=module)
+            if content is None:
+                content = make_pdf(module=module)
             email.attach(filename=pdf_file_name, content=content, mimetype='application/pdf')
             email.send()
 
 
-def make_pdf(*, module: Module) -> str:
+def make_pdf(*, module: Module) -> bytes:
     context = {
         'module': module,
         'module_summary': get_module_summary(module.id),
@@ -239,7 +242,7 @@ def make_pdf(*, module: Module) -> str:
         'comments_list': module.feedbackadmin_set.order_by('updated'),
     }
     html_doc = render_to_string('feedback/pdfs/module_feedback.html', context=context)
-    return HTML(string=html_doc).write_pdf(stylesheets=[CSS(f"{Path(__file__).parent}/static/css/pdf.css")])
+    return render_pdf(html_doc, stylesheets=[Path(__file__).parent / 'static/css/pdf.css'])
 
 
 def get_module_summary(module_id: int) -> dict:
@@ -1,12 +1,15 @@
+from unittest.mock import patch
+
 from django import test
 from django.core import mail
 from django.urls import reverse
 
 from apps.core.utils.tests import LoggedInMixin
 from apps.enrolment.tests.factories import EnrolmentFactory
+from apps.module.tests.factories import ModuleFactory
 from apps.student.tests.factories import EmailFactory
 
-from . import models
+from . import models, services
 
 
 class TestEmailing(LoggedInMixin, test.TestCase):
@@ -39,6 +42,17 @@ class TestEmailing(LoggedInMixin, test.TestCase):
         self.assertEqual(len(mail.outbox), 4)
 
 
+class TestTutorReport(test.TestCase):
+    def test_report_rendered_once(self):
+        module = ModuleFactory(email='fake@conted.ox.ac.uk')
+        emails = EmailFactory.create_batch(2, is_default=True)
+        with patch.object(services, 'make_pdf', return_value=b'%PDF') as make_pdf:
+            services.email_tutor_report(module, [email.student_id for email in emails])
+        make_pdf.assert_called_once_with(module=module)
+        self.assertEqual(len(mail.outbox), 2)
+        self.assertTrue(all(message.attachments for message in mail.outbox))
+
+
 class TestYearRangeMethod(test.TestCase):
     """Check that the query selects the right start and end dates"""
 
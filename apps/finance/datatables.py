@@ -86,7 +86,7 @@ class BatchFilter(filters.FilterSet):
     unbatched = filters.BooleanFilter(label='Unbatched items', method='filter_unbatched', widget=forms.CheckboxInput())
 
     class Meta:
-        model = models.Ledger
+        model = models.DailyCashTotal
         fields = ['created_by', 'batch', 'unbatched']
 
 
@@ -102,6 +102,6 @@ class BatchTable(tables.Table):
     type = tables.Column(verbose_name='Transaction type', accessor='type__description')
 
     class Meta:
-        model = models.Ledger
+        model = models.DailyCashTotal
         fields = ['created_by', 'type', 'batch', 'print_column']
         order_by = ['created_by', '-batch']
@@ -0,0 +1,97 @@
+"""Journal exports of the ledger for an accounting period, as CSV or XLSX.
+
+Ledger lines are read with `.iterator()`, and each format is written a row at a time (xlsxwriter in `constant_memory`
+mode), so memory use doesn't grow with the number of lines exported.
+"""
+from __future__ import annotations
+
+import csv
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from typing import Any, Callable, Iterator, Optional
+
+import xlsxwriter
+
+from django.conf import settings
+from django.db.models import QuerySet
+
+from . import models
+
+# Ledger lines fetched per query while exporting
+EXPORT_CHUNK_SIZE = 2000
+
+CSV = 'csv'
+XLSX = 'xlsx'
+FORMATS = [(CSV, 'CSV'), (XLSX, 'Excel (XLSX)')]
+
+COLUMNS: list[tuple[str, Callable[[models.Ledger], Any]]] = [
+    ('Date', lambda line: line.timestamp),
+    ('Allocation', lambda line: line.allocation),
+    ('Batch', lambda line: line.batch),
+    ('Account', lambda line: line.account_id),
+    ('Account description', lambda line: line.account.description),
+    ('Type', lambda line: line.type.description),
+    ('Finance code', lambda line: line.finance_code),
+    ('Narrative', lambda line: line.narrative),
+    ('Amount', lambda line: line.amount),
+    ('Enrolment', lambda line: line.enrolment_id),
+    ('Module code', lambda line: line.enrolment.module.code if line.enrolment else None),
+    ('Module title', lambda line: line.enrolment.module.title if line.enrolment else None),
+    ('Created by', lambda line: line.created_by),
+]
+
+
+def journal_lines(*, start: date, end: date, accounts: Optional[list[str]] = None) -> QuerySet:
+    """Ledger lines dated between `start` and `end` inclusive, optionally limited to some accounts"""
+    lines = (
+        models.Ledger.objects.filter(timestamp__gte=start, timestamp__lt=end + timedelta(days=1))
+        .select_related('type', 'account', 'enrolment__module')
+        .order_by('timestamp', 'id')
+    )
+    if accounts:
+        lines = lines.filter(account__in=accounts)
+    return lines
+
+
+def journal_rows(lines: QuerySet, *, progress: Callable[[int], None] = None) -> Iterator[list]:
+    """Yield a header row, then a row for each ledger line.  `progress` is called with the row count every chunk"""
+    yield [heading for heading, _ in COLUMNS]
+    for count, line in enumerate(lines.iterator(chunk_size=EXPORT_CHUNK_SIZE), start=1):
+        yield [value(line) for _, value in COLUMNS]
+        if progress and count % EXPORT_CHUNK_SIZE == 0:
+            progress(count)
+
+
+class _Echo:
+    """A file-like object which returns what's written to it, so csv.writer can produce strings for streaming"""
+
+    def write(self, value: str) -> str:
+        return value
+
+
+def stream_csv(lines: QuerySet) -> Iterator[str]:
+    """Yield the journal as CSV, a line at a time (e.g. for a StreamingHttpResponse)"""
+    writer = csv.writer(_Echo())
+    return (writer.writerow(row) for row in journal_rows(lines))
+
+
+def write_csv(lines: QuerySet, path: Path, *, progress: Callable[[int], None] = None) -> None:
+    with open(path, 'w', newline='') as file:
+        csv.writer(file).writerows(journal_rows(lines, progress=progress))
+
+
+def write_xlsx(lines: QuerySet, path: Path, *, progress: Callable[[int], None] = None) -> None:
+    # constant_memory flushes each row to disk once the next is started, so rows must be written in order
+    options = {'constant_memory': True, 'default_date_format': 'dd/mm/yyyy hh:mm'}
+    with xlsxwriter.Workbook(str(path), options) as workbook:
+        worksheet = workbook.add_worksheet('Journal')
+        for row_number, row in enumerate(journal_rows(lines, progress=progress)):
+            worksheet.write_row(row_number, 0, row)
+
+
+def export_root() -> Path:
+    return settings.PROTECTED_MEDIA_ROOT / 'finance' / 'journals'
+
+
+def export_filename(*, start: date, end: date, file_format: str, created_by: str) -> str:
+    return f'journal_{start:%Y-%m-%d}_{end:%Y-%m-%d}_{datetime.now():%Y%m%d%H%M%S}_{created_by}.{file_format}'
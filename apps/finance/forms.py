@@ -4,10 +4,10 @@ from decimal import Decimal
 
 from django import forms
 
-from apps.core.utils.widgets import PoundInput
+from apps.core.utils.widgets import DatePickerInput, PoundInput
 from apps.enrolment.models import Enrolment
 
-from . import models
+from . import exports, models
 
 
 class AddFeeForm(forms.ModelForm):
@@ -105,3 +105,21 @@ class TransferForm(forms.Form):
         )
         # Easier than subclassing ModelChoiceField solely for this
         self.fields['target_enrolment'].label_from_instance = lambda obj: f'{obj.module} ({obj.module.code})'
+
+
+class JournalExportForm(forms.Form):
+    submit_label = 'Export'
+
+    start_date = forms.DateField(widget=DatePickerInput())
+    end_date = forms.DateField(widget=DatePickerInput(), help_text='Inclusive')
+    accounts = forms.ModelMultipleChoiceField(
+        queryset=models.Account.objects.order_by('code'),  # Including the hidden control accounts
+        required=False,
+        help_text='Leave blank for all accounts',
+    )
+    file_format = forms.ChoiceField(choices=exports.FORMATS, label='Format')
+
+    def clean(self):
+        start_date, end_date = self.cleaned_data.get('start_date'), self.cleaned_data.get('end_date')
+        if start_date and end_date and end_date < start_date:
+            self.add_error('end_date', 'Must be on or after the start date')
@@ -0,0 +1,41 @@
+# Generated by Django 3.2.13 on 2026-10-18 08:32
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def populate_balances(apps, schema_editor):
+    Ledger = apps.get_model('finance', 'Ledger')
+    EnrolmentBalance = apps.get_model('finance', 'EnrolmentBalance')
+    balances = (
+        Ledger.objects.filter(account='Z300', enrolment__isnull=False)
+        .order_by()
+        .values_list('enrolment_id')
+        .annotate(total=models.Sum('amount'))
+    )
+    EnrolmentBalance.objects.bulk_create(
+        (EnrolmentBalance(enrolment_id=enrolment_id, balance=total) for enrolment_id, total in balances.iterator()),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('enrolment', '0008_data_futures_columns'),
+        ('finance', '0002_alter_ledger_options'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EnrolmentBalance',
+            fields=[
+                ('enrolment', models.OneToOneField(db_column='enrolment', on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='debtor_balance', serialize=False, to='enrolment.enrolment')),
+                ('balance', models.DecimalField(decimal_places=4, default=0, max_digits=19)),
+            ],
+            options={
+                'db_table': 'enrolment_balance',
+            },
+        ),
+        migrations.RunPython(populate_balances, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 3.2.13 on 2026-10-18 08:41
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('finance', '0003_enrolment_balance'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyCashTotal',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('batch', models.IntegerField(null=True)),
+                ('created_by', models.CharField(max_length=150, null=True)),
+                ('amount', models.DecimalField(decimal_places=4, max_digits=19)),
+                ('lines', models.IntegerField()),
+                ('last_ledger_id', models.IntegerField()),
+                ('account', models.ForeignKey(db_column='account', on_delete=django.db.models.deletion.CASCADE, to='finance.account')),
+                ('type', models.ForeignKey(db_column='type', on_delete=django.db.models.deletion.CASCADE, to='finance.transactiontype')),
+            ],
+            options={
+                'db_table': 'ledger_daily_cash_total',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='dailycashtotal',
+            index=models.Index(fields=['date', 'created_by'], name='daily_cash_total_date'),
+        ),
+    ]
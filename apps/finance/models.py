@@ -101,6 +101,53 @@ class Ledger(SignatureModel):
         )
 
 
+class EnrolmentBalance(models.Model):
+    """The debtor control balance of each enrolment, maintained alongside the ledger by `services.post_transactions`.
+    Drift from the ledger (e.g. rows written by other applications) is repaired nightly by `reconcile_balances`
+    """
+
+    enrolment = models.OneToOneField(
+        'enrolment.Enrolment',
+        models.CASCADE,
+        db_column='enrolment',
+        primary_key=True,
+        related_name='debtor_balance',
+    )
+    balance = models.DecimalField(max_digits=19, decimal_places=4, default=0)
+
+    class Meta:
+        db_table = 'enrolment_balance'
+
+
+class DailyCashTotalQuerySet(models.QuerySet):
+    def batched(self) -> models.QuerySet:
+        return self.filter(batch__isnull=False)
+
+    def unbatched(self) -> models.QuerySet:
+        return self.filter(batch__isnull=True)
+
+
+class DailyCashTotal(models.Model):
+    """A rollup of cash ledger lines, totalled by the day they were created, batch, type, account and creator.
+    Kept up to date by `services.update_cash_totals`, and read by the batch list views instead of the ledger
+    """
+
+    date = models.DateField()
+    batch = models.IntegerField(null=True)  # Unbatched lines (batch null or 0) are totalled together
+    type = models.ForeignKey('TransactionType', models.CASCADE, db_column='type')
+    account = models.ForeignKey('Account', models.CASCADE, db_column='account')
+    created_by = models.CharField(max_length=150, null=True)
+    amount = models.DecimalField(max_digits=19, decimal_places=4)
+    lines = models.IntegerField()
+    last_ledger_id = models.IntegerField()  # The latest ledger line included, for incremental updates
+
+    objects = DailyCashTotalQuerySet.as_manager()
+
+    class Meta:
+        db_table = 'ledger_daily_cash_total'
+        indexes = [models.Index(fields=['date', 'created_by'], name='daily_cash_total_date')]
+
+
 class Account(models.Model):
     code = models.CharField(primary_key=True, max_length=5)
     description = models.CharField(max_length=64)
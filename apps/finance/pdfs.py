@@ -4,7 +4,10 @@ import textwrap
 from datetime import datetime
 from typing import Optional
 
+from django.db.models import Max
+
 from apps.core.utils.legacy.fpdf import ContedPDF
+from apps.core.utils.pdf_cache import latest
 from apps.core.utils.postal import FormattedAddress
 from apps.invoice.models import Invoice
 from apps.student.models import Student
@@ -14,6 +17,15 @@ from . import models
 DATE_FORMAT = '%-d %b %Y'
 
 
+def receipt_modified(*, allocation: int, student: Student) -> Optional[datetime]:
+    """The latest change to a receipt's ledger lines, or the invoice or student address it's addressed to"""
+    lines = models.Ledger.objects.filter(allocation=allocation).aggregate(
+        created=Max('created_on'), modified=Max('modified_on'), invoice=Max('invoice_ledger__invoice__modified_on')
+    )
+    address = student.addresses.aggregate(modified=Max('modified_on'))
+    return latest(lines['created'], lines['modified'], lines['invoice'], address['modified'])
+
+
 def create_receipt(*, allocation: int, student: Optional[Student] = None) -> bytes:
     """Creates the context for rendering a receipt, then calls the rendering method.  Separation of argument logic from
     rendering will make for an easy move to weasyprint"""
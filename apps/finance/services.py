@@ -1,27 +1,40 @@
 from __future__ import annotations
 
+from collections import defaultdict
 from dataclasses import dataclass
-from datetime import datetime
+from datetime import date, datetime
 from decimal import Decimal
-from typing import Any, Optional
+from typing import Any, Iterable, Optional
 
-from django.db import transaction
+from django.db import IntegrityError, transaction
+from django.db.models import Case, Count, DecimalField, F, Max, QuerySet, Sum, Value, When
+from django.db.models.functions import TruncDate
 
+from apps.booking import services as booking_services
 from apps.booking.models import Accommodation, Catering
 from apps.core.models import User
-from apps.core.utils.db import next_in_sequence
+from apps.core.utils.db import next_in_sequence, next_values_in_sequence
 from apps.enrolment.models import Enrolment
 from apps.fee.models import Fee
-from apps.module.models import Module
 
 from . import models
 
+# Ledger amounts are stored to 4 decimal places
+AMOUNT_PRECISION = Decimal('0.0001')
+# Rows per query when repairing balances or totals, to stay well within SQL Server's parameter limit
+RECONCILE_CHUNK_SIZE = 1000
+
 
 def next_allocation() -> int:
     """Return the next allocation number available for use"""
     return next_in_sequence('ledger_allocation_sequence')
 
 
+def next_allocations(count: int) -> list[int]:
+    """Reserve a number of allocations at once"""
+    return next_values_in_sequence('ledger_allocation_sequence', count)
+
+
 def next_batch() -> int:
     """Return the next batch available for use"""
     return next_in_sequence('ledger_batch_sequence')
@@ -30,7 +43,7 @@ def next_batch() -> int:
 @dataclass
 class Transaction:
     """Holds both sides of a double-sided ledger transaction, to act as a useful return value.
-    All functions calling _insert_account_line and _insert_debtor_line should return a Transaction
+    All functions posting to the ledger should return a Transaction
     """
 
     allocation: int
@@ -38,7 +51,73 @@ class Transaction:
     debtor_lines: list[models.Ledger]
 
 
-def _insert_account_line(
+@dataclass
+class DebtorLine:
+    """The debtors' control (Z300) side of a posting, for a single enrolment.
+    +ive amount increases debt owing (fees), -ive amount decreases debt owing (payment)
+    """
+
+    amount: Decimal
+    enrolment_id: Optional[int] = None
+    finance_code: Optional[str] = None  # If not given, the enrolment's module's finance code is used
+
+
+@dataclass
+class Posting:
+    """A double-sided transaction: one or more debtor lines, balanced by a single line posted to `account_code`"""
+
+    account_code: str
+    narrative: str
+    type_id: int
+    debtor_lines: list[DebtorLine]
+    account_enrolment_id: Optional[int] = None
+    account_finance_code: Optional[str] = None  # As for debtor lines, defaults to the enrolment's finance code
+    ref_no: Optional[str] = None
+    timestamp: Optional[datetime] = None
+
+    @classmethod
+    def single(
+        cls,
+        *,
+        account_code: str,
+        amount: Decimal,
+        finance_code: Optional[str],
+        narrative: str,
+        type_id: int,
+        enrolment_id: Optional[int] = None,
+        ref_no: Optional[str] = None,
+        timestamp: Optional[datetime] = None,
+    ) -> Posting:
+        """A posting with a single debtor line, where both sides share the enrolment and finance code"""
+        return cls(
+            account_code=account_code,
+            narrative=narrative,
+            type_id=type_id,
+            debtor_lines=[DebtorLine(amount=amount, enrolment_id=enrolment_id, finance_code=finance_code)],
+            account_enrolment_id=enrolment_id,
+            account_finance_code=finance_code,
+            ref_no=ref_no,
+            timestamp=timestamp,
+        )
+
+
+def _finance_codes(postings: list[Posting]) -> dict[int, Optional[str]]:
+    """Look up the module finance code of every enrolment in the postings lacking one, in a single query"""
+    enrolment_ids = set()
+    for posting in postings:
+        enrolment_ids.update(line.enrolment_id for line in posting.debtor_lines if line.finance_code is None)
+        if posting.account_finance_code is None:
+            enrolment_ids.add(posting.account_enrolment_id)
+    enrolment_ids.discard(None)
+    if not enrolment_ids:
+        return {}
+    return {
+        enrolment.id: enrolment.module.finance_code
+        for enrolment in Enrolment.objects.filter(id__in=enrolment_ids).select_related('module')
+    }
+
+
+def _ledger_line(
     *,
     account_code: str,
     amount: Decimal,
@@ -48,13 +127,12 @@ def _insert_account_line(
     type_id: int,
     timestamp: datetime,
     allocation: int,
-    enrolment_id: Optional[int] = None,
-    ref_no: str = None,
+    enrolment_id: Optional[int],
+    ref_no: Optional[str],
 ) -> models.Ledger:
-    """Produces the debtor side of a double-sided transaction"""
-    return models.Ledger.objects.create(
+    return models.Ledger(
         account_id=account_code,
-        amount=-amount,  # Note the negative
+        amount=amount,
         allocation=allocation,
         enrolment_id=enrolment_id,
         finance_code=finance_code,
@@ -67,35 +145,232 @@ def _insert_account_line(
     )
 
 
-def _insert_debtor_line(
-    *,
-    amount: Decimal,
-    user: User,
-    finance_code: Optional[str],
-    narrative: str,
-    type_id: int,
-    timestamp: datetime,
-    allocation: int,
-    enrolment_id: Optional[int] = None,
-    ref_no: str = None,
-) -> models.Ledger:
-    """Produces the account side of a double-sided transaction"""
-    return models.Ledger.objects.create(
-        account_id=models.Accounts.DEBTOR,
-        amount=amount,  # Note the positive
-        allocation=allocation,
-        enrolment_id=enrolment_id,
-        finance_code=finance_code,
-        narrative=narrative,
-        ref_no=ref_no,
-        timestamp=timestamp,
-        type_id=type_id,
-        created_by=user.username,
-        modified_by=user.username,
+def _read_primary_keys(lines: list[models.Ledger]) -> None:
+    """Set the ids of bulk-created lines (which not all backends return), by matching on their content"""
+
+    def key(allocation: int, account_id: str, enrolment_id: Optional[int], amount: Decimal) -> tuple:
+        return allocation, account_id, enrolment_id, Decimal(amount).quantize(AMOUNT_PRECISION)
+
+    saved: defaultdict[tuple, list[int]] = defaultdict(list)
+    rows = (
+        models.Ledger.objects.filter(allocation__in={line.allocation for line in lines})
+        .order_by('id')
+        .values_list('id', 'allocation', 'account_id', 'enrolment_id', 'amount')
+    )
+    for pk, *content in rows:
+        saved[key(*content)].append(pk)
+    for line in lines:
+        # Lines with identical content are interchangeable, so are given ids in order
+        line.pk = saved[key(line.allocation, line.account_id, line.enrolment_id, line.amount)].pop(0)
+        line._state.adding = False
+        line._state.db = rows.db
+
+
+def _ledger_balances(enrolment_ids: Optional[list[int]] = None) -> dict[int, Decimal]:
+    """Aggregate debtor control balances from the ledger, for all enrolments or only those given"""
+    lines = models.Ledger.objects.debts().filter(enrolment__isnull=False)
+    if enrolment_ids is not None:
+        lines = lines.filter(enrolment_id__in=enrolment_ids)
+    return dict(lines.order_by().values_list('enrolment_id').annotate(total=Sum('amount')))
+
+
+def adjust_balances(deltas: dict[int, Decimal]) -> None:
+    """Apply changes to enrolments' maintained balances, in the same transaction as the ledger write causing them.
+
+    Existing balances are updated in a single statement, which is safe against concurrent postings.  Enrolments
+    without a balance row get one calculated from the ledger, so the ledger must already include the new lines
+    """
+    if not deltas:
+        return
+    balances = models.EnrolmentBalance.objects.filter(enrolment_id__in=deltas)
+    missing = set(deltas) - set(balances.values_list('enrolment_id', flat=True))
+    if missing:
+        try:
+            with transaction.atomic():
+                models.EnrolmentBalance.objects.bulk_create(
+                    models.EnrolmentBalance(enrolment_id=enrolment_id, balance=balance)
+                    for enrolment_id, balance in _ledger_balances(list(missing)).items()
+                )
+        except IntegrityError:
+            # A concurrent posting created some of the rows first (without our lines), so start again, updating them
+            return adjust_balances(deltas)
+
+    if len(missing) < len(deltas):
+        balances.exclude(enrolment_id__in=missing).update(
+            balance=F('balance')
+            + Case(
+                *(When(enrolment_id=enrolment_id, then=Value(delta)) for enrolment_id, delta in deltas.items()),
+                default=Value(Decimal(0)),
+                output_field=DecimalField(max_digits=19, decimal_places=4),
+            )
+        )
+
+
+def _balance_deltas(lines: list[models.Ledger]) -> dict[int, Decimal]:
+    """The change each set of ledger lines makes to its enrolments' balances"""
+    deltas: defaultdict[int, Decimal] = defaultdict(Decimal)
+    for line in lines:
+        if line.account_id == models.Accounts.DEBTOR and line.enrolment_id is not None:
+            deltas[line.enrolment_id] += Decimal(line.amount)
+    return deltas
+
+
+@transaction.atomic
+def refresh_balances(enrolment_ids: list[int]) -> None:
+    """Recalculate enrolments' maintained balances from the ledger"""
+    # Lock the rows first, so postings can't change them between the recalculation and the update
+    stored = {
+        balance.enrolment_id: balance
+        for balance in models.EnrolmentBalance.objects.select_for_update().filter(enrolment_id__in=enrolment_ids)
+    }
+    recalculated = _ledger_balances(enrolment_ids)
+    for balance in stored.values():
+        balance.balance = recalculated.get(balance.enrolment_id, Decimal(0))
+    models.EnrolmentBalance.objects.bulk_update(stored.values(), fields=['balance'])
+    models.EnrolmentBalance.objects.bulk_create(
+        models.EnrolmentBalance(enrolment_id=enrolment_id, balance=balance)
+        for enrolment_id, balance in recalculated.items()
+        if enrolment_id not in stored
     )
 
 
+def reconcile_balances() -> list[int]:
+    """Check every maintained balance against a full recompute from the ledger, repairing any which have drifted.
+    Returns the ids of the repaired enrolments
+    """
+    recalculated = _ledger_balances()
+    stored = dict(models.EnrolmentBalance.objects.values_list('enrolment_id', 'balance'))
+    drifted = sorted(
+        enrolment_id
+        for enrolment_id in recalculated.keys() | stored.keys()
+        if recalculated.get(enrolment_id, 0) != stored.get(enrolment_id, 0)
+    )
+    for start in range(0, len(drifted), RECONCILE_CHUNK_SIZE):
+        refresh_balances(drifted[start : start + RECONCILE_CHUNK_SIZE])
+    return drifted
+
+
+def _cash_totals(lines: QuerySet) -> list[models.DailyCashTotal]:
+    """Total cash ledger lines by day, batch, type, account and creator, in a single query"""
+    groups = (
+        lines.filter(created_on__isnull=False)
+        .order_by()
+        .annotate(date=TruncDate('created_on'))
+        .values('date', 'batch', 'type', 'account', 'created_by')
+        .annotate(amount=Sum('amount'), lines=Count('id'), last_ledger_id=Max('id'))
+    )
+    totals: dict[tuple, models.DailyCashTotal] = {}
+    for group in groups:
+        # Both null and 0 mean unbatched, so are combined
+        key = (group['date'], group['batch'] or None, group['type'], group['account'], group['created_by'])
+        total = totals.get(key)
+        if total is None:
+            totals[key] = models.DailyCashTotal(
+                date=key[0],
+                batch=key[1],
+                type_id=key[2],
+                account_id=key[3],
+                created_by=key[4],
+                amount=group['amount'],
+                lines=group['lines'],
+                last_ledger_id=group['last_ledger_id'],
+            )
+        else:
+            total.amount += group['amount']
+            total.lines += group['lines']
+            total.last_ledger_id = max(total.last_ledger_id, group['last_ledger_id'])
+    return list(totals.values())
+
+
+@transaction.atomic
+def refresh_cash_totals(days: Iterable[date]) -> None:
+    """Rebuild the daily cash totals for the given days from the ledger"""
+    days = sorted(set(days))
+    # Chunked, since the first update covers every day in the ledger
+    for start in range(0, len(days), RECONCILE_CHUNK_SIZE):
+        chunk = days[start : start + RECONCILE_CHUNK_SIZE]
+        models.DailyCashTotal.objects.filter(date__in=chunk).delete()
+        models.DailyCashTotal.objects.bulk_create(
+            _cash_totals(models.Ledger.objects.cash().filter(created_on__date__in=chunk))
+        )
+
+
+def update_cash_totals() -> list[date]:
+    """Refresh the daily cash totals for every day with cash lines added since the last update, and today.
+    Today is always included, in case earlier ids were committed after later ones.  Returns the days refreshed
+    """
+    last_ledger_id = models.DailyCashTotal.objects.aggregate(Max('last_ledger_id'))['last_ledger_id__max'] or 0
+    days = {*models.Ledger.objects.cash().filter(id__gt=last_ledger_id).dates('created_on', 'day'), date.today()}
+    refresh_cash_totals(days)
+    return sorted(days)
+
+
 @transaction.atomic
+def create_batch(*, type_id: int, created_by: str) -> int:
+    """Assign a new batch number to a user's unbatched cash lines of a type, returning the batch"""
+    batch = next_batch()
+    lines = models.Ledger.objects.unbatched().filter(created_by=created_by, type_id=type_id)
+    days = list(lines.dates('created_on', 'day'))
+    lines.update(batch=batch)
+    refresh_cash_totals(days)
+    return batch
+
+
+@transaction.atomic
+def post_transactions(postings: list[Posting], *, user: User) -> list[Transaction]:
+    """Post a number of double-sided transactions together.
+
+    Finance codes are looked up in a single query, allocations are reserved in a single round trip, every ledger
+    line is written with a single bulk insert, and enrolment balances are updated to match.  Returns a Transaction for
+    each posting, in order
+    """
+    if not postings:
+        return []
+    finance_codes = _finance_codes(postings)
+    allocations = next_allocations(len(postings))
+    now = datetime.now()
+
+    transactions = []
+    for posting, allocation in zip(postings, allocations):
+        common: dict[str, Any] = {
+            'allocation': allocation,
+            'narrative': posting.narrative,
+            'ref_no': posting.ref_no,
+            'timestamp': posting.timestamp or now,  # identical timestamp for all rows
+            'type_id': posting.type_id,
+            'user': user,
+        }
+        debtor_lines = [
+            _ledger_line(
+                account_code=models.Accounts.DEBTOR,
+                amount=line.amount,  # Note the positive
+                enrolment_id=line.enrolment_id,
+                finance_code=finance_codes.get(line.enrolment_id) if line.finance_code is None else line.finance_code,
+                **common,
+            )
+            for line in posting.debtor_lines
+        ]
+        account_line = _ledger_line(
+            account_code=posting.account_code,
+            amount=-sum(line.amount for line in posting.debtor_lines),  # Note the negative
+            enrolment_id=posting.account_enrolment_id,
+            finance_code=(
+                finance_codes.get(posting.account_enrolment_id)
+                if posting.account_finance_code is None
+                else posting.account_finance_code
+            ),
+            **common,
+        )
+        transactions.append(Transaction(allocation, account_line, debtor_lines))
+
+    lines = [line for posted in transactions for line in (posted.account_line, *posted.debtor_lines)]
+    models.Ledger.objects.bulk_create(lines)
+    if any(line.pk is None for line in lines):
+        _read_primary_keys(lines)
+    adjust_balances(_balance_deltas(lines))
+    return transactions
+
+
 def insert_ledger(
     *,
     account_code: str,
@@ -111,33 +386,17 @@ def insert_ledger(
     """Creates a double-sided transaction: posting to an account and debtors' control (Z300) at the same time.
     +ive amount increases debt owing (fees), -ive amount decreases debt owing(payment)
     """
-
-    # Get a ledger allocation
-    allocation = next_allocation()
-    if not timestamp:
-        timestamp = datetime.now()
-    common: dict[str, Any] = {
-        'allocation': allocation,
-        'enrolment_id': enrolment_id,
-        'finance_code': finance_code,
-        'narrative': narrative,
-        'ref_no': ref_no,
-        'timestamp': timestamp,
-        'type_id': type_id,
-        'user': user,
-    }
-
-    # Create the entries
-    account_line = _insert_account_line(
+    posting = Posting.single(
         account_code=account_code,
         amount=amount,
-        **common,
-    )
-    debtor_line = _insert_debtor_line(
-        amount=amount,
-        **common,
+        finance_code=finance_code,
+        narrative=narrative,
+        type_id=type_id,
+        enrolment_id=enrolment_id,
+        ref_no=ref_no,
+        timestamp=timestamp,
     )
-    return Transaction(allocation, account_line, [debtor_line])
+    return post_transactions([posting], user=user)[0]
 
 
 @transaction.atomic
@@ -166,11 +425,13 @@ def add_enrolment_fee(*, enrolment_id: int, fee_id: int, discount: int = 0, user
 
     # If the fee is accomodation-related, add in an accommodation line.
     if fee.is_single_accom or fee.is_twin_accom:
-        Accommodation.objects.create(
-            type=Accommodation.Types.SINGLE if fee.is_single_accom else Accommodation.Types.TWIN,
-            limit=fee.limit,
-            enrolment_id=enrolment_id,
-            **signature_fields,
+        booking_services.save_accommodation(
+            Accommodation(
+                type=Accommodation.Types.SINGLE if fee.is_single_accom else Accommodation.Types.TWIN,
+                limit=fee.limit,
+                enrolment_id=enrolment_id,
+                **signature_fields,
+            )
         )
     return ledger_transaction
 
@@ -194,37 +455,19 @@ def add_distributed_payment(
     if amount != total:
         raise DistributedPaymentTotalError(f"Total does not match: {amount} vs {total}")
 
-    allocation = next_allocation()
-    if not timestamp:
-        timestamp = datetime.now()  # identical timestamp for all rows
-
-    debtor_lines = []
-    for enrolment_id, sub_amount in enrolments.items():
-        finance_code = Module.objects.get(enrolment__id=enrolment_id).finance_code
-        line = _insert_debtor_line(
-            finance_code=finance_code,
-            narrative=narrative,
-            amount=-sub_amount,
-            type_id=type_id,
-            allocation=allocation,
-            enrolment_id=enrolment_id,
-            user=user,
-            timestamp=timestamp,
-        )
-        debtor_lines.append(line)
-
-    # Corresponding total
-    account_line = _insert_account_line(
+    posting = Posting(
         account_code=models.Accounts.CASH,
-        finance_code='',
+        account_finance_code='',
         narrative=narrative,
-        amount=-amount,
         type_id=type_id,
-        allocation=allocation,
-        user=user,
+        # Each enrolment's line takes its module's finance code
+        debtor_lines=[
+            DebtorLine(amount=-sub_amount, enrolment_id=enrolment_id)
+            for enrolment_id, sub_amount in enrolments.items()
+        ],
         timestamp=timestamp,
     )
-    return Transaction(allocation, account_line, debtor_lines)
+    return post_transactions([posting], user=user)[0]
 
 
 @transaction.atomic
@@ -241,21 +484,25 @@ def transfer_funds(
     common_args: dict[str, Any] = {
         'account_code': models.Accounts.CASH,
         'narrative': narrative,
-        'user': user,
         'type_id': type_id,
         'timestamp': datetime.now(),
     }
-    # Source enrolment lines
-    insert_ledger(
-        finance_code=source_enrolment.module.finance_code,
-        amount=amount,
-        enrolment_id=source_enrolment.id,
-        **common_args,
-    )
-    # Target enrolment lines
-    insert_ledger(
-        finance_code=target_enrolment.module.finance_code,
-        amount=-amount,
-        enrolment_id=target_enrolment.id,
-        **common_args,
+    post_transactions(
+        [
+            # Source enrolment lines
+            Posting.single(
+                finance_code=source_enrolment.module.finance_code,
+                amount=amount,
+                enrolment_id=source_enrolment.id,
+                **common_args,
+            ),
+            # Target enrolment lines
+            Posting.single(
+                finance_code=target_enrolment.module.finance_code,
+                amount=-amount,
+                enrolment_id=target_enrolment.id,
+                **common_args,
+            ),
+        ],
+        user=user,
     )
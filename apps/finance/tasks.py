@@ -0,0 +1,48 @@
+from datetime import date
+
+from celery_progress.backend import ProgressRecorder
+
+from django.urls import reverse
+
+from apps.core.utils.celery import mail_on_failure
+from redpot.celery import app
+
+from . import exports, services
+
+
+@app.task(name='reconcile_enrolment_balances')
+@mail_on_failure
+def reconcile_enrolment_balances() -> list[int]:
+    """Nightly check of the maintained enrolment balances against the ledger, repairing any drift.
+    Returns the ids of enrolments whose balances were repaired
+    """
+    return services.reconcile_balances()
+
+
+@app.task(name='update_daily_cash_totals')
+@mail_on_failure
+def update_daily_cash_totals() -> list[str]:
+    """Bring the daily cash totals used by the batch views up to date with new ledger lines.
+    Returns the days refreshed
+    """
+    return [day.isoformat() for day in services.update_cash_totals()]
+
+
+@app.task(name='export_ledger_journal', bind=True)
+def export_journal(self, *, start: str, end: str, accounts: list[str], file_format: str, created_by: str):
+    """Write the ledger lines for a period (given as ISO dates) to a journal file, for download"""
+    recorder = ProgressRecorder(self)
+    start_date, end_date = date.fromisoformat(start), date.fromisoformat(end)
+    lines = exports.journal_lines(start=start_date, end=end_date, accounts=accounts)
+    total = lines.count()
+
+    root = exports.export_root()
+    root.mkdir(parents=True, exist_ok=True)
+    filename = exports.export_filename(start=start_date, end=end_date, file_format=file_format, created_by=created_by)
+    writer = exports.write_xlsx if file_format == exports.XLSX else exports.write_csv
+    writer(
+        lines,
+        root / filename,
+        progress=lambda count: recorder.set_progress(current=count, total=total, description='Exporting ledger'),
+    )
+    return {'redirect': reverse('finance:download-journal', kwargs={'filename': filename})}
@@ -2,7 +2,7 @@ import factory
 
 from apps.enrolment.tests.factories import EnrolmentFactory
 
-from .. import models
+from .. import models, services
 
 
 class LedgerFactory(factory.django.DjangoModelFactory):
@@ -15,3 +15,11 @@ class LedgerFactory(factory.django.DjangoModelFactory):
     type_id = models.TransactionTypes.FEE
     allocation = 1
     account_id = models.Accounts.DEBTOR  # todo: We may want a FeeFactory and PaymentFactory instead
+
+    @classmethod
+    def _create(cls, model_class, *args, **kwargs):
+        # Rows created directly bypass finance.services, so bring the enrolment's maintained balance up to date
+        ledger = super()._create(model_class, *args, **kwargs)
+        if ledger.enrolment_id:
+            services.refresh_balances([ledger.enrolment_id])
+        return ledger
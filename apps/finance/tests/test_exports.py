@@ -0,0 +1,67 @@
+import tempfile
+import zipfile
+from datetime import date, datetime
+from decimal import Decimal
+from pathlib import Path
+from unittest.mock import Mock, patch
+
+from django import test
+from django.contrib.auth import get_user_model
+
+from apps.enrolment.tests.factories import EnrolmentFactory
+
+from .. import exports, models, services, tasks
+
+
+class TestJournalExport(test.TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        user = get_user_model().objects.create_user(username='testuser')
+        enrolment = EnrolmentFactory()
+        for day in [1, 15, 31]:
+            services.insert_ledger(
+                account_code=models.Accounts.TUITION,
+                amount=Decimal(10),
+                finance_code='ABCDE',
+                narrative='Journal test',
+                type_id=models.TransactionTypes.FEE,
+                enrolment_id=enrolment.id,
+                user=user,
+                timestamp=datetime(2022, 1, day, 12),
+            )
+
+    def test_period_inclusive(self):
+        lines = exports.journal_lines(start=date(2022, 1, 15), end=date(2022, 1, 31))
+        self.assertEqual(lines.count(), 4)  # both sides of two transactions
+
+    def test_csv_matches_lines(self):
+        lines = exports.journal_lines(start=date(2022, 1, 1), end=date(2022, 1, 31), accounts=[models.Accounts.DEBTOR])
+        rows = list(exports.stream_csv(lines))
+        self.assertEqual(len(rows), 4)
+        self.assertTrue(rows[1].startswith('2022-01-01 12:00:00,'))
+
+    def test_xlsx_written_with_progress(self):
+        lines = exports.journal_lines(start=date(2022, 1, 1), end=date(2022, 1, 31))
+        progress = Mock()
+        with tempfile.TemporaryDirectory() as directory:
+            path = Path(directory) / 'journal.xlsx'
+            with patch.object(exports, 'EXPORT_CHUNK_SIZE', 2):
+                exports.write_xlsx(lines, path, progress=progress)
+            with zipfile.ZipFile(path) as workbook:
+                sheet = workbook.read('xl/worksheets/sheet1.xml').decode()
+        self.assertEqual(sheet.count('<row '), 7)  # a header, and six lines
+        self.assertEqual([call.args[0] for call in progress.call_args_list], [2, 4, 6])
+
+    def test_task_saves_file(self):
+        with tempfile.TemporaryDirectory() as directory, test.override_settings(PROTECTED_MEDIA_ROOT=Path(directory)):
+            result = tasks.export_journal.apply(
+                kwargs={
+                    'start': '2022-01-01',
+                    'end': '2022-01-31',
+                    'accounts': [],
+                    'file_format': exports.CSV,
+                    'created_by': 'testuser',
+                }
+            ).get()
+            filename = result['redirect'].rsplit('/', 1)[-1]
+            self.assertEqual(len((exports.export_root() / filename).read_text().splitlines()), 7)
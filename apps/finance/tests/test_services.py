@@ -1,8 +1,12 @@
+from datetime import date, datetime
 from decimal import Decimal
 
 from django import test
 from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 
+from apps.enrolment.models import Enrolment
 from apps.enrolment.tests.factories import EnrolmentFactory
 from apps.fee.tests.factories import FeeFactory
 
@@ -27,6 +31,45 @@ class TestInsertLedger(test.TestCase):
         self.assertEqual(models.Ledger.objects.total(), 0)
 
 
+class TestPostTransactions(test.TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user(username='testuser')
+
+    def _post(self, enrolments: list) -> tuple[list[services.Transaction], int]:
+        postings = [
+            services.Posting(
+                account_code=models.Accounts.CASH,
+                narrative='Test payment',
+                type_id=models.TransactionTypes.CREDIT_CARD,
+                debtor_lines=[services.DebtorLine(amount=Decimal(-10), enrolment_id=enrolment.id)],
+            )
+            for enrolment in enrolments
+        ]
+        with CaptureQueriesContext(connection) as context:
+            transactions = services.post_transactions(postings, user=self.user)
+        return transactions, len(context)
+
+    def test_query_count_independent_of_postings(self):
+        _, single = self._post(EnrolmentFactory.create_batch(size=1))
+        _, many = self._post(EnrolmentFactory.create_batch(size=10))
+        self.assertEqual(single, many)
+
+    def test_transactions_match_ledger(self):
+        enrolments = EnrolmentFactory.create_batch(size=3)
+        transactions, _ = self._post(enrolments)
+
+        self.assertEqual(len({transaction.allocation for transaction in transactions}), 3)
+        for enrolment, transaction in zip(enrolments, transactions):
+            debtor_line = models.Ledger.objects.get(pk=transaction.debtor_lines[0].pk)
+            self.assertEqual(debtor_line.enrolment, enrolment)
+            self.assertEqual(debtor_line.finance_code, enrolment.module.finance_code)
+            self.assertEqual(debtor_line.allocation, transaction.allocation)
+            account_line = models.Ledger.objects.get(pk=transaction.account_line.pk)
+            self.assertEqual((account_line.account_id, account_line.amount), (models.Accounts.CASH, 10))
+        self.assertEqual(models.Ledger.objects.total(), 0)
+
+
 class TestAddEnrolmentFee(test.TestCase):
     @classmethod
     def setUpTestData(cls):
@@ -103,3 +146,101 @@ class TestTransferFunds(test.TestCase):
         )
         self.assertEqual(source.get_balance(), 100)
         self.assertEqual(target.get_balance(), -100)
+
+
+class TestEnrolmentBalances(test.TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user(username='testuser')
+
+    def _post(self, enrolment, amount: Decimal) -> None:
+        services.insert_ledger(
+            account_code=models.Accounts.TUITION,
+            amount=amount,
+            finance_code='ABCDE',
+            narrative='Test fee',
+            type_id=models.TransactionTypes.FEE,
+            enrolment_id=enrolment.id,
+            user=self.user,
+        )
+
+    def _with_balance(self, enrolment) -> Decimal:
+        return Enrolment.objects.with_balance().get(pk=enrolment.pk).balance
+
+    def test_postings_maintain_balance(self):
+        enrolment = EnrolmentFactory()
+        self._post(enrolment, Decimal(100))
+        self._post(enrolment, Decimal(-30))
+        self.assertEqual(self._with_balance(enrolment), 70)
+        self.assertEqual(
+            self._with_balance(enrolment), Enrolment.objects.with_ledger_balance().get(pk=enrolment.pk).balance
+        )
+        self.assertQuerysetEqual(Enrolment.objects.outstanding(), [enrolment])
+
+    def test_reconcile_repairs_drift(self):
+        enrolment, untouched = EnrolmentFactory.create_batch(size=2)
+        self._post(enrolment, Decimal(100))
+        self._post(untouched, Decimal(50))
+        # A line written by another application, bypassing services
+        models.Ledger.objects.create(
+            account_id=models.Accounts.DEBTOR,
+            amount=Decimal(-100),
+            allocation=1,
+            enrolment=enrolment,
+            narrative='Payment',
+            timestamp=datetime.now(),
+            type_id=models.TransactionTypes.CREDIT_CARD,
+        )
+        self.assertEqual(self._with_balance(enrolment), 100)
+
+        self.assertEqual(services.reconcile_balances(), [enrolment.id])
+        self.assertEqual(self._with_balance(enrolment), 0)
+        self.assertEqual(self._with_balance(untouched), 50)
+        self.assertEqual(services.reconcile_balances(), [])
+
+    def test_reconcile_creates_missing_balances(self):
+        enrolment = EnrolmentFactory()
+        self._post(enrolment, Decimal(100))
+        models.EnrolmentBalance.objects.all().delete()
+
+        self.assertEqual(services.reconcile_balances(), [enrolment.id])
+        self.assertEqual(enrolment.get_balance(), 100)
+
+
+class TestDailyCashTotals(test.TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user(username='testuser')
+
+    def _pay(self, amount: Decimal) -> services.Transaction:
+        return services.add_distributed_payment(
+            narrative='Payment',
+            amount=amount,
+            type_id=models.TransactionTypes.CREDIT_CARD,
+            user=self.user,
+            enrolments={EnrolmentFactory().id: amount},
+        )
+
+    def _totals(self) -> dict:
+        return {
+            (total.batch, total.account_id): (total.amount, total.lines)
+            for total in models.DailyCashTotal.objects.filter(date=date.today())
+        }
+
+    def test_incremental_update(self):
+        self._pay(Decimal(10))
+        services.update_cash_totals()
+        self._pay(Decimal(5))
+        # Legacy unbatched lines use 0, and are totalled with nulls
+        models.Ledger.objects.update(batch=0)
+        self.assertEqual(services.update_cash_totals(), [date.today()])
+        self.assertEqual(
+            self._totals(),
+            {(None, models.Accounts.CASH): (15, 2), (None, models.Accounts.DEBTOR): (-15, 2)},
+        )
+
+    def test_create_batch(self):
+        self._pay(Decimal(10))
+        services.update_cash_totals()
+        batch = services.create_batch(type_id=models.TransactionTypes.CREDIT_CARD, created_by=self.user.username)
+        self.assertEqual(set(self._totals()), {(batch, models.Accounts.CASH), (batch, models.Accounts.DEBTOR)})
@@ -1,14 +1,18 @@
+import csv
+import io
+from datetime import datetime
 from decimal import Decimal
+from unittest.mock import patch
 from urllib.parse import urlencode
 
-from django import test
+from django import http, test
 from django.urls import reverse
 
 from apps.core.utils.tests import LoggedInMixin, LoggedInViewTestMixin
 from apps.enrolment.tests.factories import EnrolmentFactory
 from apps.fee.tests.factories import FeeFactory
 
-from .. import models, services
+from .. import models, services, tasks
 
 
 class TestAddFeesView(LoggedInViewTestMixin, test.TestCase):
@@ -142,6 +146,11 @@ class TestReceiptPDF(LoggedInViewTestMixin, test.TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response['content-type'], 'application/pdf')
 
+    def test_repeat_fetch_not_modified(self):
+        last_modified = self.client.get(self.get_url())['Last-Modified']
+        response = self.client.get(self.get_url(), HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 304)
+
 
 class TestBatchViews(LoggedInMixin, test.TestCase):
     superuser = True
@@ -157,6 +166,7 @@ class TestBatchViews(LoggedInMixin, test.TestCase):
             narrative='test narrative',
             type_id=models.TransactionTypes.CREDIT_CARD,
         )
+        services.update_cash_totals()
 
     def test_my_batches(self):
         """Check that the unbatched type is displayed"""
@@ -182,8 +192,73 @@ class TestBatchViews(LoggedInMixin, test.TestCase):
         )
         self.transaction.account_line.refresh_from_db()
         self.assertIsNotNone(self.transaction.account_line.batch)
+        # The batch list reads the updated totals
+        response = self.client.get(reverse('finance:all-batches'), data={'unbatched': False})
+        self.assertContains(response, 'Credit card')
 
     def test_print_batch(self):
         models.Ledger.objects.filter(allocation=self.transaction.allocation).update(batch=1)
         response = self.client.get(reverse('finance:print-batch', kwargs={'batch': 1}))
         self.assertContains(response, 'test narrative')
+
+
+class TestDeleteTransactionView(LoggedInMixin, test.TestCase):
+    superuser = True
+
+    def test_delete_updates_balance(self):
+        enrolment = EnrolmentFactory()
+        transaction = services.insert_ledger(
+            account_code=models.Accounts.TUITION,
+            amount=Decimal(100),
+            finance_code='ABCDE',
+            narrative='Test fee',
+            type_id=models.TransactionTypes.FEE,
+            enrolment_id=enrolment.id,
+            user=self.user,
+        )
+        url = reverse('finance:delete-transaction', args=[transaction.allocation])
+        response = self.client.post(f'{url}?{urlencode({"next": enrolment.get_absolute_url()})}')
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(enrolment.get_balance(), 0)
+
+
+class TestJournalExportView(LoggedInViewTestMixin, test.TestCase):
+    superuser = True
+    url = reverse('finance:export-journal')
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.enrolment = EnrolmentFactory()
+        for amount in [Decimal(100), Decimal(-40)]:
+            services.insert_ledger(
+                account_code=models.Accounts.TUITION,
+                amount=amount,
+                finance_code='ABCDE',
+                narrative='Journal test',
+                type_id=models.TransactionTypes.FEE,
+                enrolment_id=cls.enrolment.id,
+                user=cls.user,
+                timestamp=datetime(2022, 3, 15),
+            )
+
+    def _post(self, **data) -> http.HttpResponse:
+        return self.client.post(
+            self.get_url(), data={'start_date': '01/03/2022', 'end_date': '31/03/2022', 'file_format': 'csv', **data}
+        )
+
+    def test_csv_streamed(self):
+        response = self._post(accounts=[models.Accounts.DEBTOR])
+        self.assertTrue(response.streaming)
+        rows = list(csv.reader(io.StringIO(b''.join(response.streaming_content).decode())))
+        self.assertEqual(rows[0][0], 'Date')
+        self.assertEqual(len(rows), 3)
+        self.assertEqual({row[3] for row in rows[1:]}, {models.Accounts.DEBTOR})
+        self.assertEqual(rows[1][10], self.enrolment.module.code)
+
+    def test_xlsx_queued(self):
+        with patch.object(tasks.export_journal, 'delay') as delay:
+            delay.return_value.id = '3fa85f64-5717-4562-b3fc-2c963f66afa6'
+            response = self._post(file_format='xlsx')
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(delay.call_args.kwargs['start'], '2022-03-01')
@@ -22,6 +22,9 @@ urlpatterns = [
     path('my-batches', views.MyBatches.as_view(), name='my-batches'),
     path('create-batch/<int:type_id>/<str:created_by>', views.CreateBatch.as_view(), name='create-batch'),
     path('print-batch/<int:batch>', views.PrintBatch.as_view(), name='print-batch'),
+    # Journal exports
+    path('export-journal', views.JournalExport.as_view(), name='export-journal'),
+    path('journal/<str:filename>', views.DownloadJournal.as_view(), name='download-journal'),
     # website-accessible endpoints
     path('api/receipt/<int:allocation>/<int:enrolment_id>', api.ReceiptPDF.as_view()),
 ]
@@ -1,4 +1,4 @@
-from datetime import datetime
+from datetime import date, datetime
 from urllib.parse import urlencode
 
 from dateutil.relativedelta import relativedelta
@@ -18,14 +18,16 @@ from django.shortcuts import get_list_or_404, get_object_or_404, redirect
 from django.urls import reverse
 from django.views import generic
 
-from apps.core.utils import strings
+from apps.core.utils import pdf_cache, strings
 from apps.core.utils.urls import next_url_if_safe
 from apps.core.utils.views import PageTitleMixin
 from apps.enrolment.models import Enrolment
 from apps.fee.models import Fee
+from apps.invoice import services as invoice_services
+from apps.invoice.models import Invoice
 from apps.student.models import Student
 
-from . import datatables, forms, models, pdfs, services
+from . import datatables, exports, forms, models, pdfs, services, tasks
 
 
 class AddFees(LoginRequiredMixin, PageTitleMixin, SuccessMessageMixin, SingleTableMixin, generic.FormView):
@@ -249,7 +251,18 @@ class DeleteTransaction(LoginRequiredMixin, PageTitleMixin, generic.TemplateView
             raise PermissionDenied("You don't have permission to delete this transaction")
         # dump the logging data before deletion
         data = [item.__dict__ for item in ledger_items]
+        enrolment_ids = {item.enrolment_id for item in ledger_items if item.enrolment_id}
+        days = {item.created_on.date() for item in ledger_items if item.created_on}
+        invoice_ids = list(
+            Invoice.objects.filter(invoice_ledger_allocations__ledger__allocation=allocation).values_list(
+                'id', flat=True
+            )
+        )
         ledger_items.delete()
+        services.refresh_balances(list(enrolment_ids))
+        invoice_services.refresh_balances(invoice_ids)
+        services.refresh_cash_totals(days)
+        pdf_cache.invalidate(pdf_cache.RECEIPT, [allocation])
         # todo: consider a better form of logging this
         mail.send_mail(
             subject='Deleted ledger rows',
@@ -269,10 +282,15 @@ class ReceiptPDF(PermissionRequiredMixin, generic.View):
     def get(self, request, allocation: int, enrolment_id: int, *args, **kwargs) -> http.HttpResponse:
         enrolment = get_object_or_404(Enrolment, pk=enrolment_id)
         student = enrolment.qa.student
-        document = pdfs.create_receipt(allocation=allocation, student=student)
         filename = strings.normalize(f'Receipt_{allocation}_{student.firstname}_{student.surname}.pdf')
-        return http.HttpResponse(
-            document, content_type='application/pdf', headers={'Content-Disposition': f'inline;filename={filename}'}
+        return pdf_cache.pdf_response(
+            request,
+            kind=pdf_cache.RECEIPT,
+            document_id=allocation,
+            last_modified=pdfs.receipt_modified(allocation=allocation, student=student),
+            render=lambda: pdfs.create_receipt(allocation=allocation, student=student),
+            filename=filename,
+            variant=str(student.pk),
         )
 
 
@@ -295,8 +313,7 @@ class AllBatches(PermissionRequiredMixin, PageTitleMixin, SingleTableMixin, Filt
         # Using .values + .distinct queryset lets us display grouped results in the table,
         # but related labels must be included
         return (
-            models.Ledger.objects.cash()
-            .filter(created_on__gt=datetime.now() - relativedelta(months=12))  # limit to a year of data
+            models.DailyCashTotal.objects.filter(date__gt=date.today() - relativedelta(months=12))  # a year of data
             .values('created_by', 'type', 'type__description', 'batch')
             .distinct()
         )
@@ -313,9 +330,8 @@ class MyBatches(LoginRequiredMixin, PageTitleMixin, generic.TemplateView):
         context = super().get_context_data(**kwargs)
         # Only the user's batches from the last year
         base_query = (
-            models.Ledger.objects.cash()
-            .filter(
-                created_on__gt=datetime.now() - relativedelta(months=12),
+            models.DailyCashTotal.objects.filter(
+                date__gt=date.today() - relativedelta(months=12),
                 created_by=self.request.user.username,
             )
             .distinct()
@@ -330,11 +346,7 @@ class CreateBatch(LoginRequiredMixin, generic.View):
     # Todo: convert to post once the table is rigged up to have a posting link column
     def get(self, request, type_id: int, created_by: str, *args, **kwargs) -> http.HttpResponse:
         """Assign a batch # to a set of transactions of a shared type owned by a given user"""
-        batch: int = services.next_batch()
-        models.Ledger.objects.unbatched().filter(
-            created_by=created_by,
-            type_id=type_id,
-        ).update(batch=batch)
+        batch = services.create_batch(type_id=type_id, created_by=created_by)
         return redirect(reverse('finance:print-batch', args=[batch]))
 
 
@@ -377,3 +389,49 @@ class PrintBatch(LoginRequiredMixin, PageTitleMixin, generic.TemplateView):
             'transactions': transactions,
             'total': sum(line.amount for line in cash_control_lines),
         }
+
+
+class JournalExport(PermissionRequiredMixin, PageTitleMixin, generic.FormView):
+    """Exports the ledger for a period.  CSVs are streamed directly, while XLSX files are built by a task"""
+
+    permission_required = 'core.finance'
+    form_class = forms.JournalExportForm
+    template_name = 'core/form.html'
+    title = 'Finance'
+    subtitle = 'Export journal'
+
+    def form_valid(self, form) -> http.HttpResponse:
+        start, end = form.cleaned_data['start_date'], form.cleaned_data['end_date']
+        accounts = [account.code for account in form.cleaned_data['accounts']]
+        file_format = form.cleaned_data['file_format']
+
+        if file_format == exports.CSV:
+            lines = exports.journal_lines(start=start, end=end, accounts=accounts)
+            filename = exports.export_filename(
+                start=start, end=end, file_format=file_format, created_by=self.request.user.username
+            )
+            return http.StreamingHttpResponse(
+                exports.stream_csv(lines),
+                content_type='text/csv',
+                headers={'Content-Disposition': f'attachment; filename="{filename}"'},
+            )
+
+        task = tasks.export_journal.delay(
+            start=start.isoformat(),
+            end=end.isoformat(),
+            accounts=accounts,
+            file_format=file_format,
+            created_by=self.request.user.username,
+        )
+        return redirect('task:progress', task_id=task.id)
+
+
+class DownloadJournal(PermissionRequiredMixin, generic.View):
+    permission_required = 'core.finance'
+
+    def get(self, request, filename: str, *args, **kwargs) -> http.HttpResponse:
+        path = settings.PROTECTED_MEDIA_URL + 'finance/journals/' + filename
+        return http.HttpResponse(
+            content_type='',
+            headers={'X-Accel-Redirect': path, 'Content-Disposition': f'attachment;filename={filename}'},
+        )
@@ -0,0 +1,182 @@
+"""A benchmark of the HESA and Data Futures return builders, against a synthetic population.
+
+Run with `manage.py benchmarkhesa`.  The population is generated with the test factories, and everything written
+(including the batches) is rolled back afterwards.  Each stage is measured for wall time and query count, then run
+again for its peak (python-allocated) memory, since tracing memory slows down every allocation.  Results can be saved
+as JSON and compared between commits.
+"""
+from __future__ import annotations
+
+import random
+import subprocess
+import time
+import tracemalloc
+from dataclasses import asdict, dataclass
+from datetime import date, timedelta
+from typing import Callable, Optional
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from apps.enrolment.tests.factories import EnrolmentFactory
+from apps.finance.tests.factories import LedgerFactory
+from apps.hesa_data_futures import schemas as data_futures_schemas
+from apps.hesa_data_futures import services as data_futures_services
+from apps.hesa_data_futures import xml as data_futures_xml
+from apps.module.tests.factories import ModuleFactory
+from apps.programme.models import Qualification
+from apps.programme.tests.factories import ProgrammeFactory
+from apps.qualification_aim.models import AT_PROVIDER_STUDY_LOCATION
+from apps.qualification_aim.tests.factories import QualificationAimFactory
+from apps.student.tests.factories import StudentFactory
+
+from . import services
+
+INSTITUTIONAL_CREDIT_QUALIFICATION = 61
+CONFIRMED_STATUS = 10
+ENGLAND_DOMICILE = 240
+PASSED_RESULT = 1
+
+
+@dataclass
+class Population:
+    """The size of a synthetic return"""
+
+    students: int = 100
+    qas_per_student: int = 1
+    modules: int = 50
+    enrolments_per_qa: int = 2
+    fees_per_enrolment: int = 1
+
+
+@dataclass
+class StageResult:
+    builder: str
+    stage: str
+    seconds: float
+    queries: int
+    peak_memory: int  # bytes
+
+
+def generate_population(population: Population, academic_year: int, *, seed: int = 0) -> None:
+    """Create returnable students, qualification aims, modules, enrolments and fees in the academic year"""
+    rng = random.Random(seed)
+    # the qualification fixture doesn't yet include data futures codes
+    Qualification.objects.filter(pk=INSTITUTIONAL_CREDIT_QUALIFICATION, data_futures_code__isnull=True).update(
+        data_futures_code='C90'
+    )
+    programme = ProgrammeFactory(qualification_id=INSTITUTIONAL_CREDIT_QUALIFICATION)
+
+    year_start = date(academic_year, 8, 1)
+    modules = []
+    for _ in range(population.modules):
+        start_date = year_start + timedelta(days=rng.randint(0, 300))
+        modules.append(
+            ModuleFactory(
+                credit_points=rng.choice([10, 20, 30]),
+                start_date=start_date,
+                end_date=start_date + timedelta(days=rng.randint(1, 60)),
+            )
+        )
+
+    for _ in range(population.students):
+        student = StudentFactory(domicile_id=ENGLAND_DOMICILE, gender=rng.choice(['F', 'M']))
+        for _ in range(population.qas_per_student):
+            qa = QualificationAimFactory(
+                student=student, programme=programme, study_location_id=AT_PROVIDER_STUDY_LOCATION
+            )
+            for module in rng.sample(modules, min(population.enrolments_per_qa, len(modules))):
+                enrolment = EnrolmentFactory(qa=qa, module=module, status_id=CONFIRMED_STATUS, result_id=PASSED_RESULT)
+                for _ in range(population.fees_per_enrolment):
+                    LedgerFactory(enrolment=enrolment, amount=rng.randint(50, 500))
+
+
+class Benchmark:
+    """Measures each stage of the builders in two passes over the same population: one timed, and one traced"""
+
+    def __init__(self) -> None:
+        self._results: dict[tuple[str, str], StageResult] = {}
+        self._trace_memory = False
+
+    @property
+    def results(self) -> list[StageResult]:
+        return list(self._results.values())
+
+    def run(self, builders: list[str], academic_year: int) -> None:
+        for trace_memory in [False, True]:
+            self._trace_memory = trace_memory
+            # Each pass's return is rolled back, so the second builds from the same data as the first
+            with transaction.atomic():
+                for builder in builders:
+                    getattr(self, f'run_{builder}')(academic_year)
+                transaction.set_rollback(True)
+
+    def measure(self, builder: str, stage: str, function: Callable[[], object]) -> None:
+        if self._trace_memory:
+            tracemalloc.start()
+            try:
+                function()
+                _, peak_memory = tracemalloc.get_traced_memory()
+            finally:
+                tracemalloc.stop()
+            self._results[builder, stage].peak_memory = peak_memory
+        else:
+            start = time.perf_counter()
+            with CaptureQueriesContext(connection) as queries:
+                function()
+            seconds = time.perf_counter() - start
+            self._results[builder, stage] = StageResult(builder, stage, round(seconds, 3), len(queries), 0)
+
+    def run_hesa(self, academic_year: int) -> None:
+        hesa_return = services.HESAReturn(academic_year, 'benchmark')
+        for stage in [
+            '_institution',
+            '_student',
+            '_course',
+            '_course_subject',
+            '_module',
+            '_module_subject',
+            '_instance',
+            '_entry_profile',
+            '_student_on_module',
+            '_post_processing',
+        ]:
+            self.measure('hesa', stage.lstrip('_'), getattr(hesa_return, stage))
+        self.measure('hesa', 'xml', lambda: services.save_xml(hesa_return.batch))
+        (settings.PROTECTED_MEDIA_ROOT / 'hesa' / hesa_return.batch.filename).unlink(missing_ok=True)
+
+    def run_data_futures(self, academic_year: int) -> None:
+        hesa_return = data_futures_services.HESAReturn(academic_year, 'benchmark')
+        for stage in ['build_courses', 'build_modules', 'build_session_year', 'build_venue', 'build_students']:
+            self.measure('data_futures', stage, getattr(hesa_return, stage))
+        self.measure('data_futures', 'save_entities', hesa_return.entities.flush)
+
+        batch = hesa_return.batch
+        filename = data_futures_xml._filename(batch.id)
+        self.measure('data_futures', 'xml', lambda: data_futures_xml.stream_xml(batch))
+        try:
+            data_futures_schemas.get_entity_schema(academic_year)
+        except data_futures_schemas.SchemaNotFound:
+            pass  # validation can only be measured with a stored schema
+        else:
+            self.measure('data_futures', 'validation', lambda: data_futures_xml.validate_file(batch, filename))
+        data_futures_xml._file_path(filename).unlink(missing_ok=True)
+
+
+def current_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True, cwd=settings.BASE_DIR
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def to_json(results: list[StageResult], population: Population, academic_year: int) -> dict:
+    return {
+        'commit': current_commit(),
+        'academic_year': academic_year,
+        'population': asdict(population),
+        'results': [asdict(result) for result in results],
+    }
@@ -0,0 +1,61 @@
+import json
+from dataclasses import fields
+from pathlib import Path
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from apps.core.utils.dates import academic_year
+from apps.hesa import benchmark
+
+BUILDERS = ['hesa', 'data_futures']
+
+
+class Command(BaseCommand):
+    help = (
+        'Times the HESA and Data Futures return builders against a synthetic population, which is rolled back '
+        'afterwards.  Reports the wall time, query count and peak memory of each stage'
+    )
+
+    def add_arguments(self, parser):
+        for field in fields(benchmark.Population):
+            parser.add_argument(f'--{field.name.replace("_", "-")}', type=int, default=field.default)
+        parser.add_argument('--year', type=int, default=academic_year() - 1, help='The academic year of the return')
+        parser.add_argument('--builder', choices=BUILDERS, action='append', help='Defaults to all builders')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', type=Path, help='Save the results as JSON')
+        parser.add_argument('--compare', type=Path, help='JSON results of an earlier run to compare against')
+
+    def handle(self, *args, **options):
+        sizes = {field.name: options[field.name] for field in fields(benchmark.Population)}
+        population = benchmark.Population(**sizes)
+        runner = benchmark.Benchmark()
+
+        with transaction.atomic():
+            self.stdout.write(f'Generating {population}')
+            benchmark.generate_population(population, options['year'], seed=options['seed'])
+            runner.run(options['builder'] or BUILDERS, options['year'])
+            transaction.set_rollback(True)
+
+        results = benchmark.to_json(runner.results, population, options['year'])
+        previous = {}
+        if options['compare']:
+            previous = {
+                (result['builder'], result['stage']): result
+                for result in json.loads(options['compare'].read_text())['results']
+            }
+
+        self.stdout.write(f'{"Stage":<36}{"Seconds":>10}{"Queries":>10}{"Peak MiB":>10}')
+        for result in results['results']:
+            key = (result['builder'], result['stage'])
+            line = (
+                f'{".".join(key):<36}{result["seconds"]:>10.3f}{result["queries"]:>10}'
+                f'{result["peak_memory"] / 2**20:>10.1f}'
+            )
+            if key in previous:
+                line += f'  (was {previous[key]["seconds"]:.3f}s, {previous[key]["queries"]} queries)'
+            self.stdout.write(line)
+
+        if options['output']:
+            options['output'].write_text(json.dumps(results, indent=2))
+            self.stdout.write(f'Results saved to {options["output"]}')
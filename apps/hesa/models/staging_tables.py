@@ -1,17 +1,23 @@
 from __future__ import annotations
 
 from datetime import datetime
-from typing import Iterable
+from typing import Iterable, Optional
 
 from django.db import models
 from django.urls import reverse
 
+from apps.core.utils.xml import ChildRelation, load_graph
+
 INSTITUTION_CODE = 10007774
 
 
 class XMLStagingModel:
     xml_fields: Iterable[str] = ()
     xml_required: Iterable[str] = ()
+    # Child nodes, as (model name, parent field, child field): rows in the same batch whose child field matches
+    xml_children: Iterable[tuple[str, str, str]] = ()
+    # Populated by load_batch_graph(), to avoid a query per node
+    _loaded_children: Optional[list[list[XMLStagingModel]]] = None
 
     @property
     def element_name(self) -> str:
@@ -19,9 +25,15 @@ class XMLStagingModel:
         Can be overridden"""
         return self.__class__.__name__
 
-    def children(self) -> list[models.QuerySet]:
-        """Returns a list of querysets, which will be iterated over in sequence to create child nodes"""
-        return []
+    def children(self) -> list[Iterable[XMLStagingModel]]:
+        """Returns a list of querysets (or lists, if the batch graph is loaded), which will be iterated over in
+        sequence to create child nodes"""
+        if self._loaded_children is not None:
+            return self._loaded_children
+        return [
+            _staging_model(name).objects.filter(batch=self.batch_id, **{child_field: getattr(self, parent_field)})
+            for name, parent_field, child_field in self.xml_children
+        ]
 
 
 class Batch(XMLStagingModel, models.Model):
@@ -54,6 +66,7 @@ class Course(XMLStagingModel, models.Model):
         'reducedc',
         'ttcid',
     ]
+    xml_children = [('CourseSubject', 'courseid', 'courseid_fk')]
 
     batch = models.ForeignKey(Batch, models.CASCADE, db_column='batch', blank=True, null=True)
     programme = models.IntegerField(blank=True, null=True)
@@ -77,9 +90,6 @@ class Course(XMLStagingModel, models.Model):
         db_table = 'hesa_course'
         unique_together = (('batch', 'courseid'),)
 
-    def children(self) -> list[models.QuerySet]:
-        return [CourseSubject.objects.filter(batch=self.batch, courseid_fk=self.courseid)]
-
 
 class CourseSubject(XMLStagingModel, models.Model):
     xml_fields = ['sbjca', 'sbjpcnt']
@@ -142,6 +152,11 @@ class Instance(XMLStagingModel, models.Model):
         'yearstu',
     ]
     xml_required = ['splength', 'mcdate', 'enddate']
+    xml_children = [
+        ('EntryProfile', 'instanceid', 'instanceid_fk'),
+        ('QualificationsAwarded', 'instanceid', 'instanceid_fk'),
+        ('StudentOnModule', 'instanceid', 'instanceid_fk'),
+    ]
 
     batch = models.ForeignKey(Batch, models.CASCADE, db_column='batch')
     qa = models.IntegerField(blank=True, null=True)
@@ -181,16 +196,14 @@ class Instance(XMLStagingModel, models.Model):
     class Meta:
         db_table = 'hesa_instance'
 
-    def children(self) -> list[models.QuerySet]:
-        return [
-            EntryProfile.objects.filter(batch=self.batch, instanceid_fk=self.instanceid),
-            QualificationsAwarded.objects.filter(batch=self.batch, instanceid_fk=self.instanceid),
-            StudentOnModule.objects.filter(batch=self.batch, instanceid_fk=self.instanceid),
-        ]
-
 
 class Institution(XMLStagingModel, models.Model):
     xml_fields = ['instapp', 'recid', 'ukprn']
+    xml_children = [
+        ('Course', 'batch_id', 'batch_id'),
+        ('Module', 'batch_id', 'batch_id'),
+        ('Student', 'batch_id', 'batch_id'),
+    ]
 
     batch = models.ForeignKey(Batch, models.CASCADE, db_column='batch')
     instapp = models.IntegerField(db_column='INSTAPP', default=0)
@@ -200,16 +213,10 @@ class Institution(XMLStagingModel, models.Model):
     class Meta:
         db_table = 'hesa_institution'
 
-    def children(self) -> list[models.QuerySet]:
-        return [
-            Course.objects.filter(batch=self.batch),
-            Module.objects.filter(batch=self.batch),
-            Student.objects.filter(batch=self.batch),
-        ]
-
 
 class Module(XMLStagingModel, models.Model):
     xml_fields = ['modid', 'crdtpts', 'crdtscm', 'fte', 'levlpts', 'mtitle', 'pcolab', 'tinst']
+    xml_children = [('ModuleSubject', 'modid', 'modid_fk')]
 
     batch = models.ForeignKey(Batch, models.CASCADE, db_column='batch')
     module = models.IntegerField(blank=True, null=True)
@@ -226,9 +233,6 @@ class Module(XMLStagingModel, models.Model):
     class Meta:
         db_table = 'hesa_module'
 
-    def children(self) -> list[models.QuerySet]:
-        return [ModuleSubject.objects.filter(batch=self.batch, modid_fk=self.modid)]
-
 
 class ModuleSubject(XMLStagingModel, models.Model):
     xml_fields = ['costcn', 'modsbj', 'modsbjp']
@@ -275,6 +279,7 @@ class Student(XMLStagingModel, models.Model):
         'ttpcode',
     ]
     xml_required = ['birthdte', 'scn', 'ttpcode']
+    xml_children = [('Instance', 'ownstu', 'ownstu_fk')]
 
     batch = models.ForeignKey(Batch, models.CASCADE, db_column='batch')
     student = models.IntegerField()
@@ -299,9 +304,6 @@ class Student(XMLStagingModel, models.Model):
     class Meta:
         db_table = 'hesa_student'
 
-    def children(self) -> list[models.QuerySet]:
-        return [Instance.objects.filter(batch=self.batch, ownstu_fk=self.ownstu)]
-
 
 class StudentOnModule(XMLStagingModel, models.Model):
     xml_fields = ['modid', 'modout', 'modstat']
@@ -315,3 +317,29 @@ class StudentOnModule(XMLStagingModel, models.Model):
 
     class Meta:
         db_table = 'hesa_student_on_module'
+
+
+def _staging_model(name: str) -> type[models.Model]:
+    return globals()[name]
+
+
+def load_batch_graph(institution: Institution) -> None:
+    """Read the institution's entire batch into memory, one query per staging table, so generating the XML
+    doesn't issue a query for each node's children"""
+    relations = []
+
+    def add_relations(parent: type[XMLStagingModel]) -> None:
+        for name, parent_field, child_field in parent.xml_children:
+            model = _staging_model(name)
+            relations.append(
+                ChildRelation(
+                    parent=parent,  # type: ignore
+                    queryset=model.objects.filter(batch=institution.batch_id),
+                    parent_field=parent_field,
+                    child_field=child_field,
+                )
+            )
+            add_relations(model)  # type: ignore
+
+    add_relations(Institution)
+    load_graph(institution, relations)
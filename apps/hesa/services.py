@@ -1,15 +1,17 @@
 import itertools
 import re
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import date
-from typing import Iterable, Optional
+from typing import BinaryIO, Callable, Iterable, Optional
 
 from celery_progress.backend import ProgressRecorder
 from lxml import etree
 
 from django.conf import settings
-from django.db.models import F, FilteredRelation, OuterRef, Prefetch, Q, Subquery
+from django.db import connection
+from django.db.models import F, FilteredRelation, Model, OuterRef, Prefetch, Q, Subquery
 
-from apps.core.utils import strings
+from apps.core.utils import strings, xml
 from apps.enrolment.models import Enrolment
 from apps.finance.models import Accounts, Ledger
 from apps.module.models import Module
@@ -18,7 +20,7 @@ from apps.qualification_aim.models import QualificationAim
 from apps.student.models import Student
 
 from . import models
-from .models.staging_tables import XMLStagingModel
+from .models.staging_tables import XMLStagingModel, load_batch_graph
 
 EMPTY_ELEMENT = '<EMPTY>'
 
@@ -33,20 +35,36 @@ COMPLETE_PENDING_RESULT = 'C'
 
 FEE_TRANSACTION_TYPE = 1
 
+# Number of staging rows written per INSERT statement
+BULK_CREATE_CHUNK_SIZE = 500
+
+# Number of stages run concurrently when producing a return, each with its own database connection
+STAGE_WORKERS = 4
+
 
 # todo: determine if we need both the task and services
 def create_return(
     academic_year, created_by, *, recorder: Optional[ProgressRecorder] = None, run_xml=False
 ) -> models.Batch:
     """The schedulable routine which call the magic below"""
-    return HESAReturn(academic_year, created_by, recorder=recorder).create()
+    return HESAReturn(academic_year, created_by, recorder=recorder, workers=STAGE_WORKERS).create()
 
 
 class HESAReturn:
-    def __init__(self, academic_year: int, created_by: str, *, recorder: Optional[ProgressRecorder] = None) -> None:
+    def __init__(
+        self,
+        academic_year: int,
+        created_by: str,
+        *,
+        recorder: Optional[ProgressRecorder] = None,
+        chunk_size: int = BULK_CREATE_CHUNK_SIZE,
+        workers: int = 1,
+    ) -> None:
         self.academic_year = academic_year
         self.batch = models.Batch.objects.create(academic_year=self.academic_year, created_by=created_by)
         self.recorder = recorder
+        self.chunk_size = chunk_size
+        self.workers = workers
 
         # Universal base query
         # could potentially use other Models, but it sits nicely as the m2m between QA and Module
@@ -71,31 +89,48 @@ class HESAReturn:
             self.recorder.set_progress(current=current, total=total, description=description)
 
     def create(self) -> models.Batch:
-        """Populate the tables in order, updating the status after each"""
-        steps = 11
+        """Populate the tables, updating the status after each.
+
+        Each stage reads only from core tables and writes its own staging tables, so with more than one worker the
+        stages run concurrently.  Post-processing relies on every table, so runs once they're all complete
+        """
+        stages: dict[str, Callable[[], None]] = {
+            'Students': self._student,
+            'Courses': self._course,
+            'Course subjects': self._course_subject,
+            'Modules': self._module,
+            'Module subjects': self._module_subject,
+            'Instances': self._instance,
+            'Entry profiles': self._entry_profile,
+            'Students on modules': self._student_on_module,
+        }
+        steps = len(stages) + 3
         self._set_progress(1, steps, 'Institution')
         self._institution()
-        self._set_progress(2, steps, 'Student')
-        self._student()
-        self._set_progress(3, steps, 'Courses')
-        self._course()
-        self._set_progress(4, steps, 'Course subjects')
-        self._course_subject()
-        self._set_progress(5, steps, 'Modules')
-        self._module()
-        self._set_progress(6, steps, 'Module subjects')
-        self._module_subject()
-        self._set_progress(7, steps, 'Instances')
-        self._instance()
-        self._set_progress(8, steps, 'Entry profiles')
-        self._entry_profile()
-        self._set_progress(9, steps, 'Students on modules')
-        self._student_on_module()
-        self._set_progress(10, steps, 'Post-processing business rules')
+        self._run_stages(stages, first_step=2, steps=steps)
+        self._set_progress(steps - 1, steps, 'Post-processing business rules')
         self._post_processing()
 
         return self.batch
 
+    def _run_stages(self, stages: dict[str, Callable[[], None]], *, first_step: int, steps: int) -> None:
+        if self.workers == 1:
+            for step, (description, stage) in enumerate(stages.items(), start=first_step):
+                self._set_progress(step, steps, description)
+                stage()
+            return
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = {executor.submit(_run_in_worker, stage): description for description, stage in stages.items()}
+            # Progress is only reported from this thread, as each stage finishes
+            for step, future in enumerate(as_completed(futures), start=first_step):
+                future.result()
+                self._set_progress(step, steps, f'{futures[future]} complete')
+
+    def _bulk_create(self, model: type[Model], rows: list[Model]) -> None:
+        """Write a stage's staging rows in chunks, rather than one INSERT per row"""
+        model.objects.bulk_create(rows, batch_size=self.chunk_size)
+
     def _institution(self):
         models.Institution.objects.create(
             batch=self.batch,
@@ -122,8 +157,8 @@ class HESAReturn:
             .distinct()
         )
 
-        for row in results:
-            models.Student.objects.create(
+        rows = [
+            models.Student(
                 batch=self.batch,
                 student=row.id,
                 husid=str(row.husid).zfill(13),
@@ -142,6 +177,9 @@ class HESAReturn:
                 ssn=row.ssn,
                 relblf=str(row.religion_or_belief_id).zfill(2),
             )
+            for row in results
+        ]
+        self._bulk_create(models.Student, rows)
 
     def _instance(self) -> None:
         in_query = self.base_query.values('qa__id')
@@ -177,10 +215,12 @@ class HESAReturn:
             .distinct()
         )
 
+        instances = []
+        qualifications_awarded = []
         for row in results:
             enrolments: Iterable[Enrolment] = row.returned_enrolments  # type: ignore
             reason_for_ending = _reason_for_ending(enrolments=enrolments)
-            models.Instance.objects.create(
+            instance = models.Instance(
                 batch=self.batch,
                 qa=row.id,
                 instanceid=self._instance_id(row.id),
@@ -208,12 +248,17 @@ class HESAReturn:
                 # Required field for our Master's level courses, but we have no research council students
                 rcstdnt=99 if row.programme.qualification.hesa_code[0] in ('E', 'M') else None,
             )
+            instances.append(instance)
             if reason_for_ending == '01':  # completed
-                models.QualificationsAwarded.objects.create(
-                    batch=self.batch,
-                    instanceid_fk=self._instance_id(row.id),
-                    qual=row.programme.qualification.hesa_code,
+                qualifications_awarded.append(
+                    models.QualificationsAwarded(
+                        batch=self.batch,
+                        instanceid_fk=self._instance_id(row.id),
+                        qual=row.programme.qualification.hesa_code,
+                    )
                 )
+        self._bulk_create(models.Instance, instances)
+        self._bulk_create(models.QualificationsAwarded, qualifications_awarded)
 
     def _entry_profile(self) -> None:
         in_query = self.base_query.values('qa__id')
@@ -232,8 +277,8 @@ class HESAReturn:
             .distinct()
         )
 
-        for row in results:
-            models.EntryProfile.objects.create(
+        rows = [
+            models.EntryProfile(
                 batch=self.batch,
                 instanceid_fk=self._instance_id(row.id),
                 domicile=row.student.domicile.hesa_code,
@@ -243,14 +288,17 @@ class HESAReturn:
                 else None,
                 pared=row.student.parental_education_id,
             )
+            for row in results
+        ]
+        self._bulk_create(models.EntryProfile, rows)
 
     def _module(self) -> None:
         in_query = self.base_query.values('module__id')
 
         results = Module.objects.filter(id__in=Subquery(in_query)).order_by('code').distinct()
 
-        for row in results:
-            models.Module.objects.create(
+        rows = [
+            models.Module(
                 batch=self.batch,
                 module=row.id,
                 modid=row.code,
@@ -259,18 +307,24 @@ class HESAReturn:
                 crdtpts=str(row.credit_points).zfill(3),
                 levlpts=row.points_level_id,
             )
+            for row in results
+        ]
+        self._bulk_create(models.Module, rows)
 
     def _student_on_module(self) -> None:
         results = self.base_query.select_related('module', 'result')
 
-        for row in results:
-            models.StudentOnModule.objects.create(
+        rows = [
+            models.StudentOnModule(
                 batch=self.batch,
                 enrolment=row.id,
                 instanceid_fk=self._instance_id(row.qa_id),
                 modid=row.module.code,
                 modout=row.result.hesa_code,
             )
+            for row in results
+        ]
+        self._bulk_create(models.StudentOnModule, rows)
 
     def _module_subject(self) -> None:
         in_query = self.base_query.values('module__id')
@@ -281,14 +335,17 @@ class HESAReturn:
             .distinct()
         )
 
-        for row in results:
-            models.ModuleSubject.objects.create(
+        rows = [
+            models.ModuleSubject(
                 batch=self.batch,
                 modid_fk=row.module.code,
                 modsbj=row.hecos_subject.id,
                 modsbjp=row.percentage,
                 costcn=row.hecos_subject.cost_centre_id,
             )
+            for row in results
+        ]
+        self._bulk_create(models.ModuleSubject, rows)
 
     def _course(self) -> None:
         in_query = self.base_query.values('qa__programme__id')
@@ -300,8 +357,8 @@ class HESAReturn:
             .distinct()
         )
 
-        for row in results:
-            models.Course.objects.create(
+        rows = [
+            models.Course(
                 batch=self.batch,
                 programme=row.id,
                 courseid=row.id,
@@ -310,6 +367,9 @@ class HESAReturn:
                 ctitle=row.title,
                 msfund=str(row.funding_source or '').zfill(2),
             )
+            for row in results
+        ]
+        self._bulk_create(models.Course, rows)
 
     def _course_subject(self):
         in_query = self.base_query.values('qa__programme__id')
@@ -321,13 +381,16 @@ class HESAReturn:
             .distinct()
         )
 
-        for row in results:
-            models.CourseSubject.objects.create(
+        rows = [
+            models.CourseSubject(
                 batch=self.batch,
                 courseid_fk=row.programme_id,
                 sbjca=row.hecos_subject.id,
                 sbjpcnt=row.percentage,
             )
+            for row in results
+        ]
+        self._bulk_create(models.CourseSubject, rows)
 
     def _post_processing(self) -> None:
         """A series of tasks to shape the records to match HESA's XML expectations
@@ -409,6 +472,14 @@ class HESAReturn:
         models.EntryProfile.objects.filter(batch=self.batch, instanceid_fk__in=Subquery(instances)).update(pared=None)
 
 
+def _run_in_worker(stage: Callable[[], None]) -> None:
+    """Run a stage in a worker thread, closing the thread's database connection once it's done"""
+    try:
+        stage()
+    finally:
+        connection.close()
+
+
 def _correct_postcode(postcode: str) -> str:
     """Format UK postcodes while filtering out non-UK"""
     # UK govt regex from https://stackoverflow.com/questions/164979/regex-for-matching-uk-postcodes
@@ -468,9 +539,9 @@ def _grossfee(*, enrolments) -> int:
     return round(sum(enrolment_sum(enrolment) for enrolment in enrolments))
 
 
-def _model_to_node(model: XMLStagingModel) -> etree.Element:
-    node = etree.Element(model.element_name)
-    # Fill with elements
+def _field_nodes(model: XMLStagingModel) -> list[etree.Element]:
+    """Create the value elements of a model's node"""
+    nodes = []
     for column in model.xml_fields:
         value = getattr(model, column)
         # hack to deal with qualification_awarded.class shadowing a reserved word
@@ -479,10 +550,19 @@ def _model_to_node(model: XMLStagingModel) -> etree.Element:
         if value is not None:
             # EMPTY_ELEMENT lets us handle conditionally-returned elements, e.g. postcode and ttpcode: they
             # must not exist for overseas, but can exist and be empty for UK
-            etree.SubElement(node, column.upper()).text = str(value).replace(EMPTY_ELEMENT, '')
+            node = etree.Element(column.upper())
+            node.text = str(value).replace(EMPTY_ELEMENT, '')
+            nodes.append(node)
         elif column in model.xml_required:
             # Empty element for a null
-            etree.SubElement(node, column.upper())
+            nodes.append(etree.Element(column.upper()))
+    return nodes
+
+
+def _model_to_node(model: XMLStagingModel) -> etree.Element:
+    node = etree.Element(model.element_name)
+    # Fill with elements
+    node.extend(_field_nodes(model))
 
     # Create subnodes if any exist
     for child in itertools.chain.from_iterable(model.children()):
@@ -494,20 +574,32 @@ def _model_to_node(model: XMLStagingModel) -> etree.Element:
 def _generate_tree(batch: int) -> str:
     root = etree.Element('StudentRecord')
     institution = models.Institution.objects.get(batch=batch)
+    load_batch_graph(institution)
     root.append(_model_to_node(institution))
 
     return etree.tostring(root, pretty_print=True).decode('utf8')
 
 
-def save_xml(batch: models.Batch) -> None:
+def _stream_tree(batch: int, output: BinaryIO) -> None:
+    """Write the same document as _generate_tree, one node at a time, without holding the tree in memory"""
+    institution = models.Institution.objects.get(batch=batch)
+    load_batch_graph(institution)
+    xml.write_document(output, institution, field_nodes=_field_nodes, root_element='StudentRecord')
+
+
+def save_xml(batch: models.Batch, *, streaming: bool = True) -> None:
     # create the media subfolder if required
     file_path = settings.PROTECTED_MEDIA_ROOT / 'hesa'
     file_path.mkdir(parents=True, exist_ok=True)
 
     filename = f'conted_batch_{batch.id}.xml'
     fullpath = file_path / filename
-    with open(fullpath, 'w') as f:
-        xml_string = _generate_tree(batch.id)
-        f.write(xml_string)
+    if streaming:
+        with open(fullpath, 'wb') as f:
+            _stream_tree(batch.id, f)
+    else:
+        with open(fullpath, 'w') as f:
+            xml_string = _generate_tree(batch.id)
+            f.write(xml_string)
     batch.filename = filename
     batch.save()
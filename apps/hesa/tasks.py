@@ -6,18 +6,18 @@ from . import models, services
 
 
 @app.task(name='create_hesa_return', bind=True)
-def create_return(self, *, academic_year: int, created_by: str):
+def create_return(self, *, academic_year: int, created_by: str, streaming: bool = True):
     recorder = ProgressRecorder(self)
     batch = services.create_return(academic_year, created_by, recorder=recorder)
     recorder.set_progress(current=12, total=12, description='Generating XML')
-    services.save_xml(batch=batch)
+    services.save_xml(batch=batch, streaming=streaming)
     return {'redirect': batch.get_absolute_url()}
 
 
 @app.task(name='create_hesa_xml', bind=True)
-def create_hesa_xml(self, *, batch_id: int):
+def create_hesa_xml(self, *, batch_id: int, streaming: bool = True):
     recorder = ProgressRecorder(self)
     batch = models.Batch.objects.get(pk=batch_id)
     recorder.set_progress(current=1, total=1, description='Generating XML')
-    services.save_xml(batch=batch)
+    services.save_xml(batch=batch, streaming=streaming)
     return {'redirect': batch.get_absolute_url()}
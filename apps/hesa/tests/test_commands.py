@@ -0,0 +1,30 @@
+import io
+import json
+import tempfile
+from pathlib import Path
+
+from django import test
+from django.core.management import call_command
+
+from apps.student.models import Student
+
+from .. import models
+
+
+class TestBenchmarkHESA(test.TestCase):
+    def test_results_saved_and_population_rolled_back(self):
+        students = Student.objects.count()
+        with tempfile.TemporaryDirectory() as directory:
+            output = Path(directory) / 'results.json'
+            options = ['--students=3', '--modules=2', '--year=2020', f'--output={output}']
+            call_command('benchmarkhesa', *options, stdout=io.StringIO())
+            results = json.loads(output.read_text())
+
+        stages = {(result['builder'], result['stage']): result for result in results['results']}
+        self.assertEqual(stages['hesa', 'student']['queries'], 2)  # a select, and one insert
+        self.assertIn(('data_futures', 'xml'), stages)
+        # Memory is traced in a second pass, which fills in every stage
+        self.assertTrue(all(result['peak_memory'] > 0 for result in results['results']))
+        self.assertEqual(results['population']['students'], 3)
+        self.assertEqual(Student.objects.count(), students)
+        self.assertFalse(models.Batch.objects.exists())
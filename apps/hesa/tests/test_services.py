@@ -1,6 +1,14 @@
+import io
+import threading
+from functools import partial
+from unittest.mock import Mock
+
+from lxml import etree
 from parameterized import parameterized
 
 from django import test
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 
 from apps.enrolment.tests.factories import EnrolmentFactory
 from apps.module.tests.factories import ModuleFactory
@@ -137,4 +145,137 @@ class TestReturnProduction(test.TestCase):
         ]:
             self.assertIn(element, xml)
 
+    def test_streamed_xml_matches_tree(self):
+        hesa_return = services.HESAReturn(2020, 'test')
+        batch = hesa_return.create()
+
+        output = io.BytesIO()
+        services._stream_tree(batch.id, output)
+        self.assertEqual(output.getvalue().decode('utf8'), services._generate_tree(batch.id))
+
     # todo: add no-result test cases, etc.
+
+
+class TestStageQueryCounts(test.TestCase):
+    """Each stage should write its staging rows in bulk, so query counts don't scale with the batch"""
+
+    stages = [
+        '_institution',
+        '_student',
+        '_course',
+        '_course_subject',
+        '_module',
+        '_module_subject',
+        '_instance',
+        '_entry_profile',
+        '_student_on_module',
+    ]
+
+    @staticmethod
+    def _add_students(count: int) -> None:
+        programme = ProgrammeFactory(qualification_id=INSTITUTIONAL_CREDIT_QUALIFICATION)
+        for _ in range(count):
+            qa = QualificationAimFactory(
+                student=StudentFactory(domicile_id=ENGLAND_DOMICILE, gender='F'),
+                programme=programme,
+                study_location_id=AT_PROVIDER_STUDY_LOCATION,
+            )
+            EnrolmentFactory(
+                qa=qa,
+                module=ModuleFactory(credit_points=10, start_date='2021-01-01'),
+                status_id=CONFIRMED_STATUS,
+                result_id=PASSED_RESULT,
+            )
+
+    def _query_counts(self) -> dict[str, int]:
+        hesa_return = services.HESAReturn(2020, 'test')
+        counts = {}
+        for stage in self.stages:
+            with CaptureQueriesContext(connection) as context:
+                getattr(hesa_return, stage)()
+            counts[stage] = len(context)
+        return counts
+
+    def test_query_count_independent_of_batch_size(self):
+        self._add_students(1)
+        small_batch = self._query_counts()
+        self._add_students(5)
+        large_batch = self._query_counts()
+
+        self.assertEqual(small_batch, large_batch)
+        self.assertEqual(models.Student.objects.count(), 1 + 6)  # across both batches
+
+    def test_xml_query_count_independent_of_batch_size(self):
+        self._add_students(1)
+        small_batch = services.HESAReturn(2020, 'test').create()
+        self._add_students(5)
+        large_batch = services.HESAReturn(2020, 'test').create()
+
+        # One query for the institution, then one per staging table
+        for batch in (small_batch, large_batch):
+            with self.assertNumQueries(10):
+                services._generate_tree(batch.id)
+
+    def test_loaded_graph_matches_queries(self):
+        self._add_students(3)
+        batch = services.HESAReturn(2020, 'test').create()
+        institution = models.Institution.objects.get(batch=batch)
+        expected = etree.tostring(services._model_to_node(institution))
+
+        models.staging_tables.load_batch_graph(institution)
+        with self.assertNumQueries(0):
+            self.assertEqual(etree.tostring(services._model_to_node(institution)), expected)
+
+    def test_rows_written_in_chunks(self):
+        self._add_students(3)
+        hesa_return = services.HESAReturn(2020, 'test', chunk_size=2)
+        with CaptureQueriesContext(connection) as context:
+            hesa_return._student()
+        self.assertEqual(models.Student.objects.filter(batch=hesa_return.batch).count(), 3)
+        # One select, plus two chunked inserts
+        self.assertEqual(len(context), 3)
+
+
+class TestParallelStages(test.TestCase):
+    stages = [
+        '_student',
+        '_course',
+        '_course_subject',
+        '_module',
+        '_module_subject',
+        '_instance',
+        '_entry_profile',
+        '_student_on_module',
+    ]
+
+    def test_post_processing_after_stages(self):
+        """Check each stage runs once in a worker thread, and post-processing waits for them all"""
+        calls = []
+
+        def record(stage: str) -> None:
+            calls.append((stage, threading.get_ident()))
+
+        hesa_return = services.HESAReturn(2020, 'test', recorder=Mock(), workers=4)
+        for stage in self.stages + ['_post_processing']:
+            setattr(hesa_return, stage, partial(record, stage))
+
+        hesa_return.create()
+
+        self.assertCountEqual([stage for stage, _ in calls[:-1]], self.stages)
+        self.assertNotIn(threading.get_ident(), {thread for _, thread in calls[:-1]})
+        self.assertEqual(calls[-1], ('_post_processing', threading.get_ident()))
+        # Progress is reported for every stage, from the task's thread
+        self.assertEqual(
+            [call.kwargs['current'] for call in hesa_return.recorder.set_progress.call_args_list], list(range(1, 11))
+        )
+
+    def test_stage_errors_raised(self):
+        hesa_return = services.HESAReturn(2020, 'test', workers=4)
+        for stage in self.stages:
+            setattr(hesa_return, stage, Mock())
+        hesa_return._module.side_effect = ValueError
+        hesa_return._post_processing = Mock()
+
+        with self.assertRaises(ValueError):
+            hesa_return.create()
+        hesa_return._post_processing.assert_not_called()
@@ -0,0 +1,10 @@
+import django_tables2 as tables
+
+from .models import SchemaError
+
+
+class SchemaErrorTable(tables.Table):
+    class Meta:
+        model = SchemaError
+        fields = ('entity', 'key', 'line', 'message')
+        per_page = 100
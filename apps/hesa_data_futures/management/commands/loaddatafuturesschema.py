@@ -0,0 +1,24 @@
+from pathlib import Path
+
+from lxml import etree
+
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.hesa_data_futures import schemas
+
+
+class Command(BaseCommand):
+    help = 'Loads a Data Futures XSD file into the local schema store, for validating the given collection year'
+
+    def add_arguments(self, parser):
+        parser.add_argument('academic_year', type=int, help='The start year of the collection, e.g. 2022 for 2022-23')
+        parser.add_argument('path', type=Path, help='The XSD file, as downloaded from the HESA coding manual')
+
+    def handle(self, *args, **options):
+        try:
+            path = schemas.install(options['path'], options['academic_year'])
+        except OSError as e:
+            raise CommandError(f'Could not read {options["path"]}: {e}')
+        except (etree.XMLSyntaxError, etree.XMLSchemaParseError) as e:
+            raise CommandError(f'{options["path"]} is not a valid XSD schema: {e}')
+        self.stdout.write(f'Loaded schema for {options["academic_year"]} to {path}')
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.13 on 2026-10-18 08:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hesa_data_futures', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='student',
+            name='student',
+            field=models.IntegerField(null=True),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 3.2.13 on 2026-10-18 08:20
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hesa_data_futures', '0002_student_source_id'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SchemaError',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('entity', models.CharField(max_length=32)),
+                ('key', models.CharField(max_length=50, null=True)),
+                ('line', models.IntegerField(null=True)),
+                ('message', models.TextField()),
+                ('batch', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='hesa_data_futures.batch')),
+            ],
+            options={
+                'db_table': 'data_futures_schema_error',
+            },
+        ),
+    ]
@@ -4,17 +4,23 @@ For the (2022-23) definitions, see https://codingmanual.hesa.ac.uk/22056/dataDic
 from __future__ import annotations
 
 from datetime import datetime
-from typing import Iterable
+from typing import Iterable, Optional
 
 from django.db import models
 from django.urls import reverse
 
+from apps.core.utils.xml import ChildRelation, load_graph
+
 INSTITUTION_CODE = 10007774  # our UKPRN
 
 
 class XMLStagingModel:
     xml_fields: Iterable[str] = ()
     xml_required: Iterable[str] = ()
+    # Reverse foreign key accessors for child nodes, in the order they're written
+    xml_children: Iterable[str] = ()
+    # Populated by load_batch_graph(), to avoid a query per node
+    _loaded_children: Optional[list[list[XMLStagingModel]]] = None
 
     @property
     def element_name(self) -> str:
@@ -22,13 +28,17 @@ class XMLStagingModel:
         Can be overridden"""
         return self.__class__.__name__
 
-    def children(self) -> list[models.QuerySet]:
-        """Returns a list of querysets, which will be iterated over in sequence to create child nodes"""
-        return []
+    def children(self) -> list[Iterable[XMLStagingModel]]:
+        """Returns a list of querysets (or lists, if the batch graph is loaded), which will be iterated over in
+        sequence to create child nodes"""
+        if self._loaded_children is not None:
+            return self._loaded_children
+        return [getattr(self, accessor).all() for accessor in self.xml_children]
 
 
 class Batch(XMLStagingModel, models.Model):
     element_name = 'DataFutures'
+    xml_children = ['course_set', 'module_set', 'qualification_set', 'sessionyear_set', 'student_set', 'venue_set']
 
     class Statuses(models.TextChoices):
         EMPTY = 'EMPTY'
@@ -63,7 +73,9 @@ class Batch(XMLStagingModel, models.Model):
     def is_complete(self) -> bool:
         return self.status == self.Statuses.COMPLETE
 
-    def children(self) -> list[models.QuerySet]:
+    def children(self) -> list[Iterable[XMLStagingModel]]:
+        if self._loaded_children is not None:
+            return self._loaded_children
         # by prefetching the entire batch, xml generation uses dozens of database reads instead of >10000
         return [
             self.course_set.prefetch_related('courserole_set'),
@@ -86,8 +98,22 @@ class Batch(XMLStagingModel, models.Model):
         ]
 
 
+class SchemaError(models.Model):
+    """An XSD validation error, located to the top-level entity (e.g. the student) which failed"""
+
+    batch = models.ForeignKey('Batch', on_delete=models.CASCADE)
+    entity = models.CharField(max_length=32)  # element name, e.g. Student
+    key = models.CharField(max_length=50, null=True)  # the entity's identifier, e.g. its SID
+    line = models.IntegerField(null=True)
+    message = models.TextField()
+
+    class Meta:
+        db_table = 'data_futures_schema_error'
+
+
 class Course(XMLStagingModel, models.Model):
     xml_fields = ['courseid', 'clsdcrs', 'coursetitle', 'prerequisite', 'qualid', 'ttcid']
+    xml_children = ['courserole_set']
 
     # structure
     batch = models.ForeignKey('Batch', on_delete=models.CASCADE)
@@ -103,9 +129,6 @@ class Course(XMLStagingModel, models.Model):
     class Meta:
         db_table = 'data_futures_course'
 
-    def children(self) -> list[models.QuerySet]:
-        return [self.courserole_set.all()]
-
 
 class CourseRole(XMLStagingModel, models.Model):
     xml_fields = ['hesaid', 'roletype', 'crproportion']
@@ -124,6 +147,7 @@ class CourseRole(XMLStagingModel, models.Model):
 
 class Module(XMLStagingModel, models.Model):
     xml_fields = ['modid', 'crdtpts', 'crdtscm', 'fte', 'levlpts', 'mtitle']
+    xml_children = ['modulecostcentre_set', 'modulesubject_set']
 
     # structure
     batch = models.ForeignKey('Batch', on_delete=models.CASCADE)
@@ -139,9 +163,6 @@ class Module(XMLStagingModel, models.Model):
     class Meta:
         db_table = 'data_futures_module'
 
-    def children(self) -> list[models.QuerySet]:
-        return [self.modulecostcentre_set.all(), self.modulesubject_set.all()]
-
 
 # todo: amend core module and subject data structure, so cost centres are allocated directly to modules
 class ModuleCostCentre(XMLStagingModel, models.Model):
@@ -174,6 +195,7 @@ class ModuleSubject(XMLStagingModel, models.Model):
 
 class Qualification(XMLStagingModel, models.Model):
     xml_fields = ['qualid', 'qualcat']
+    xml_children = ['awardingbodyrole_set', 'qualificationsubject_set']
 
     # structure
     batch = models.ForeignKey('Batch', on_delete=models.CASCADE)
@@ -185,9 +207,6 @@ class Qualification(XMLStagingModel, models.Model):
     class Meta:
         db_table = 'data_futures_qualification'
 
-    def children(self) -> list[models.QuerySet]:
-        return [self.awardingbodyrole_set.all(), self.qualificationsubject_set.all()]
-
 
 class AwardingBodyRole(XMLStagingModel, models.Model):
     xml_fields = ['awardingbodyid']
@@ -248,9 +267,11 @@ class Student(XMLStagingModel, models.Model):
         'ttaccom',
         'ttpcode',
     ]
+    xml_children = ['disability_set', 'engagement_set']
 
     # structure
     batch = models.ForeignKey('Batch', on_delete=models.CASCADE)
+    student = models.IntegerField(null=True)  # source record, identifying the row when writing child entities
 
     # values
     sid = models.CharField(max_length=17)  # todo: slightly different than husid, will need generating
@@ -271,9 +292,6 @@ class Student(XMLStagingModel, models.Model):
     class Meta:
         db_table = 'data_futures_student'
 
-    def children(self) -> list[models.QuerySet]:
-        return [self.disability_set.all(), self.engagement_set.all()]
-
 
 class Disability(XMLStagingModel, models.Model):
     xml_fields = ['disability']
@@ -290,6 +308,7 @@ class Disability(XMLStagingModel, models.Model):
 
 class Engagement(XMLStagingModel, models.Model):
     xml_fields = ['numhus', 'engexpectedenddate', 'engstartdate', 'feeelig', 'rcstdnt']
+    xml_children = ['entryprofile_set', 'leaver_set', 'qualificationawarded_set', 'studentcoursesession_set']
 
     # structure
     student = models.ForeignKey('Student', on_delete=models.CASCADE)
@@ -305,14 +324,6 @@ class Engagement(XMLStagingModel, models.Model):
     class Meta:
         db_table = 'data_futures_engagement'
 
-    def children(self) -> list[models.QuerySet]:
-        return [
-            self.entryprofile_set.all(),
-            self.leaver_set.all(),
-            self.qualificationawarded_set.all(),
-            self.studentcoursesession_set.all(),
-        ]
-
 
 class EntryProfile(XMLStagingModel, models.Model):
     xml_fields = ['careleaver', 'highestqoe', 'pared', 'permaddcountry', 'permaddpostcode']
@@ -374,6 +385,12 @@ class StudentCourseSession(XMLStagingModel, models.Model):
         'sessionyearid',
         'yearprg',
     ]
+    xml_children = [
+        'fundingandmonitoring_set',
+        'moduleinstance_set',
+        'referenceperiodstudentload_set',
+        'studylocation_set',
+    ]
 
     # structure
     engagement = models.ForeignKey('Engagement', on_delete=models.CASCADE)
@@ -393,14 +410,6 @@ class StudentCourseSession(XMLStagingModel, models.Model):
     class Meta:
         db_table = 'data_futures_student_course_session'
 
-    def children(self) -> list[models.QuerySet]:
-        return [
-            self.fundingandmonitoring_set.all(),
-            self.moduleinstance_set.all(),
-            self.referenceperiodstudentload_set.all(),
-            self.studylocation_set.all(),
-        ]
-
 
 class FundingAndMonitoring(XMLStagingModel, models.Model):
     xml_fields = ['elq', 'fundcomp', 'fundlength', 'nonregfee']
@@ -501,3 +510,26 @@ class Venue(XMLStagingModel, models.Model):
 
     class Meta:
         db_table = 'data_futures_venue'
+
+
+def load_batch_graph(batch: Batch) -> None:
+    """Read the entire batch into memory, one query per staging table, so generating the XML doesn't issue a
+    query for each node's children"""
+    relations = []
+
+    def add_relations(parent: type[XMLStagingModel], batch_lookup: str) -> None:
+        for accessor in parent.xml_children:
+            rel = next(rel for rel in parent._meta.related_objects if rel.get_accessor_name() == accessor)
+            lookup = f'{rel.field.name}__{batch_lookup}' if batch_lookup else rel.field.name
+            relations.append(
+                ChildRelation(
+                    parent=parent,  # type: ignore
+                    queryset=rel.related_model.objects.filter(**{lookup: batch}),
+                    parent_field=rel.field.target_field.attname,
+                    child_field=rel.field.attname,
+                )
+            )
+            add_relations(rel.related_model, lookup)
+
+    add_relations(Batch, '')
+    load_graph(batch, relations)
@@ -0,0 +1,122 @@
+"""A local store of the Data Futures XSD schemas, one per collection year.
+
+Schemas are loaded from disk with the `loaddatafuturesschema` management command, so validation never needs network
+access.  Compiling a schema is slow, so compiled schemas are memoized for the life of the process, and recompiled
+only if the stored file changes.
+
+Besides the full schema, each year has an entity schema, in which every top-level entity (Student, Course...) is
+declared globally.  This lets each entity be validated as a document by itself, without the rest of the return.
+"""
+from __future__ import annotations
+
+import copy
+import itertools
+import shutil
+from pathlib import Path
+from typing import Callable, Iterator
+
+from lxml import etree
+
+from django.conf import settings
+
+XS = '{http://www.w3.org/2001/XMLSchema}'
+ROOT_ELEMENT = 'DataFutures'
+
+# {(academic_year, kind): (file modification time, compiled schema)}
+_compiled: dict[tuple[int, str], tuple[int, etree.XMLSchema]] = {}
+
+
+class SchemaNotFound(Exception):
+    pass
+
+
+def _schema_root() -> Path:
+    return settings.PROTECTED_MEDIA_ROOT / 'hesa_data_futures' / 'schemas'
+
+
+def schema_path(academic_year: int) -> Path:
+    """The stored schema for a collection year, e.g. 2022 for 2022-23"""
+    return _schema_root() / f'{academic_year}.xsd'
+
+
+def _parse(path: Path) -> etree._ElementTree:
+    return etree.parse(str(path), etree.XMLParser(no_network=True))
+
+
+def _compile(path: Path) -> etree.XMLSchema:
+    return etree.XMLSchema(_parse(path))
+
+
+def _entity_declarations(schema: etree._Element) -> Iterator[etree._Element]:
+    """Find the element declarations for the children of the root element"""
+    root = schema.find(f'{XS}element[@name="{ROOT_ELEMENT}"]')
+    if root is None:
+        return
+    content = root
+    if root.get('type'):
+        # The root's content is a named type, rather than declared inline
+        type_name = root.get('type').split(':')[-1]
+        content = schema.find(f'{XS}complexType[@name="{type_name}"]')
+        if content is None:
+            return
+    for element in content.iter(f'{XS}element'):
+        # Entities are the declarations with no other element declaration between them and the root's content
+        between = itertools.takewhile(lambda ancestor: ancestor is not content, element.iterancestors())
+        if element is not content and not any(ancestor.tag == f'{XS}element' for ancestor in between):
+            yield element
+
+
+def _compile_entities(path: Path) -> etree.XMLSchema:
+    """Compile a copy of the schema with each top-level entity promoted to a global declaration"""
+    document = _parse(path)
+    schema = document.getroot()
+    global_names = {element.get('name') for element in schema.iterfind(f'{XS}element')}
+    for element in list(_entity_declarations(schema)):
+        # Entities declared with ref= are already global
+        if element.get('name') and element.get('name') not in global_names:
+            declaration = copy.deepcopy(element)
+            # Occurrence constraints aren't allowed on global declarations
+            declaration.attrib.pop('minOccurs', None)
+            declaration.attrib.pop('maxOccurs', None)
+            schema.append(declaration)
+    return etree.XMLSchema(document)
+
+
+def install(source: Path, academic_year: int) -> Path:
+    """Copy a schema file into the store, replacing any existing schema for the year.
+
+    The schema is compiled first, so a broken file never replaces a working one
+    """
+    _compile(source)
+    path = schema_path(academic_year)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    shutil.copyfile(source, path)
+    for key in [key for key in _compiled if key[0] == academic_year]:
+        del _compiled[key]
+    return path
+
+
+def _get(academic_year: int, kind: str, compiler: Callable[[Path], etree.XMLSchema]) -> etree.XMLSchema:
+    path = schema_path(academic_year)
+    try:
+        modified = path.stat().st_mtime_ns
+    except FileNotFoundError:
+        raise SchemaNotFound(
+            f'No Data Futures schema is stored for {academic_year}.  Load one with `manage.py loaddatafuturesschema`'
+        )
+
+    key = (academic_year, kind)
+    memo = _compiled.get(key)
+    if memo is None or memo[0] != modified:
+        memo = _compiled[key] = (modified, compiler(path))
+    return memo[1]
+
+
+def get_schema(academic_year: int) -> etree.XMLSchema:
+    """Get the compiled schema for a collection year, compiling it only if it isn't already memoized"""
+    return _get(academic_year, 'document', _compile)
+
+
+def get_entity_schema(academic_year: int) -> etree.XMLSchema:
+    """Get the schema for validating a year's top-level entities one at a time"""
+    return _get(academic_year, 'entities', _compile_entities)
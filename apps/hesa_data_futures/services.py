@@ -4,11 +4,11 @@ import re
 from collections import defaultdict
 from dataclasses import dataclass
 from datetime import date
-from typing import Iterable, Optional
+from typing import Iterable, Optional, Sequence
 
 from celery_progress.backend import ProgressRecorder
 
-from django.db.models import F, FilteredRelation, Prefetch, Q, Subquery
+from django.db.models import F, FilteredRelation, ForeignKey, Model, Prefetch, Q, Subquery
 
 from apps.core.utils import strings
 from apps.enrolment.models import Enrolment
@@ -33,6 +33,19 @@ from .enums import (
 
 OVERSEAS_STUDY_LOCATION = 9
 
+# Number of entity rows written per INSERT statement
+BULK_CREATE_CHUNK_SIZE = 500
+
+# Fields identifying a parent entity within its batch, used to look up primary keys after a bulk insert
+PARENT_KEYS: dict[type[Model], str] = {
+    models.Course: 'courseid',
+    models.Module: 'modid',
+    models.Qualification: 'qualid',
+    models.Student: 'student',
+    models.Engagement: 'numhus',
+    models.StudentCourseSession: 'scsessionid',
+}
+
 
 @dataclass
 class ReferencePeriod:
@@ -58,11 +71,102 @@ def get_fte_in_reference_period(*, fte: float, start_date: date, end_date: date,
     return max((overlap / module_duration) * fte, 0)
 
 
+def get_reference_period_loads(
+    *,
+    qa_ids: Sequence[int],
+    ftes: Sequence[float],
+    start_dates: Sequence[date],
+    end_dates: Sequence[date],
+    ref_periods: list[ReferencePeriod],
+) -> dict[int, list[float]]:
+    """Calculate each qualification aim's student load in every reference period, from columns of enrolment data
+    covering the entire return: {qa_id: [load in each period]}
+
+    Gives the same totals as summing get_fte_in_reference_period() over each qualification aim's enrolments, but
+    converts each date to a day number just once, rather than doing date arithmetic for every enrolment and period
+    """
+    periods = [(period.start_date.toordinal(), period.end_date.toordinal()) for period in ref_periods]
+    loads: dict[int, list[float]] = {}
+    for qa_id, fte, start_date, end_date in zip(qa_ids, ftes, start_dates, end_dates):
+        start, end = start_date.toordinal(), end_date.toordinal()
+        module_duration = end - start + 1
+        totals = loads.setdefault(qa_id, [0] * len(periods))
+        for idx, (period_start, period_end) in enumerate(periods):
+            overlap = min(period_end - start, end - period_start) + 1
+            totals[idx] += max((overlap / module_duration) * fte, 0)
+    return loads
+
+
+class EntityGraph:
+    """Holds a batch's entities in memory, then writes them table by table, in dependency order, with bulk_create
+
+    Since bulk_create can't return primary keys on all backends, each parent table's keys are read back with a
+    single query (matching on PARENT_KEYS), before its children are written
+    """
+
+    def __init__(self, batch: models.Batch, *, chunk_size: int = BULK_CREATE_CHUNK_SIZE) -> None:
+        self.batch = batch
+        self.chunk_size = chunk_size
+        self.entities: defaultdict[type[Model], list[tuple[Model, Optional[Model]]]] = defaultdict(list)
+
+    def add(self, entity: Model, *, parent: Optional[Model] = None) -> Model:
+        """Queue an entity for writing, as a child of `parent`, or of the batch if no parent is given"""
+        self.entities[type(entity)].append((entity, parent))
+        return entity
+
+    def flush(self) -> None:
+        """Write every queued entity, parents before children"""
+        for model in sorted(self.entities, key=_depth):
+            rows = self.entities.pop(model)
+            parent_field = _parent_field(model)
+            for entity, parent in rows:
+                setattr(entity, parent_field.attname, parent.pk if parent else self.batch.pk)
+            entities = [entity for entity, _ in rows]
+            model.objects.bulk_create(entities, batch_size=self.chunk_size)  # type: ignore
+            if model in PARENT_KEYS:
+                self._read_primary_keys(model, entities)
+
+    def _read_primary_keys(self, model: type[Model], entities: list[Model]) -> None:
+        key = PARENT_KEYS[model]
+        field = model._meta.get_field(key)
+        primary_keys = dict(model.objects.filter(**{_batch_lookup(model): self.batch}).values_list(key, 'pk'))
+        for entity in entities:
+            # keys may have been assigned as a different type (e.g. an int for a CharField)
+            entity.pk = primary_keys[field.to_python(getattr(entity, key))]
+
+
+def _parent_field(model: type[Model]) -> ForeignKey:
+    """The foreign key linking an entity to its parent entity"""
+    return next(field for field in model._meta.fields if isinstance(field, ForeignKey))
+
+
+def _depth(model: type[Model]) -> int:
+    """How many levels an entity is below the batch"""
+    parent = _parent_field(model).related_model
+    return 1 if parent is models.Batch else _depth(parent) + 1
+
+
+def _batch_lookup(model: type[Model]) -> str:
+    """The lookup from an entity to its batch, e.g. engagement__student__batch"""
+    field = _parent_field(model)
+    if field.related_model is models.Batch:
+        return field.name
+    return f'{field.name}__{_batch_lookup(field.related_model)}'
+
+
 class HESAReturn:
-    def __init__(self, academic_year: int, created_by: str, *, recorder: Optional[ProgressRecorder] = None) -> None:
+    def __init__(
+        self,
+        academic_year: int,
+        created_by: str,
+        *,
+        recorder: Optional[ProgressRecorder] = None,
+        chunk_size: int = BULK_CREATE_CHUNK_SIZE,
+    ) -> None:
         self.academic_year = academic_year
         self.batch = models.Batch.objects.create(academic_year=self.academic_year, created_by=created_by)
         self.recorder = recorder
+        self.entities = EntityGraph(self.batch, chunk_size=chunk_size)
 
         # Universal base query
         # could potentially use other Models, but it sits nicely as the m2m between QA and Module
@@ -102,6 +206,8 @@ class HESAReturn:
         self.build_session_year()
         self.build_venue()
         self.build_students()
+        self.set_progress(2, 2, 'Saving entities')
+        self.entities.flush()
 
         self.batch.status = self.batch.Statuses.COMPLETE
         self.batch.save()
@@ -132,32 +238,44 @@ class HESAReturn:
             .distinct()
         )
 
+        # Every student's engagement data is loaded up front, rather than a set of queries per student
+        qualification_aims = self.get_qualification_aims()
+        student_loads = self.get_student_loads(qualification_aims)
+
         for idx, row in enumerate(results):
             self.set_progress(idx, len(results), 'Students')
-            hesa_student = self.batch.student_set.create(
-                sid=str(row.husid).zfill(13),
-                birthdte=row.birthdate,
-                ethnic=row.ethnicity.data_futures_code,
-                fnames=f"{row.firstname} {row.middlename or ''}".upper().strip(),
-                genderid=str(row.gender_identity_id).zfill(2),
-                nation=row.nationality.hesa_code.replace('ZZ', '97'),  # todo: swap this value post-legacy hesa
-                ownstu=row.sits_id or row.id,
-                religion=row.religion_or_belief.data_futures_code,
-                sexid=gender_to_sexid_map.get(row.gender, Sexes.NOT_AVAILABLE),
-                sexort=row.sexual_orientation.data_futures_code,
-                ssn=row.ssn,
-                surname=row.surname.upper().strip(),
-                ttaccom=str(row.termtime_accommodation).zfill(2) if row.termtime_accommodation else None,
-                ttpcode=correct_postcode(row.termtime_postcode or row.postcode),
+            hesa_student = self.entities.add(
+                models.Student(
+                    student=row.id,
+                    sid=str(row.husid).zfill(13),
+                    birthdte=row.birthdate,
+                    ethnic=row.ethnicity.data_futures_code,
+                    fnames=f"{row.firstname} {row.middlename or ''}".upper().strip(),
+                    genderid=str(row.gender_identity_id).zfill(2),
+                    nation=row.nationality.hesa_code.replace('ZZ', '97'),  # todo: swap this value post-legacy hesa
+                    ownstu=row.sits_id or row.id,
+                    religion=row.religion_or_belief.data_futures_code,
+                    sexid=gender_to_sexid_map.get(row.gender, Sexes.NOT_AVAILABLE),
+                    sexort=row.sexual_orientation.data_futures_code,
+                    ssn=row.ssn,
+                    surname=row.surname.upper().strip(),
+                    ttaccom=str(row.termtime_accommodation).zfill(2) if row.termtime_accommodation else None,
+                    ttpcode=correct_postcode(row.termtime_postcode or row.postcode),
+                )
+            )
+            self.build_student_engagements(
+                student=row,
+                parent=hesa_student,
+                qualification_aims=qualification_aims.get(row.id, []),
+                student_loads=student_loads,
             )
-            self.build_student_engagements(student=row, parent=hesa_student)
 
-    def build_student_engagements(self, *, student: Student, parent: models.Student) -> None:
-        """Generates the engagements for a single student"""
+    def get_qualification_aims(self) -> dict[int, list[QualificationAim]]:
+        """Loads every qualification aim in the return, with the year's enrolments and fees, grouped by student id"""
         in_query = self.base_query.values('qa__id')
 
         results = (
-            student.qualification_aims.filter(id__in=Subquery(in_query))
+            QualificationAim.objects.filter(id__in=Subquery(in_query))
             .select_related(
                 'programme__qualification',
                 'entry_qualification',
@@ -189,7 +307,37 @@ class HESAReturn:
             .distinct()
         )
 
+        grouped: defaultdict[int, list[QualificationAim]] = defaultdict(list)
         for row in results:
+            grouped[row.student_id].append(row)
+        return grouped
+
+    def get_student_loads(self, qualification_aims: dict[int, list[QualificationAim]]) -> dict[int, list[float]]:
+        """Calculates the reference period student loads for every qualification aim in the return at once"""
+        enrolments = [
+            (qa.id, enrolment.module)
+            for rows in qualification_aims.values()
+            for qa in rows
+            for enrolment in qa.returned_enrolments  # type: ignore
+        ]
+        return get_reference_period_loads(
+            qa_ids=[qa_id for qa_id, _ in enrolments],
+            ftes=[module.full_time_equivalent for _, module in enrolments],
+            start_dates=[module.start_date for _, module in enrolments],
+            end_dates=[module.end_date for _, module in enrolments],
+            ref_periods=self.reference_periods,
+        )
+
+    def build_student_engagements(
+        self,
+        *,
+        student: Student,
+        parent: models.Student,
+        qualification_aims: Iterable[QualificationAim],
+        student_loads: dict[int, list[float]],
+    ) -> None:
+        """Generates the engagements for a single student, from their pre-loaded qualification aims"""
+        for row in qualification_aims:
             numhus = get_numhus(qa_id=row.id, academic_year=self.academic_year)
             enrolments: Iterable[Enrolment] = row.returned_enrolments  # type: ignore
             reason_for_ending = get_reason_for_ending(enrolments=enrolments)
@@ -197,74 +345,90 @@ class HESAReturn:
             # todo: change to use a home_fees_eligible column on the student table, rather than is_eu
             home_fee_eligibility = HomeFeeEligibility.ELIGIBLE if student.is_eu else HomeFeeEligibility.NOT_ELIGIBLE
 
-            engagement = parent.engagement_set.create(
-                numhus=numhus,
-                engexpectedenddate=self.end_date,
-                engstartdate=min(enrolment.module.start_date for enrolment in enrolments),
-                feeelig=home_fee_eligibility,
-                # Required field for our Master's level courses, but we have no research council students
-                rcstdnt='9997' if row.programme.qualification.data_futures_code[0] in ('E', 'M') else None,
+            engagement = self.entities.add(
+                models.Engagement(
+                    numhus=numhus,
+                    engexpectedenddate=self.end_date,
+                    engstartdate=min(enrolment.module.start_date for enrolment in enrolments),
+                    feeelig=home_fee_eligibility,
+                    # Required field for our Master's level courses, but we have no research council students
+                    rcstdnt='9997' if row.programme.qualification.data_futures_code[0] in ('E', 'M') else None,
+                ),
+                parent=parent,
             )
 
-            engagement.entryprofile_set.create(
-                careleaver='99' if row.programme.qualification.data_futures_code.startswith('C') else None,
-                highestqoe=row.entry_qualification and row.entry_qualification.data_futures_code,
-                pared=str(student.parental_education.data_futures_code).zfill(2)
-                if row.programme.qualification.data_futures_code.startswith('C')
-                else None,
-                # todo: swap this value post-legacy hesa
-                permaddcountry=student.domicile.hesa_code.replace('ZZ', '97'),
-                permaddpostcode=correct_postcode(student.postcode) if student.domicile.in_uk else None,
+            self.entities.add(
+                models.EntryProfile(
+                    careleaver='99' if row.programme.qualification.data_futures_code.startswith('C') else None,
+                    highestqoe=row.entry_qualification and row.entry_qualification.data_futures_code,
+                    pared=str(student.parental_education.data_futures_code).zfill(2)
+                    if row.programme.qualification.data_futures_code.startswith('C')
+                    else None,
+                    # todo: swap this value post-legacy hesa
+                    permaddcountry=student.domicile.hesa_code.replace('ZZ', '97'),
+                    permaddpostcode=correct_postcode(student.postcode) if student.domicile.in_uk else None,
+                ),
+                parent=engagement,
             )
-            engagement.leaver_set.create(
-                engenddate=self.end_date,
-                rsnengend=reason_for_ending,
+            self.entities.add(
+                models.Leaver(
+                    engenddate=self.end_date,
+                    rsnengend=reason_for_ending,
+                ),
+                parent=engagement,
             )
             if reason_for_ending == EngagementEndReasons.AWARDED_CREDIT:
-                engagement.qualificationawarded_set.create(
-                    qualawardid=f'qual-award-{numhus}',
-                    qualid=get_qualid(row.programme),
+                self.entities.add(
+                    models.QualificationAwarded(
+                        qualawardid=f'qual-award-{numhus}',
+                        qualid=get_qualid(row.programme),
+                    ),
+                    parent=engagement,
                 )
 
             # Student course session and its children
-            student_course_session = engagement.studentcoursesession_set.create(
-                scsessionid=f'scs-{numhus}',
-                courseid=row.programme.id,
-                invoicefeeamount=get_netfee(enrolments=enrolments),
-                rsnscsend='04',  # session ended
-                scsenddate=self.end_date,
-                scsstartdate=self.start_date,
-                sessionyearid='short-course-year',
+            student_course_session = self.entities.add(
+                models.StudentCourseSession(
+                    scsessionid=f'scs-{numhus}',
+                    courseid=row.programme.id,
+                    invoicefeeamount=get_netfee(enrolments=enrolments),
+                    rsnscsend='04',  # session ended
+                    scsenddate=self.end_date,
+                    scsstartdate=self.start_date,
+                    sessionyearid='short-course-year',
+                ),
+                parent=engagement,
             )
 
             elq = get_elq(qa=row)
-            student_course_session.fundingandmonitoring_set.create(
-                elq=elq,
-                fundcomp=get_funding_completion(enrolments=enrolments),
+            self.entities.add(
+                models.FundingAndMonitoring(
+                    elq=elq,
+                    fundcomp=get_funding_completion(enrolments=enrolments),
+                ),
+                parent=student_course_session,
             )
 
             # todo: proper investigation into the what rules determine returning a FundingBody record.
             #  currently, this just approximates legacy HESA's FUNDCODE logic
             if elq == ELQValues.NOT_ELQ and home_fee_eligibility == HomeFeeEligibility.ELIGIBLE:
-                student_course_session.fundingbody_set.create(
-                    fundingbody="5016",  # Office for Students
+                self.entities.add(
+                    models.FundingBody(
+                        fundingbody="5016",  # Office for Students
+                    ),
+                    parent=student_course_session,
                 )
 
-            for reference_period in self.reference_periods:
-                student_load = 0
-                for enrolment in enrolments:
-                    # Tally up the FTE of all the enrolments
-                    student_load += get_fte_in_reference_period(
-                        fte=enrolment.module.full_time_equivalent,
-                        start_date=enrolment.module.start_date,
-                        end_date=enrolment.module.end_date,
-                        ref_period=reference_period,
-                    )
+            # The FTE of all the enrolments, tallied by reference period
+            for reference_period, student_load in zip(self.reference_periods, student_loads.get(row.id, [])):
                 if student_load:
-                    student_course_session.referenceperiodstudentload_set.create(
-                        refperiod=reference_period.code,
-                        year=self.academic_year,
-                        rpstuload=student_load,
+                    self.entities.add(
+                        models.ReferencePeriodStudentLoad(
+                            refperiod=reference_period.code,
+                            year=self.academic_year,
+                            rpstuload=student_load,
+                        ),
+                        parent=student_course_session,
                     )
 
             # Todo: Currently assuming a single venue (Rewley), with 100% proportion.
@@ -272,21 +436,27 @@ class HESAReturn:
             #  we'll need a routine to loop through the enrolments, and figure the proportion of the total for each
             #  venue.  It'd be fairly easy if it were a many-to-one relationship with programmes.
             distance_learning = row.study_location_id == OVERSEAS_STUDY_LOCATION
-            student_course_session.studylocation_set.create(
-                studylocid=f'study-location-{numhus}',
-                distance=DistanceValues.IN_UK if distance_learning else None,
-                studyproportion=100,
-                venueid=None if distance_learning else 'rewley-house',
+            self.entities.add(
+                models.StudyLocation(
+                    studylocid=f'study-location-{numhus}',
+                    distance=DistanceValues.IN_UK if distance_learning else None,
+                    studyproportion=100,
+                    venueid=None if distance_learning else 'rewley-house',
+                ),
+                parent=student_course_session,
             )
 
             for enrolment in enrolments:
-                student_course_session.moduleinstance_set.create(
-                    modinstid=enrolment.id,
-                    mifeeamount=sum(line.amount for line in enrolment.fee_ledger_items if line.amount > 0),
-                    modid=enrolment.module.code,
-                    modinstenddate=enrolment.module.start_date,
-                    modinststartdate=enrolment.module.end_date,
-                    moduleoutcome=enrolment.result.data_futures_outcome,
+                self.entities.add(
+                    models.ModuleInstance(
+                        modinstid=enrolment.id,
+                        mifeeamount=sum(line.amount for line in enrolment.fee_ledger_items if line.amount > 0),
+                        modid=enrolment.module.code,
+                        modinstenddate=enrolment.module.start_date,
+                        modinststartdate=enrolment.module.end_date,
+                        moduleoutcome=enrolment.result.data_futures_outcome,
+                    ),
+                    parent=student_course_session,
                 )
 
     def build_modules(self) -> None:
@@ -305,25 +475,33 @@ class HESAReturn:
         )
 
         for row in results:
-            module = self.batch.module_set.create(
-                modid=row.code,
-                crdtpts=str(row.credit_points).zfill(3),
-                fte=row.full_time_equivalent,
-                levlpts=row.points_level and row.points_level.data_futures_code,
-                mtitle=strings.normalize_to_latin1(row.title),
+            module = self.entities.add(
+                models.Module(
+                    modid=row.code,
+                    crdtpts=str(row.credit_points).zfill(3),
+                    fte=row.full_time_equivalent,
+                    levlpts=row.points_level and row.points_level.data_futures_code,
+                    mtitle=strings.normalize_to_latin1(row.title),
+                )
             )
             # while we still derive cost centre from subject, we need to sum up percents if cost centres are the same
             cost_centres: defaultdict[int, int] = defaultdict(lambda: 0)
             for module_subject in row.module_hecos_subjects.all():
-                module.modulesubject_set.create(
-                    modsbj=module_subject.hecos_subject_id,
-                    modproportion=module_subject.percentage,
+                self.entities.add(
+                    models.ModuleSubject(
+                        modsbj=module_subject.hecos_subject_id,
+                        modproportion=module_subject.percentage,
+                    ),
+                    parent=module,
                 )
                 cost_centres[module_subject.hecos_subject.cost_centre_id] += module_subject.percentage
             for cost_centre, percentage in cost_centres.items():
-                module.modulecostcentre_set.create(
-                    costcn=cost_centre,
-                    costcnproportion=percentage,
+                self.entities.add(
+                    models.ModuleCostCentre(
+                        costcn=cost_centre,
+                        costcnproportion=percentage,
+                    ),
+                    parent=module,
                 )
 
     def build_courses(self) -> None:
@@ -334,7 +512,7 @@ class HESAReturn:
         results = (
             Programme.objects.filter(id__in=Subquery(in_query))
             .select_related('qualification')
-            .prefetch_related('hecos_subjects')
+            .prefetch_related('programmehecossubject_set')
             .order_by('id')
             .distinct()
         )
@@ -342,43 +520,54 @@ class HESAReturn:
         for row in results:
             # Create a qualification for the programme
             qualid = get_qualid(row)
-            qualification = self.batch.qualification_set.create(
-                qualid=qualid,
-                qualcat=row.qualification.data_futures_code,
+            qualification = self.entities.add(
+                models.Qualification(
+                    qualid=qualid,
+                    qualcat=row.qualification.data_futures_code,
+                )
             )
             # Child records for the qualification
-            qualification.awardingbodyrole_set.create()
+            self.entities.add(models.AwardingBodyRole(), parent=qualification)
             for subject in row.programmehecossubject_set.all():
-                qualification.qualificationsubject_set.create(
-                    qualsubject=subject.hecos_subject_id,
-                    qualproportion=subject.percentage,
+                self.entities.add(
+                    models.QualificationSubject(
+                        qualsubject=subject.hecos_subject_id,
+                        qualproportion=subject.percentage,
+                    ),
+                    parent=qualification,
                 )
             # And the course itself
-            course = self.batch.course_set.create(
-                courseid=row.id,
-                coursetitle=row.title,
-                prerequisite='02' if row.qualification.is_postgraduate else '01',
-                qualid=qualid,
+            course = self.entities.add(
+                models.Course(
+                    courseid=row.id,
+                    coursetitle=row.title,
+                    prerequisite='02' if row.qualification.is_postgraduate else '01',
+                    qualid=qualid,
+                )
             )
-            course.courserole_set.create()
+            self.entities.add(models.CourseRole(), parent=course)
 
     def build_session_year(self):
         """Generates a standardized SessionYear entity"""
 
-        self.batch.sessionyear_set.create(
-            sessionyearid='short-course-year',
-            systartdate=self.start_date,
-            syenddate=self.end_date,
+        self.entities.add(
+            models.SessionYear(
+                sessionyearid='short-course-year',
+                systartdate=self.start_date,
+                syenddate=self.end_date,
+            )
         )
 
     def build_venue(self):
         """Generates a standardized Venue entity"""
 
-        self.batch.venue_set.create(
-            venueid='rewley-house',
-            postcode='OX1 2JA',
-            venuename='Department for Continuing Education, Rewley House',
-            venueukprn=models.INSTITUTION_CODE,
+        self.entities.add(
+            models.Venue(
+                venueid='rewley-house',
+                postcode='OX1 2JA',
+                venuename='Department for Continuing Education, Rewley House',
+                venueukprn=models.INSTITUTION_CODE,
+            )
         )
 
 
@@ -1,21 +1,40 @@
+from typing import Optional
+
 from celery_progress.backend import ProgressRecorder
+from lxml import etree
 
 from redpot.celery import app
 
 from . import models, services, xml
 
 
+def _write_xml(batch: models.Batch, *, streaming: bool) -> tuple[str, Optional[etree.Element]]:
+    """Save a batch's xml, returning the filename and, if it was built in memory, the tree"""
+    if streaming:
+        return xml.stream_xml(batch), None
+    tree = xml.generate_tree(batch)
+    return xml.save_xml(batch_id=batch.id, tree=tree), tree
+
+
+def _validate_xml(batch: models.Batch, path: str, tree: Optional[etree.Element]) -> dict[str, int]:
+    """Validate the tree if we have it, otherwise the saved file, entity by entity"""
+    if tree is None:
+        return xml.validate_file(batch, path)
+    # Only file validation locates its errors, so clear any from an earlier build
+    batch.schemaerror_set.all().delete()
+    return xml.validate_xml(tree, batch.academic_year)
+
+
 @app.task(name='create_data_futures_return', bind=True)
-def create_return(self, *, academic_year: int, created_by: str):
+def create_return(self, *, academic_year: int, created_by: str, streaming: bool = True):
     recorder = ProgressRecorder(self)
     batch = services.HESAReturn(academic_year, created_by, recorder=recorder).create()
 
     recorder.set_progress(current=2, total=3, description='Generating XML')
-    tree = xml.generate_tree(batch)
-    path = xml.save_xml(batch_id=batch.id, tree=tree)
+    path, tree = _write_xml(batch, streaming=streaming)
 
     recorder.set_progress(current=2, total=3, description='Validating XML schema')
-    errors = xml.validate_xml(tree)
+    errors = _validate_xml(batch, path, tree)
 
     batch.filename = path
     batch.errors = errors
@@ -25,16 +44,15 @@ def create_return(self, *, academic_year: int, created_by: str):
 
 
 @app.task(name='create_data_futures_xml', bind=True)
-def create_hesa_xml(self, *, batch_id: int):
+def create_hesa_xml(self, *, batch_id: int, streaming: bool = True):
     recorder = ProgressRecorder(self)
     batch = models.Batch.objects.get(pk=batch_id)
 
     recorder.set_progress(current=1, total=2, description='Generating XML')
-    tree = xml.generate_tree(batch)
-    path = xml.save_xml(batch_id=batch.id, tree=tree)
+    path, tree = _write_xml(batch, streaming=streaming)
 
     recorder.set_progress(current=2, total=2, description='Validating XML schema')
-    errors = xml.validate_xml(tree)
+    errors = _validate_xml(batch, path, tree)
 
     batch.filename = path
     batch.errors = errors
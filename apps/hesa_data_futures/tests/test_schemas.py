@@ -0,0 +1,145 @@
+import io
+import tempfile
+from pathlib import Path
+from unittest.mock import patch
+
+from lxml import etree
+
+from django import test
+from django.core.management import CommandError, call_command
+
+from .. import models, schemas, xml
+
+SCHEMA = b'''<?xml version="1.0"?>
+<xs:schema xmlns:xs="http://www.w3.org/2001/XMLSchema">
+  <xs:element name="DataFutures">
+    <xs:complexType>
+      <xs:sequence>
+        <xs:element name="Student" minOccurs="0" maxOccurs="unbounded">
+          <xs:complexType>
+            <xs:sequence>
+              <xs:element name="SID" type="xs:string"/>
+              <xs:element name="SURNAME" type="xs:string"/>
+            </xs:sequence>
+          </xs:complexType>
+        </xs:element>
+        <xs:element name="Venue" minOccurs="0" maxOccurs="unbounded"/>
+      </xs:sequence>
+    </xs:complexType>
+  </xs:element>
+</xs:schema>
+'''
+
+# The same schema, with the root's content declared as a named type
+NAMED_TYPE_SCHEMA = b'''<?xml version="1.0"?>
+<xs:schema xmlns:xs="http://www.w3.org/2001/XMLSchema">
+  <xs:element name="DataFutures" type="DataFuturesType"/>
+  <xs:complexType name="DataFuturesType">
+    <xs:sequence>
+      <xs:element name="Student" minOccurs="0" maxOccurs="unbounded">
+        <xs:complexType>
+          <xs:sequence>
+            <xs:element name="SID" type="xs:string"/>
+            <xs:element name="SURNAME" type="xs:string"/>
+          </xs:sequence>
+        </xs:complexType>
+      </xs:element>
+      <xs:element name="Venue" minOccurs="0" maxOccurs="unbounded"/>
+    </xs:sequence>
+  </xs:complexType>
+</xs:schema>
+'''
+
+
+class SchemaStoreMixin:
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        media_root = test.override_settings(PROTECTED_MEDIA_ROOT=Path(media.name))
+        media_root.enable()
+        self.addCleanup(media_root.disable)
+        memo = patch.dict(schemas._compiled, clear=True)
+        memo.start()
+        self.addCleanup(memo.stop)
+
+        self.source = Path(media.name) / 'downloaded.xsd'
+        self.source.write_bytes(SCHEMA)
+
+
+class TestSchemaStore(SchemaStoreMixin, test.SimpleTestCase):
+    def test_validates_against_stored_schema(self):
+        call_command('loaddatafuturesschema', 2022, str(self.source), stdout=io.StringIO())
+        valid = '<DataFutures><Student><SID>1</SID><SURNAME>Smith</SURNAME></Student><Venue/></DataFutures>'
+        self.assertEqual(xml.validate_xml(etree.fromstring(valid), 2022), {})
+        errors = xml.validate_xml(etree.fromstring('<DataFutures><Course/></DataFutures>'), 2022)
+        self.assertEqual(sum(errors.values()), 1)
+
+    def test_compiled_schema_memoized(self):
+        schemas.install(self.source, 2022)
+        with patch.object(schemas, '_compile', wraps=schemas._compile) as compile_:
+            self.assertIs(schemas.get_schema(2022), schemas.get_schema(2022))
+        compile_.assert_called_once()
+
+    def test_reloaded_schema_recompiled(self):
+        schemas.install(self.source, 2022)
+        first = schemas.get_schema(2022)
+        schemas.install(self.source, 2022)
+        self.assertIsNot(schemas.get_schema(2022), first)
+
+    def test_missing_year(self):
+        schemas.install(self.source, 2022)
+        with self.assertRaises(schemas.SchemaNotFound):
+            schemas.get_schema(2023)
+
+    def test_invalid_schema_not_loaded(self):
+        self.source.write_bytes(b'<DataFutures/>')
+        with self.assertRaises(CommandError):
+            call_command('loaddatafuturesschema', 2022, str(self.source))
+        self.assertFalse(schemas.schema_path(2022).exists())
+
+
+class TestFileValidation(SchemaStoreMixin, test.TestCase):
+    def setUp(self):
+        super().setUp()
+        schemas.install(self.source, 2022)
+        self.batch = models.Batch.objects.create(academic_year=2022)
+
+    def _validate(self, document: str) -> dict[str, int]:
+        filename = 'batch.xml'
+        xml._file_path(filename).write_text(document)
+        return xml.validate_file(self.batch, filename)
+
+    def test_errors_located_by_entity(self):
+        summary = self._validate(
+            """<DataFutures>
+  <Student><SID>1</SID><SURNAME>Smith</SURNAME></Student>
+  <Student><SID>2</SID></Student>
+  <Venue/>
+  <Student><SID>3</SID><SURNAME>Jones</SURNAME><FNAMES>Ann</FNAMES></Student>
+</DataFutures>"""
+        )
+        errors = self.batch.schemaerror_set.order_by('pk')
+        self.assertEqual(
+            [(error.entity, error.key, error.line) for error in errors], [('Student', '2', 3), ('Student', '3', 5)]
+        )
+        self.assertEqual(sum(summary.values()), 2)
+
+    def test_matches_document_validation(self):
+        document = '<DataFutures><Student><SID>1</SID></Student><Student/><Venue/></DataFutures>'
+        self.assertEqual(self._validate(document), xml.validate_xml(etree.fromstring(document), 2022))
+
+    def test_named_root_type(self):
+        self.source.write_bytes(NAMED_TYPE_SCHEMA)
+        schemas.install(self.source, 2022)
+        self.assertEqual(
+            [element.get('name') for element in schemas._entity_declarations(etree.XML(NAMED_TYPE_SCHEMA))],
+            ['Student', 'Venue'],
+        )
+        self._validate('<DataFutures><Student><SID>1</SID></Student><Venue/></DataFutures>')
+        errors = self.batch.schemaerror_set.all()
+        self.assertEqual([(error.entity, error.key) for error in errors], [('Student', '1')])
+
+    def test_revalidation_replaces_errors(self):
+        self._validate('<DataFutures><Student/></DataFutures>')
+        self._validate('<DataFutures><Venue/></DataFutures>')
+        self.assertFalse(self.batch.schemaerror_set.exists())
@@ -0,0 +1,142 @@
+import random
+from datetime import date, timedelta
+
+from django import test
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from apps.enrolment.tests.factories import EnrolmentFactory
+from apps.module.tests.factories import ModuleFactory
+from apps.programme.models import Qualification
+from apps.programme.tests.factories import ProgrammeFactory
+from apps.qualification_aim.models import AT_PROVIDER_STUDY_LOCATION, QualificationAim
+from apps.qualification_aim.tests.factories import QualificationAimFactory
+from apps.student.tests.factories import StudentFactory
+
+from .. import models, services
+
+INSTITUTIONAL_CREDIT_QUALIFICATION = 61
+CONFIRMED_STATUS = 10
+ENGLAND_DOMICILE = 240
+PASSED_RESULT = 1
+
+
+def add_students(count: int, *, modules_each: int = 1) -> None:
+    """Create a number of returnable students, each with a qualification aim and enrolments"""
+    # the qualification fixture doesn't yet include data futures codes
+    Qualification.objects.filter(pk=INSTITUTIONAL_CREDIT_QUALIFICATION).update(data_futures_code='C90')
+    programme = ProgrammeFactory(qualification_id=INSTITUTIONAL_CREDIT_QUALIFICATION)
+    for _ in range(count):
+        qa = QualificationAimFactory(
+            student=StudentFactory(domicile_id=ENGLAND_DOMICILE, gender='F'),
+            programme=programme,
+            study_location_id=AT_PROVIDER_STUDY_LOCATION,
+        )
+        for _ in range(modules_each):
+            EnrolmentFactory(
+                qa=qa,
+                module=ModuleFactory(credit_points=10, start_date='2021-01-01', end_date='2021-03-01'),
+                status_id=CONFIRMED_STATUS,
+                result_id=PASSED_RESULT,
+            )
+
+
+class TestBuildStudents(test.TestCase):
+    @staticmethod
+    def _engagement_reads(hesa_return: services.HESAReturn) -> int:
+        """Count the queries reading qualification aims, enrolments and fees while building students"""
+        with CaptureQueriesContext(connection) as context:
+            hesa_return.build_students()
+            hesa_return.entities.flush()
+        tables = [f'FROM {connection.ops.quote_name(table)}' for table in ('qa', 'enrolment', 'ledger')]
+        return sum(
+            1
+            for query in context.captured_queries
+            if query['sql'].startswith('SELECT') and any(table in query['sql'] for table in tables)
+        )
+
+    def test_engagement_queries_independent_of_student_count(self):
+        add_students(1)
+        small_batch = self._engagement_reads(services.HESAReturn(2020, 'test'))
+        add_students(4)
+        large_batch = self._engagement_reads(services.HESAReturn(2020, 'test'))
+        self.assertEqual(small_batch, large_batch)
+
+    def test_engagements_grouped_by_student(self):
+        add_students(3, modules_each=2)
+        hesa_return = services.HESAReturn(2020, 'test')
+        hesa_return.build_students()
+        hesa_return.entities.flush()
+
+        for student in hesa_return.batch.student_set.all():
+            engagement = student.engagement_set.get()
+            session = engagement.studentcoursesession_set.get()
+            self.assertEqual(session.moduleinstance_set.count(), 2)
+        self.assertEqual(models.Engagement.objects.filter(student__batch=hesa_return.batch).count(), 3)
+
+
+class TestEntityGraph(test.TestCase):
+    def test_query_count_independent_of_student_count(self):
+        """Every entity table is written in bulk, so the whole return takes a fixed number of queries"""
+        add_students(1)
+        with CaptureQueriesContext(connection) as small_batch:
+            services.HESAReturn(2020, 'test').create()
+        add_students(4, modules_each=2)
+        with CaptureQueriesContext(connection) as large_batch:
+            services.HESAReturn(2020, 'test').create()
+
+        self.assertEqual(len(small_batch), len(large_batch))
+
+    def test_children_linked_to_parents(self):
+        add_students(2, modules_each=2)
+        batch = services.HESAReturn(2020, 'test').create()
+
+        for student in batch.student_set.all():
+            engagement = student.engagement_set.get()
+            qa_id = int(engagement.numhus.split('-')[0])
+            self.assertEqual(QualificationAim.objects.get(pk=qa_id).student_id, student.student)
+            session = engagement.studentcoursesession_set.get()
+            self.assertEqual(session.moduleinstance_set.count(), 2)
+
+
+class TestReferencePeriodLoads(test.SimpleTestCase):
+    ref_periods = services.ReferencePeriod.from_academic_year(2020)
+
+    def _scalar_loads(self, enrolments: list[tuple[int, float, date, date]]) -> dict[int, list[float]]:
+        loads: dict[int, list[float]] = {}
+        for qa_id, fte, start_date, end_date in enrolments:
+            totals = loads.setdefault(qa_id, [0] * len(self.ref_periods))
+            for idx, ref_period in enumerate(self.ref_periods):
+                totals[idx] += services.get_fte_in_reference_period(
+                    fte=fte, start_date=start_date, end_date=end_date, ref_period=ref_period
+                )
+        return loads
+
+    def test_matches_scalar_calculation(self):
+        """Check the batch calculation against get_fte_in_reference_period() for many random returns"""
+        rng = random.Random(2020)
+        year_start = date(2020, 8, 1)
+        for _ in range(200):
+            enrolments = []
+            for _ in range(rng.randint(0, 30)):
+                # Modules may start before the year, and end after it
+                start_date = year_start + timedelta(days=rng.randint(-60, 400))
+                end_date = start_date + timedelta(days=rng.choice([0, 1, rng.randint(0, 300)]))
+                fte = rng.choice([0, rng.random(), round(rng.uniform(0, 1), 3)])
+                enrolments.append((rng.randint(1, 5), fte, start_date, end_date))
+
+            qa_ids, ftes, start_dates, end_dates = zip(*enrolments) if enrolments else ([], [], [], [])
+            loads = services.get_reference_period_loads(
+                qa_ids=qa_ids, ftes=ftes, start_dates=start_dates, end_dates=end_dates, ref_periods=self.ref_periods
+            )
+            self.assertEqual(loads, self._scalar_loads(enrolments))
+
+    def test_module_spanning_periods(self):
+        loads = services.get_reference_period_loads(
+            qa_ids=[1],
+            ftes=[1],
+            start_dates=[date(2020, 11, 6)],
+            end_dates=[date(2020, 11, 25)],
+            ref_periods=self.ref_periods,
+        )
+        self.assertEqual(loads, {1: [0.5, 0.5, 0]})
@@ -0,0 +1,99 @@
+import io
+from datetime import date
+from unittest.mock import patch
+
+from lxml import etree
+
+from django import test
+
+from .. import models, xml
+
+
+def _create_student(batch: models.Batch, number: int) -> None:
+    """Create a student with a complete set of descendant records"""
+    student = models.Student.objects.create(
+        batch=batch,
+        sid=f'{number:017}',
+        fnames='Ann',
+        surname='Smith',
+        genderid='01',
+        nation='GB',
+        ownstu=number,
+        religion=1,
+        sexid=1,
+        sexort=1,
+    )
+    models.Disability.objects.create(student=student, disability=96)
+    engagement = models.Engagement.objects.create(
+        student=student,
+        numhus=number,
+        engexpectedenddate=date(2023, 7, 31),
+        engstartdate=date(2022, 8, 1),
+        feeelig='01',
+    )
+    models.EntryProfile.objects.create(engagement=engagement, permaddcountry='XF')
+    models.Leaver.objects.create(engagement=engagement, engenddate=date(2023, 7, 31), rsnengend='01')
+    models.QualificationAwarded.objects.create(engagement=engagement, qualawardid=1, qualid=1)
+    session = models.StudentCourseSession.objects.create(
+        engagement=engagement,
+        scsessionid=1,
+        courseid=1,
+        scsstartdate=date(2022, 8, 1),
+        sessionyearid=2022,
+    )
+    models.FundingAndMonitoring.objects.create(student_course_session=session)
+    models.ModuleInstance.objects.create(
+        student_course_session=session, modinstid=number, modid='M1', modinststartdate=date(2022, 9, 1)
+    )
+    models.ReferencePeriodStudentLoad.objects.create(
+        student_course_session=session, refperiod='01', year=2022, rpstuload=10
+    )
+    models.StudyLocation.objects.create(student_course_session=session, studylocid=1, studyproportion=100)
+
+
+class TestBatchGraph(test.TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.batch = models.Batch.objects.create(academic_year=2022)
+        course = models.Course.objects.create(batch=cls.batch, courseid=1, coursetitle='Course', prerequisite='01')
+        models.CourseRole.objects.create(course=course)
+        module = models.Module.objects.create(batch=cls.batch, modid='M1', crdtpts=10, fte=5, mtitle='Module')
+        models.ModuleCostCentre.objects.create(module=module, costcnproportion=100)
+        models.ModuleSubject.objects.create(module=module, modsbj=100001, modproportion=100)
+        qualification = models.Qualification.objects.create(batch=cls.batch, qualid=1, qualcat='C1')
+        models.AwardingBodyRole.objects.create(qualification=qualification)
+        models.QualificationSubject.objects.create(qualification=qualification, qualsubject=1, qualproportion=100)
+        models.SessionYear.objects.create(
+            batch=cls.batch, sessionyearid=2022, syenddate=date(2023, 7, 31), systartdate=date(2022, 8, 1)
+        )
+        models.Venue.objects.create(batch=cls.batch, venueid=1, postcode='OX1 2JA', venuename='Rewley House')
+        _create_student(cls.batch, 1)
+
+    def _unloaded_tree(self) -> bytes:
+        batch = models.Batch.objects.get(pk=self.batch.pk)
+        return etree.tostring(xml._model_to_node(batch))
+
+    def test_query_count_independent_of_batch_size(self):
+        # One query per staging table, however many students are in the batch
+        batch = models.Batch.objects.get(pk=self.batch.pk)
+        with self.assertNumQueries(21):
+            xml.generate_tree(batch)
+
+        for number in range(2, 10):
+            _create_student(self.batch, number)
+        batch = models.Batch.objects.get(pk=self.batch.pk)
+        with self.assertNumQueries(21):
+            xml.generate_tree(batch)
+
+    def test_loaded_graph_matches_queries(self):
+        _create_student(self.batch, 2)
+        tree = xml.generate_tree(models.Batch.objects.get(pk=self.batch.pk))
+        self.assertEqual(etree.tostring(tree), self._unloaded_tree())
+
+    def test_streamed_xml_matches_tree(self):
+        expected = etree.tostring(xml.generate_tree(models.Batch.objects.get(pk=self.batch.pk)), pretty_print=True)
+
+        output = io.BytesIO()
+        with patch('apps.hesa_data_futures.xml.open', return_value=output), patch.object(output, 'close'):
+            xml.stream_xml(models.Batch.objects.get(pk=self.batch.pk))
+        self.assertEqual(output.getvalue(), expected)
@@ -13,7 +13,7 @@ from django.views import generic
 
 from apps.core.utils.views import PageTitleMixin
 
-from . import forms, models, tasks
+from . import datatables, forms, models, tasks
 
 
 class List(PermissionRequiredMixin, PageTitleMixin, generic.ListView):
@@ -58,7 +58,7 @@ class View(PermissionRequiredMixin, PageTitleMixin, tables.views.SingleTableMixi
 
 
 class Errors(PermissionRequiredMixin, PageTitleMixin, tables.views.SingleTableMixin, generic.DetailView):
-    """Generic datatable to view all the records in any of the hesa tables"""
+    """Pages through a batch's schema errors, by entity.  Batches validated in memory only have a summary of errors"""
 
     permission_required = 'hesa.view_batch'
     model = models.Batch
@@ -67,6 +67,10 @@ class Errors(PermissionRequiredMixin, PageTitleMixin, tables.views.SingleTableMi
     subtitle = 'Schema errors'
 
     def get_table(self, **kwargs) -> tables.Table:
+        errors = self.object.schemaerror_set.order_by('pk')
+        if errors.exists():
+            return datatables.SchemaErrorTable(data=errors, request=self.request)
+
         class ErrorTable(tables.Table):
             error = tables.Column()
             count = tables.Column()
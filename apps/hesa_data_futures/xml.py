@@ -2,37 +2,77 @@ from __future__ import annotations
 
 import itertools
 from collections import Counter
-from urllib.request import urlopen
+from pathlib import Path
 
 from lxml import etree
 
 from django.conf import settings
 
-from apps.hesa_data_futures import models
+from apps.core.utils import xml
+from apps.hesa_data_futures import models, schemas
 
+VALIDATION_CHUNK_SIZE = 500
 
-def save_xml(batch_id: int, tree: etree.Element) -> str:
-    """Save the an xml tree to the protected media folder"""
+# The element identifying each top-level entity, to locate validation errors
+ENTITY_KEYS = {
+    'Course': 'COURSEID',
+    'Module': 'MODID',
+    'Qualification': 'QUALID',
+    'SessionYear': 'SESSIONYEARID',
+    'Student': 'SID',
+    'Venue': 'VENUEID',
+}
+
+
+def _file_path(filename: str) -> Path:
     # create the media subfolder if required
     file_path = settings.PROTECTED_MEDIA_ROOT / 'hesa_data_futures'
     file_path.mkdir(parents=True, exist_ok=True)
+    return file_path / filename
+
+
+def _filename(batch_id: int) -> str:
+    return f'conted_data_futures_batch_{batch_id}.xml'
+
 
-    filename = f'conted_data_futures_batch_{batch_id}.xml'
-    fullpath = file_path / filename
-    with open(fullpath, 'w') as f:
+def save_xml(batch_id: int, tree: etree.Element) -> str:
+    """Save the an xml tree to the protected media folder"""
+    filename = _filename(batch_id)
+    with open(_file_path(filename), 'w') as f:
         xml_string = etree.tostring(tree, pretty_print=True).decode('utf8')
         f.write(xml_string)
     return filename
 
 
+def stream_xml(batch: models.Batch) -> str:
+    """Serialize a batch straight to the protected media folder, one node at a time.
+
+    Produces the same file as save_xml(generate_tree()), without holding the tree in memory
+    """
+    filename = _filename(batch.id)
+    models.load_batch_graph(batch)
+    with open(_file_path(filename), 'wb') as f:
+        xml.write_document(f, batch, field_nodes=_field_nodes)
+    return filename
+
+
+def _field_nodes(model: models.XMLStagingModel) -> list[etree.Element]:
+    """Create the value elements of a model's node"""
+    nodes = []
+    for column in model.xml_fields:
+        value = getattr(model, column)
+        if value is not None:
+            node = etree.Element(column.upper())
+            node.text = str(value)
+            nodes.append(node)
+    return nodes
+
+
 def _model_to_node(model: models.XMLStagingModel) -> etree.Element:
     """Recursively convert an XMLStagingModel and its children into an xml tree"""
     node = etree.Element(model.element_name)
     # Fill with elements
-    for column in model.xml_fields:
-        value = getattr(model, column)
-        if value is not None:
-            etree.SubElement(node, column.upper()).text = str(value)
+    node.extend(_field_nodes(model))
 
     # Create subnodes if any exist
     for child in itertools.chain.from_iterable(model.children()):
@@ -43,21 +83,61 @@ def _model_to_node(model: models.XMLStagingModel) -> etree.Element:
 
 def generate_tree(batch: models.Batch) -> etree.Element:
     """Serialize an entire batch as an XML tree"""
+    models.load_batch_graph(batch)
     return _model_to_node(batch)
 
 
-def validate_xml(tree: etree.Element) -> dict[str, int]:
-    """Validates the produced XML, and produces a dictionary of the errors: {description: count}"""
-
-    # todo: using a hardcoded XSD url for 2022-23.  This will need to be dynamic in order to get the year's rules
-    xsd_path = 'https://hesacodingmanualprod.blob.core.windows.net/strapi-files/assets/22056_1_3_0_103f2e1c86.xsd'
-
-    # etree can only natively deal with http, so we get the XSD via urllib
-    xmlschema_doc = etree.parse(urlopen(xsd_path))
-    xmlschema = etree.XMLSchema(xmlschema_doc)
+def validate_xml(tree: etree.Element, academic_year: int) -> dict[str, int]:
+    """Validates the produced XML against the year's stored schema, and produces a dictionary of the errors:
+    {description: count}"""
+    xmlschema = schemas.get_schema(academic_year)
 
     try:
         xmlschema.assertValid(tree)
     except etree.DocumentInvalid as validation_error:
         return Counter(error.message for error in validation_error.error_log)
     return {}
+
+
+def validate_file(batch: models.Batch, filename: str) -> dict[str, int]:
+    """Validates a saved batch file one top-level entity at a time, recording each error against the entity's key.
+
+    Entities are discarded once validated, so memory use doesn't grow with the size of the return.  Produces the
+    same summary as validate_xml: {description: count}
+    """
+    xmlschema = schemas.get_entity_schema(batch.academic_year)
+    batch.schemaerror_set.all().delete()
+    summary = Counter()
+    errors = []
+
+    depth = 0
+    for event, element in etree.iterparse(str(_file_path(filename)), events=('start', 'end')):
+        if event == 'start':
+            depth += 1
+            continue
+        depth -= 1
+        if depth != 1:
+            continue
+
+        if not xmlschema.validate(element):
+            key_element = ENTITY_KEYS.get(element.tag)
+            key = element.findtext(key_element) if key_element else None
+            for error in xmlschema.error_log:
+                summary[error.message] += 1
+                errors.append(
+                    models.SchemaError(
+                        batch=batch, entity=element.tag, key=key, line=error.line, message=error.message
+                    )
+                )
+
+        # Release the entity, along with the emptied entities before it
+        element.clear()
+        while element.getprevious() is not None:
+            del element.getparent()[0]
+
+        if len(errors) >= VALIDATION_CHUNK_SIZE:
+            models.SchemaError.objects.bulk_create(errors)
+            errors = []
+
+    models.SchemaError.objects.bulk_create(errors)
+    return summary
@@ -6,6 +6,7 @@ from rest_framework.views import APIView
 from django.db import transaction
 from django.shortcuts import get_object_or_404
 
+from apps.core.utils import pdf_cache
 from apps.core.utils.api_views import OtherModelPermissions
 
 from . import models, serializers, views
@@ -31,6 +32,7 @@ class SaveSchedule(generics.CreateAPIView):
             modified_by=self.request.user.username,
             modified_on=datetime.now(),
         )
+        pdf_cache.invalidate(pdf_cache.STATEMENT, [plan.invoice_id])
 
 
 # --- Website document access - wrapping normal views to allow non-session-based access ---
@@ -0,0 +1,86 @@
+"""Batch printing of invoices or statements, as a single merged PDF or a zip of PDFs.
+
+Invoices are read a chunk at a time, with everything their documents show prefetched in a few queries.  Rendering
+(the slow part, with the legacy FPDF code) is then spread over a process pool, and each document is added to the
+output as soon as it's rendered.  Zips are written as they go, while a merged PDF is assembled by PyPDF2 and written
+once every document has been added.
+
+Batches are rendered by Celery's prefork workers, whose processes are daemonic, so the pool is billiard's (see
+`process_map()`), which can start processes from a daemonic process.
+"""
+from __future__ import annotations
+
+import zipfile
+from datetime import datetime
+from functools import partial
+from io import BytesIO
+from pathlib import Path
+from typing import Callable, Iterator
+
+from PyPDF2 import PdfFileMerger
+
+from django.conf import settings
+
+from apps.core.utils.celery import process_map
+
+from . import models, pdfs
+
+# Invoices read (and rendered) at a time
+BATCH_CHUNK_SIZE = 100
+
+INVOICES = 'invoices'
+STATEMENTS = 'statements'
+DOCUMENTS = [(INVOICES, 'Invoices'), (STATEMENTS, 'Statements')]
+
+PDF = 'pdf'
+ZIP = 'zip'
+OUTPUTS = [(PDF, 'A single PDF'), (ZIP, 'A zip of separate PDFs')]
+
+_ARGUMENTS = {INVOICES: pdfs.invoice_arguments, STATEMENTS: pdfs.statement_arguments}
+_RENDERERS = {INVOICES: pdfs.render_invoice, STATEMENTS: pdfs.render_statement}
+_FILENAMES = {INVOICES: pdfs.invoice_filename, STATEMENTS: pdfs.statement_filename}
+
+
+def _render(document: str, arguments: dict) -> bytes:
+    # Module-level, so the pool can pickle it
+    return _RENDERERS[document](**arguments)
+
+
+def render_documents(invoice_ids: list[int], document: str) -> Iterator[tuple[models.Invoice, bytes]]:
+    """Yield each invoice with its rendered document, in the order of `invoice_ids`.
+
+    With settings.PDF_RENDER_PROCESSES > 1, documents are rendered in a pool of that many processes
+    """
+    with process_map(settings.PDF_RENDER_PROCESSES) as render:
+        for start in range(0, len(invoice_ids), BATCH_CHUNK_SIZE):
+            chunk = invoice_ids[start : start + BATCH_CHUNK_SIZE]
+            found = models.Invoice.objects.in_bulk(chunk)
+            invoices = [found[invoice_id] for invoice_id in chunk if invoice_id in found]
+            arguments = _ARGUMENTS[document](invoices)
+            yield from zip(invoices, render(partial(_render, document), arguments))
+
+
+def write_pdf(invoice_ids: list[int], document: str, path: Path, *, progress: Callable[[int], None] = None) -> None:
+    merger = PdfFileMerger()
+    for count, (invoice, rendered) in enumerate(render_documents(invoice_ids, document), start=1):
+        merger.append(BytesIO(rendered), bookmark=str(invoice))
+        if progress:
+            progress(count)
+    with open(path, 'wb') as output:
+        merger.write(output)
+
+
+def write_zip(invoice_ids: list[int], document: str, path: Path, *, progress: Callable[[int], None] = None) -> None:
+    with zipfile.ZipFile(path, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        for count, (invoice, rendered) in enumerate(render_documents(invoice_ids, document), start=1):
+            archive.writestr(_FILENAMES[document](invoice), rendered)
+            if progress:
+                progress(count)
+
+
+def batch_root() -> Path:
+    return settings.PROTECTED_MEDIA_ROOT / 'invoices'
+
+
+def batch_filename(*, document: str, output: str, created_by: str) -> str:
+    return f'{document}_{datetime.now():%Y-%m-%d_%H%M%S}_{created_by}.{output}'
@@ -178,3 +178,11 @@ class ChooseFeesTable(tables.Table):
         model = Ledger
         fields = ('fee', 'amount', 'narrative', 'type', 'date', 'enrolment')
         per_page = 100
+
+
+class ChooseModuleFeesTable(ChooseFeesTable):
+    student = tables.Column(accessor='enrolment__qa__student', linkify=True, orderable=False)
+
+    class Meta(ChooseFeesTable.Meta):
+        fields = ('fee', 'student', 'amount', 'narrative', 'type', 'date')
+        orderable = False  # Kept in the order fees are printed on the invoice
@@ -1,3 +1,5 @@
+from dal import autocomplete
+
 from django import forms
 from django.core import validators
 from django.forms.models import fields_for_model
@@ -5,9 +7,10 @@ from django.forms.models import fields_for_model
 from apps.core.utils.widgets import DatePickerInput, PoundInput
 from apps.enrolment.models import Enrolment
 from apps.finance.models import Ledger, TransactionType
+from apps.module.models import Module
 from apps.student.models import Student
 
-from . import models
+from . import batches, models
 
 
 class LookupForm(forms.Form):
@@ -123,3 +126,20 @@ class PaymentForm(forms.Form):
         self.fields[
             'enrolment'
         ].label_from_instance = lambda obj: f'{obj.module.code} - {obj.module} (£{obj.get_balance():.2f})'
+
+
+class PrintBatchForm(forms.Form):
+    submit_label = 'Print'
+    document = forms.ChoiceField(choices=batches.DOCUMENTS, label='Print')
+    module = forms.ModelChoiceField(
+        Module.objects.all(),
+        widget=autocomplete.ModelSelect2(url='autocomplete:module', attrs={'data-minimum-input-length': 3}),
+        required=False,
+        help_text='Invoices for enrolments on this module',
+    )
+    overdue = forms.BooleanField(label='Overdue only?', required=False)
+    output = forms.ChoiceField(choices=batches.OUTPUTS, label='As')
+
+    def clean(self):
+        if not self.cleaned_data.get('module') and not self.cleaned_data.get('overdue'):
+            raise forms.ValidationError('Choose a module, or overdue invoices')
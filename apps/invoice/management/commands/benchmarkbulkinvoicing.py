@@ -0,0 +1,89 @@
+import time
+from datetime import datetime
+from decimal import Decimal
+from functools import partial
+from typing import Callable
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from apps.core.models import User
+from apps.enrolment.tests.factories import EnrolmentFactory
+from apps.finance.models import Accounts, Ledger, TransactionTypes
+from apps.invoice import services
+from apps.invoice.models import Invoice
+from apps.module.tests.factories import ModuleFactory
+
+INVOICE_DETAILS = {
+    'invoiced_to': 'Benchmark sponsor',
+    'contact_person': 'Benchmark',
+    'contact_email': 'benchmark@example.com',
+    'contact_phone': '01865 000000',
+}
+
+
+def _create_invoice_per_row(*, amount: Decimal, fees: list[Ledger], user: User, **kwargs) -> Invoice:
+    """Invoice creation as it was before bulk inserts, attaching each fee with its own insert"""
+    invoice = Invoice.objects.create(
+        amount=amount,
+        balance=sum(fee.amount for fee in fees),
+        number=services.next_invoice_number(),
+        created_by=user.username,
+        modified_by=user.username,
+        **kwargs,
+    )
+    for index, ledger in enumerate(fees, start=1):
+        invoice.ledger_items.add(ledger, through_defaults={'item_no': index, 'allocation': invoice})
+    return invoice
+
+
+class Command(BaseCommand):
+    help = (
+        "Times invoicing a sponsor for a module's cohort (500 fee lines by default), comparing attaching fees one at "
+        'a time with a single bulk insert.  Everything generated is rolled back afterwards'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fees', type=int, default=500)
+        parser.add_argument('--students', type=int, default=250)
+
+    def handle(self, *args, **options):
+        user = User(username='benchmark')
+        with transaction.atomic():
+            self.stdout.write(f'Generating {options["fees"]} fees across {options["students"]} students on a module')
+            module = ModuleFactory()
+            enrolments = EnrolmentFactory.create_batch(size=options['students'], module=module)
+            Ledger.objects.bulk_create(
+                Ledger(
+                    account_id=Accounts.DEBTOR,
+                    allocation=-index,
+                    amount=Decimal(100),
+                    enrolment=enrolments[index % len(enrolments)],
+                    narrative='Benchmark',
+                    timestamp=datetime.now(),
+                    type_id=TransactionTypes.FEE,
+                )
+                for index in range(1, options['fees'] + 1)
+            )
+
+            self.stdout.write(f'{"Step":<40}{"Seconds":>10}{"Queries":>10}')
+            fees = []
+            self._measure('gather fees', lambda: fees.extend(services.uninvoiced_module_fees(module)))
+            for name, create in [
+                ('create invoice (per-row inserts)', _create_invoice_per_row),
+                ('create invoice (bulk insert)', services.create_invoice),
+            ]:
+                # Each run invoices the same fees, so is rolled back before the next
+                savepoint = transaction.savepoint()
+                amount = sum(fee.amount for fee in fees)
+                self._measure(name, partial(create, amount=amount, fees=fees, user=user, **INVOICE_DETAILS))
+                transaction.savepoint_rollback(savepoint)
+            transaction.set_rollback(True)
+
+    def _measure(self, name: str, function: Callable[[], object]) -> None:
+        start = time.perf_counter()
+        with CaptureQueriesContext(connection) as queries:
+            function()
+        seconds = time.perf_counter() - start
+        self.stdout.write(f'{name:<40}{seconds:>10.3f}{len(queries):>10}')
@@ -0,0 +1,111 @@
+import random
+import time
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from typing import Callable
+
+from django.core.management.base import BaseCommand
+from django.db import connection, models, transaction
+from django.test.utils import CaptureQueriesContext
+
+from apps.finance.models import Accounts, Ledger, TransactionTypes
+from apps.invoice import services
+from apps.invoice.models import Invoice, InvoiceLedger
+
+# Invoices generated per batch of inserts
+CHUNK_SIZE = 1000
+
+
+def _ledger_outstanding() -> models.QuerySet:
+    """The outstanding filter as it was before balances were stored, aggregating every invoice's ledger items"""
+    return Invoice.objects.filter(
+        id__in=models.Subquery(
+            Invoice.objects.annotate(total=models.Sum('allocated_ledger_items__amount'))
+            .filter(total__gt=0)
+            .values('id')
+        )
+    )
+
+
+class Command(BaseCommand):
+    help = (
+        'Times the invoice search filters against a synthetic ledger (a million rows by default), comparing stored '
+        'balances with aggregating the ledger.  Everything generated is rolled back afterwards'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--invoices', type=int, default=100_000)
+        parser.add_argument('--lines-per-invoice', type=int, default=10)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            self.stdout.write(
+                f'Generating {options["invoices"]} invoices with {options["lines_per_invoice"]} ledger lines each'
+            )
+            self._generate(options['invoices'], options['lines_per_invoice'], random.Random(options['seed']))
+
+            today = date.today()
+            self.stdout.write(f'{"Query":<40}{"Seconds":>10}{"Queries":>10}{"Rows":>10}')
+            for name, function in [
+                ('outstanding (ledger aggregate)', lambda: _ledger_outstanding().count()),
+                ('outstanding (stored balance)', lambda: Invoice.objects.outstanding().count()),
+                ('overdue (ledger aggregate)', lambda: _ledger_outstanding().filter(due_date__lt=today).count()),
+                ('overdue (stored balance)', lambda: Invoice.objects.overdue().count()),
+                ('reconciliation check', lambda: len(services.drifted_balances())),
+            ]:
+                self._measure(name, function)
+            transaction.set_rollback(True)
+
+    def _measure(self, name: str, function: Callable[[], int]) -> None:
+        start = time.perf_counter()
+        with CaptureQueriesContext(connection) as queries:
+            rows = function()
+        seconds = time.perf_counter() - start
+        self.stdout.write(f'{name:<40}{seconds:>10.3f}{len(queries):>10}{rows:>10}')
+
+    def _generate(self, invoices: int, lines_per_invoice: int, rng: random.Random) -> None:
+        first_number = (Invoice.objects.aggregate(models.Max('number'))['number__max'] or 0) + 1
+        now = datetime.now()
+        for start in range(first_number, first_number + invoices, CHUNK_SIZE):
+            numbers = range(start, min(start + CHUNK_SIZE, first_number + invoices))
+            # Fees, with some payments and credits, so that roughly half the invoices are outstanding
+            amounts = {
+                number: [Decimal(rng.randint(-500, 500)) for _ in range(lines_per_invoice)] for number in numbers
+            }
+            Invoice.objects.bulk_create(
+                Invoice(
+                    number=number,
+                    amount=sum(amount for amount in amounts[number] if amount > 0),
+                    balance=sum(amounts[number]),
+                    due_date=now.date() + timedelta(days=rng.randint(-60, 60)),
+                    invoiced_to='Benchmark',
+                )
+                for number in numbers
+            )
+            invoice_ids = dict(Invoice.objects.filter(number__in=numbers).values_list('number', 'id'))
+
+            # Negative allocations identify each line's invoice (since bulk inserts don't return ids on all backends)
+            Ledger.objects.bulk_create(
+                Ledger(
+                    account_id=Accounts.DEBTOR,
+                    allocation=-number,
+                    amount=amount,
+                    narrative='Benchmark',
+                    timestamp=now,
+                    type_id=TransactionTypes.FEE,
+                )
+                for number in numbers
+                for amount in amounts[number]
+            )
+            InvoiceLedger.objects.bulk_create(
+                InvoiceLedger(
+                    ledger_id=ledger_id,
+                    invoice_id=invoice_ids[-allocation],
+                    allocation_id=-allocation,
+                    item_no=1,
+                )
+                for ledger_id, allocation in Ledger.objects.filter(
+                    allocation__in=[-number for number in numbers]
+                ).values_list('id', 'allocation')
+            )
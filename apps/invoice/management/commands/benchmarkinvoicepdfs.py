@@ -0,0 +1,76 @@
+import os
+import time
+from datetime import date
+from decimal import Decimal
+from unittest.mock import patch
+
+from fpdf import FPDF
+
+from django.core.management.base import BaseCommand
+
+from apps.core.utils.legacy.fpdf import CONTED_FONTS, MODULE_DIRECTORY, ContedPDF
+from apps.enrolment.models import Enrolment
+from apps.finance.models import Ledger
+from apps.invoice import pdfs
+from apps.invoice.models import Invoice
+from apps.module.models import Module
+from apps.qualification_aim.models import QualificationAim
+from apps.student.models import Student
+
+
+class AddFontPDF(ContedPDF):
+    """ContedPDF as it was before fonts were registered per process: fpdf reads every font's metrics (parsing the font,
+    or unpickling its cache) and embeds every font, working out their widths again, for each document
+    """
+
+    set_font = FPDF.set_font
+    _putTTfontwidths = FPDF._putTTfontwidths
+
+    def add_fonts(self):
+        for family, style, filename in CONTED_FONTS:
+            self.add_font(family, style, os.path.join(MODULE_DIRECTORY, 'fonts', filename), uni=True)
+
+
+def sample_invoice(fees: int) -> dict:
+    """Arguments for render_invoice(), built from unsaved instances so no database is needed"""
+    qa = QualificationAim(student=Student(firstname='Sample', surname='Student'))
+    enrolment = Enrolment(module=Module(code='O00P000SAM', title='Sample module'), qa=qa)
+    invoice = Invoice(
+        number=1,
+        date=date.today(),
+        due_date=date.today(),
+        invoiced_to='Sample sponsor',
+        line1='1 Wellington Square',
+        town='Oxford',
+        postcode='OX1 2JA',
+        amount=Decimal(100) * fees,
+        contact_person='Sample',
+        contact_email='sample@example.com',
+        contact_phone='01865 000000',
+    )
+    return {
+        'invoice': invoice,
+        'fees': [Ledger(enrolment=enrolment, amount=Decimal(100), narrative=f'Fee {n}') for n in range(fees)],
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        'Times rendering an invoice (1,000 times by default) with the legacy PDF generator, comparing fpdf adding '
+        'fonts for every document with the per-process font registry'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--renders', type=int, default=1000)
+        parser.add_argument('--fees', type=int, default=5)
+
+    def handle(self, *args, **options):
+        arguments = sample_invoice(options['fees'])
+        self.stdout.write(f'{"Fonts":<40}{"Seconds":>10}{"ms/render":>12}')
+        for name, pdf_class in [('add_font() per document', AddFontPDF), ('font registry', ContedPDF)]:
+            with patch.object(pdfs, 'ContedPDF', pdf_class):
+                start = time.perf_counter()
+                for _ in range(options['renders']):
+                    pdfs.render_invoice(**arguments)
+                seconds = time.perf_counter() - start
+            self.stdout.write(f'{name:<40}{seconds:>10.3f}{seconds * 1000 / options["renders"]:>12.2f}')
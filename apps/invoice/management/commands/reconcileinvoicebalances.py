@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from apps.invoice import services
+
+
+class Command(BaseCommand):
+    help = (
+        "Checks every invoice's stored balance against its allocated ledger items, and repairs any that differ.  "
+        'Also used to backfill the balances after they were introduced'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Only report the invoices that differ')
+
+    def handle(self, *args, **options):
+        if options['dry_run']:
+            drifted = services.drifted_balances()
+        else:
+            drifted = services.reconcile_balances()
+        verb = 'differ' if options['dry_run'] else 'repaired'
+        self.stdout.write(f'{len(drifted)} invoice balances {verb}')
+        if drifted and options['verbosity'] > 1:
+            self.stdout.write(', '.join(str(invoice_id) for invoice_id in drifted))
@@ -0,0 +1,40 @@
+# Generated by Django 3.2.13 on 2026-10-18 08:34
+
+from decimal import Decimal
+
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+
+
+def populate_balances(apps, schema_editor):
+    Invoice = apps.get_model('invoice', 'Invoice')
+    InvoiceLedger = apps.get_model('invoice', 'InvoiceLedger')
+    # Allocations refer to invoice numbers, rather than ids
+    totals = (
+        InvoiceLedger.objects.filter(allocation_id=models.OuterRef('number'))
+        .order_by()
+        .values('allocation_id')
+        .annotate(total=models.Sum('ledger__amount'))
+        .values('total')
+    )
+    Invoice.objects.update(balance=Coalesce(models.Subquery(totals), models.Value(Decimal(0))))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('invoice', '0006_alter_invoice_options'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='invoice',
+            name='balance',
+            field=models.DecimalField(decimal_places=4, default=0, editable=False, max_digits=19),
+        ),
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(fields=['balance', 'due_date'], name='invoice_balance_due_date'),
+        ),
+        migrations.RunPython(populate_balances, migrations.RunPython.noop),
+    ]
@@ -1,9 +1,10 @@
 from datetime import date, datetime
+from decimal import Decimal
 
 from django.db import models
 from django.db.models import Q
+from django.db.models.functions import Coalesce
 from django.urls import reverse
-from django.utils.functional import cached_property
 
 from apps.core.models import AddressModel, SignatureModel
 from apps.core.utils.models import PhoneField
@@ -14,22 +15,24 @@ CUSTOM_TYPE = 16
 
 class InvoiceQuerySet(models.QuerySet):
     def outstanding(self):
-        # Subquery - get a list of invoices with ledger totals > 0
-        # The performance may get worse as the number of invoices increases, in which case, it may be faster if the
-        #   subquery uses an outer reference, rather than being a big 'IN' check
-        outstanding = models.Subquery(
-            Invoice.objects.annotate(balance=models.Sum('allocated_ledger_items__amount'))
-            .filter(balance__gt=0)
-            .values('id')
-        )
-
-        # Apply a filter to the queryset, limiting it to those outstanding invoices, plus check they're overdue
-        return self.filter(id__in=outstanding)
+        return self.filter(balance__gt=0)
 
     def overdue(self):
         # Overdue only applies to outstanding
         return self.outstanding().filter(due_date__lt=date.today())
 
+    def with_ledger_balance(self):
+        """Add a `ledger_balance` attribute to each row, aggregated from the allocated ledger items,
+        for checking the stored balances
+        """
+        return self.annotate(
+            ledger_balance=Coalesce(
+                models.Sum('allocated_ledger_items__amount'),
+                models.Value(Decimal(0)),
+                output_field=models.DecimalField(max_digits=19, decimal_places=4),
+            )
+        )
+
 
 class Invoice(AddressModel, SignatureModel):
     number = models.IntegerField(unique=True, editable=False)
@@ -40,6 +43,8 @@ class Invoice(AddressModel, SignatureModel):
     invoiced_to = models.CharField(max_length=128, verbose_name='Invoice to')
 
     amount = models.DecimalField(max_digits=19, decimal_places=4, editable=False)
+    # The total of the allocated ledger items, maintained by `services` as items are attached
+    balance = models.DecimalField(max_digits=19, decimal_places=4, default=0, editable=False)
     custom_narrative = models.BooleanField(default=False)
     narrative = models.TextField(blank=True, null=True)
     ref_no = models.CharField(max_length=64, blank=True, null=True, verbose_name='Customer ref. #')
@@ -70,6 +75,7 @@ class Invoice(AddressModel, SignatureModel):
             ('print_invoice', 'Can print an invoice'),
             ('upload_rcp', 'Can upload RCP invoice payments'),
         ]
+        indexes = [models.Index(fields=['balance', 'due_date'], name='invoice_balance_due_date')]
 
     def __str__(self):
         return f'{self.prefix}{self.number}'
@@ -80,11 +86,6 @@ class Invoice(AddressModel, SignatureModel):
     def get_edit_url(self):
         return reverse('invoice:edit', args=[self.id])
 
-    @cached_property
-    def balance(self):
-        # Todo: investigate a way of single request caching without being a property.  lru_cache persists too long
-        return self.allocated_ledger_items.aggregate(sum=models.Sum('amount'))['sum']
-
     def get_fees(self):
         """Quickly get all an invoice's fee lines.  Fees are add with an incrementing `number`"""
         return self.ledger_items.filter(invoice_ledger__item_no__gt=0)
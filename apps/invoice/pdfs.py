@@ -1,9 +1,15 @@
 from __future__ import annotations
 
-from datetime import date
+from collections import defaultdict
+from datetime import date, datetime
 from itertools import cycle
+from typing import Optional
 
+from django.db.models import Max
+
+from apps.core.utils import strings
 from apps.core.utils.legacy.fpdf import ContedPDF
+from apps.core.utils.pdf_cache import latest
 from apps.core.utils.postal import FormattedAddress
 from apps.finance.models import Ledger
 from apps.invoice import models
@@ -13,13 +19,51 @@ DATE_FORMAT = '%d %b %Y'
 # Todo: convert to weasyprint
 
 
+def invoice_modified(invoice: models.Invoice) -> Optional[datetime]:
+    """The latest change to an invoice (including its address) or its ledger items, to version its cached PDFs"""
+    lines = invoice.allocated_ledger_items.aggregate(created=Max('created_on'), modified=Max('modified_on'))
+    return latest(invoice.modified_on, lines['created'], lines['modified'])
+
+
+def statement_modified(invoice: models.Invoice) -> Optional[datetime]:
+    """As invoice_modified(), but also including changes to the invoice's payment plan"""
+    plan = models.PaymentPlan.objects.filter(invoice=invoice).aggregate(
+        modified=Max('modified_on'), schedule=Max('scheduled_payment__modified_on')
+    )
+    return latest(invoice_modified(invoice), plan['modified'], plan['schedule'])
+
+
+def invoice_filename(invoice: models.Invoice) -> str:
+    return strings.normalize(f'Invoice_{invoice}{invoice.invoiced_to}.pdf').replace(' ', '_')
+
+
+def statement_filename(invoice: models.Invoice) -> str:
+    return f'Invoice_Statement_{invoice.prefix}{invoice.number}.pdf'
+
+
+FEE_ORDER = ('enrolment__qa__student__surname', 'enrolment__qa__student__firstname', 'enrolment__id')
+
+
 def create_invoice(invoice: models.Invoice) -> bytes:
     # separated out model access from rendering to ease migration to weasyprint
-    fees = (
-        invoice.get_fees()
-        .select_related('enrolment__module', 'enrolment__qa__student')
-        .order_by('enrolment__qa__student__surname', 'enrolment__qa__student__firstname', 'enrolment__id')
-    )
+    fees = invoice.get_fees().select_related('enrolment__module', 'enrolment__qa__student').order_by(*FEE_ORDER)
+    return _generate_invoice(invoice=invoice, fees=fees)
+
+
+def invoice_arguments(invoices: list[models.Invoice]) -> list[dict]:
+    """The arguments to render_invoice() for each of some invoices, with all their fees read in a single query"""
+    fees = defaultdict(list)
+    for fee in (
+        Ledger.objects.filter(invoice_ledger__invoice__in=invoices, invoice_ledger__item_no__gt=0)
+        .select_related('invoice_ledger', 'enrolment__module', 'enrolment__qa__student')
+        .order_by(*FEE_ORDER)
+    ):
+        fees[fee.invoice_ledger.invoice_id].append(fee)
+    return [{'invoice': invoice, 'fees': fees[invoice.pk]} for invoice in invoices]
+
+
+def render_invoice(*, invoice: models.Invoice, fees: list[Ledger]) -> bytes:
+    """Render an invoice without any database access, so it can be done in another process"""
     return _generate_invoice(invoice=invoice, fees=fees)
 
 
@@ -293,6 +337,35 @@ def create_statement(invoice: models.Invoice) -> bytes:
     return _generate_statement(invoice=invoice, payments=payments, scheduled_payments=scheduled_payments)
 
 
+def statement_arguments(invoices: list[models.Invoice]) -> list[dict]:
+    """The arguments to render_statement() for each of some invoices, read with two queries"""
+    payments = defaultdict(list)
+    for payment in (
+        Ledger.objects.filter(invoice_ledger__invoice__in=invoices, invoice_ledger__item_no=0)
+        .select_related('invoice_ledger', 'type')
+        .order_by('timestamp')
+    ):
+        payments[payment.invoice_ledger.invoice_id].append(payment)
+    scheduled_payments = defaultdict(list)
+    for scheduled_payment in (
+        models.ScheduledPayment.objects.filter(payment_plan__invoice__in=invoices)
+        .select_related('payment_plan')
+        .order_by('due_date')
+    ):
+        scheduled_payments[scheduled_payment.payment_plan.invoice_id].append(scheduled_payment)
+    return [
+        {'invoice': invoice, 'payments': payments[invoice.pk], 'scheduled_payments': scheduled_payments[invoice.pk]}
+        for invoice in invoices
+    ]
+
+
+def render_statement(
+    *, invoice: models.Invoice, payments: list[Ledger], scheduled_payments: list[models.ScheduledPayment]
+) -> bytes:
+    """Render a statement without any database access, so it can be done in another process"""
+    return _generate_statement(invoice=invoice, payments=payments, scheduled_payments=scheduled_payments)
+
+
 def _generate_statement(
     *, invoice: models.Invoice, payments: list[Ledger], scheduled_payments: list[models.ScheduledPayment]
 ) -> bytes:
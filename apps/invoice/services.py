@@ -2,6 +2,8 @@ from __future__ import annotations
 
 import csv
 import io
+from collections import defaultdict
+from dataclasses import dataclass, field
 from datetime import datetime
 from decimal import Decimal
 from typing import IO, Iterable, Optional
@@ -9,43 +11,61 @@ from typing import IO, Iterable, Optional
 import pydantic
 
 from django.contrib import auth
-from django.db import transaction
+from django.db import DatabaseError, transaction
+from django.db.models import Case, DecimalField, F, QuerySet, Sum, Value, When
 
 from apps.core.models import User
+from apps.core.utils import pdf_cache
 from apps.core.utils.db import next_in_sequence
 from apps.enrolment.models import Enrolment
 from apps.finance import services as finance_services
-from apps.finance.models import Ledger, TransactionTypes
+from apps.finance.models import Accounts, Ledger, TransactionTypes
+from apps.module.models import Module
 
 from . import models
 
+# RCP payments posted together
+RCP_BATCH_SIZE = 100
+
 
 def next_invoice_number() -> int:
-    """Return the next invoice number available for use"""
+    """Return the next invoice number available for use.
+    Invoice numbers mustn't have gaps, so this sequence is never given a block size in SEQUENCE_BLOCK_SIZES
+    """
     return next_in_sequence('invoice_number_sequence')
 
 
 @transaction.atomic()
 def create_invoice(*, amount: Decimal, fees: Iterable[Ledger], user: User, **kwargs) -> models.Invoice:
-    """Creates an invoice and attaches fees"""
+    """Creates an invoice and attaches fees, with a single insert however many fees there are"""
+    fees = list(fees)
     invoice = models.Invoice.objects.create(
         amount=amount,
+        balance=sum(fee.amount for fee in fees),
         number=next_invoice_number(),
         created_by=user.username,
         modified_by=user.username,
         **kwargs,
     )
-    for index, ledger in enumerate(fees, start=1):
-        invoice.ledger_items.add(
-            ledger,
-            through_defaults={
-                'item_no': index,
-                'allocation': invoice,
-            },
-        )
+    # A fee already on another invoice fails the unique constraint on `ledger`, rolling back the whole invoice
+    models.InvoiceLedger.objects.bulk_create(
+        models.InvoiceLedger(ledger=ledger, invoice=invoice, allocation=invoice, item_no=index)
+        for index, ledger in enumerate(fees, start=1)
+    )
     return invoice
 
 
+def uninvoiced_module_fees(module: Module) -> QuerySet[Ledger]:
+    """Every uninvoiced debt line on a module, across all its students, for invoicing a sponsor for a cohort"""
+    return (
+        Ledger.objects.debts()
+        .uninvoiced()
+        .filter(enrolment__module=module)
+        .select_related('type', 'enrolment__module', 'enrolment__qa__student')
+        .order_by('enrolment__qa__student__surname', 'enrolment__qa__student__firstname', 'enrolment__id', 'id')
+    )
+
+
 class RepeatingPaymentModel(pydantic.BaseModel):
     """Validation to ensure an rcp item is a payment that can be applied to an invoice"""
 
@@ -75,43 +95,153 @@ class RepeatingPaymentModel(pydantic.BaseModel):
         return datetime.strptime(v, '%d/%m/%y %H:%M')
 
 
-def add_repeating_payments_from_file(*, file: IO[bytes]) -> int:
-    """Create financial records for all RCP payments in a file object, returning the number that succeeded"""
+@dataclass
+class RepeatingPaymentLine:
+    """The outcome of a single line of an RCP file"""
+
+    line: int
+    invoice_no: Optional[str]
+    amount: Optional[str]
+    error: Optional[str] = None
+
+    @property
+    def succeeded(self) -> bool:
+        return self.error is None
+
+
+@dataclass
+class RepeatingPaymentReport:
+    lines: list[RepeatingPaymentLine] = field(default_factory=list)
+
+    @property
+    def succeeded(self) -> list[RepeatingPaymentLine]:
+        return [line for line in self.lines if line.succeeded]
+
+    @property
+    def failed(self) -> list[RepeatingPaymentLine]:
+        return [line for line in self.lines if not line.succeeded]
+
+
+def _validation_message(error: pydantic.ValidationError) -> str:
+    return '; '.join(f'{".".join(map(str, item["loc"]))}: {item["msg"]}' for item in error.errors())
+
+
+def add_repeating_payments_from_file(*, file: IO[bytes]) -> RepeatingPaymentReport:
+    """Create financial records for all RCP payments in a file object, reporting the outcome of every line.
+
+    Lines are validated as the file is read.  Their invoices and enrolment balances are then fetched in a couple of
+    queries, and the payments posted RCP_BATCH_SIZE at a time
+    """
 
     FIELDNAMES = ['invoice_no', '_1', '_2', 'name', 'digits', 'card', 'amount', 'trans_id', 'paid_at', 'status']
     # convert BytesIO objects (which file uploads and ftp provide) to return strings, which csv requires
     str_file = io.TextIOWrapper(file)
     payments = csv.DictReader(str_file, delimiter=',', fieldnames=FIELDNAMES)
 
-    valid_payments = []
-    for payment in payments:
+    report = RepeatingPaymentReport()
+    valid_payments: list[tuple[RepeatingPaymentLine, RepeatingPaymentModel]] = []
+    for line_no, payment in enumerate(payments, start=1):
+        line = RepeatingPaymentLine(line=line_no, invoice_no=payment['invoice_no'], amount=payment['amount'])
+        report.lines.append(line)
         try:
-            validated_payment = RepeatingPaymentModel(**payment)
-        except pydantic.ValidationError:
-            continue
+            # Surplus columns are collected under a None key
+            validated_payment = RepeatingPaymentModel(**{key: value for key, value in payment.items() if key})
+        except pydantic.ValidationError as e:
+            line.error = _validation_message(e)
         else:
-            valid_payments.append(validated_payment)
+            valid_payments.append((line, validated_payment))
 
-    for payment in valid_payments:
-        _add_repeating_payment(payment)
+    if valid_payments:
+        service_user = auth.get_user_model().objects.get(username='service_user')
+        planned = _plan_repeating_payments(valid_payments)
+        for start in range(0, len(planned), RCP_BATCH_SIZE):
+            _post_repeating_payments(planned[start : start + RCP_BATCH_SIZE], user=service_user)
+    return report
 
-    return len(valid_payments)
 
+def _invoiced_balances(invoice_ids: Iterable[int]) -> dict[int, dict[int, Decimal]]:
+    """Get the balance of each enrolment's ledger items on each invoice, as used to split payments, in a single query.
+    Returns {invoice_id: {enrolment_id: balance}}
+    """
+    balances: dict[int, dict[int, Decimal]] = defaultdict(dict)
+    rows = (
+        Ledger.objects.debts()
+        .filter(invoice_ledger__invoice__in=list(invoice_ids), enrolment__isnull=False)
+        .order_by()
+        .values_list('invoice_ledger__invoice', 'enrolment')
+        .annotate(balance=Sum('amount'))
+        .order_by('enrolment')
+    )
+    for invoice_id, enrolment_id, balance in rows:
+        balances[invoice_id][enrolment_id] = balance
+    return balances
 
-def _add_repeating_payment(payment: RepeatingPaymentModel) -> None:
-    """Take an RCP dict, and create an invoice payment from it"""
-    narrative = f"{payment.name}, card: {payment.card}, digits: {payment.digits}, trans: {payment.trans_id}"[:128]
-    invoice = models.Invoice.objects.get(number=payment.invoice_no)
-    service_user = auth.get_user_model().objects.get(username='service_user')
 
-    add_payment(
-        invoice=invoice,
-        amount=payment.amount,
-        type_id=TransactionTypes.RCP,
-        narrative=narrative,
-        timestamp=payment.paid_at,
-        user=service_user,
-    )
+# (line, invoice, posting) for each payment to be made
+PlannedPayment = tuple[RepeatingPaymentLine, models.Invoice, finance_services.Posting]
+
+
+def _plan_repeating_payments(
+    payments: list[tuple[RepeatingPaymentLine, RepeatingPaymentModel]]
+) -> list[PlannedPayment]:
+    """Split each payment between its invoice's enrolments, recording an error on the lines which can't be"""
+    invoices = models.Invoice.objects.in_bulk({payment.invoice_no for _, payment in payments}, field_name='number')
+    balances = _invoiced_balances(invoice.id for invoice in invoices.values())
+
+    planned = []
+    for line, payment in payments:
+        invoice = invoices.get(payment.invoice_no)
+        if invoice is None:
+            line.error = f'Invoice {payment.invoice_no} not found'
+            continue
+        enrolment_balances = balances.get(invoice.id)
+        if not enrolment_balances:
+            line.error = f'Invoice {payment.invoice_no} has no enrolments'
+            continue
+
+        allocations = _allocate_payment(
+            amount=payment.amount, balances=enrolment_balances, total_owing=invoice.balance
+        )
+        # Any later payments to the same invoice are split according to what's left
+        for enrolment_id, allocated in allocations.items():
+            enrolment_balances[enrolment_id] -= allocated
+        invoice.balance -= payment.amount
+
+        posting = finance_services.Posting(
+            account_code=Accounts.CASH,
+            account_finance_code='',
+            narrative=f'{payment.name}, card: {payment.card}, digits: {payment.digits}, trans: {payment.trans_id}'[
+                :128
+            ],
+            type_id=TransactionTypes.RCP,
+            debtor_lines=[
+                finance_services.DebtorLine(amount=-allocated, enrolment_id=enrolment_id)
+                for enrolment_id, allocated in allocations.items()
+            ],
+            timestamp=payment.paid_at,
+        )
+        planned.append((line, invoice, posting))
+    return planned
+
+
+def _post_repeating_payments(payments: list[PlannedPayment], *, user: User) -> None:
+    """Post a batch of payments together.  If that fails, post them one at a time, so only the bad lines fail"""
+
+    def post(batch: list[PlannedPayment]) -> None:
+        with transaction.atomic():
+            posted = finance_services.post_transactions([posting for _, _, posting in batch], user=user)
+            attach_transactions_to_invoices(
+                [(ledger_transaction, invoice) for ledger_transaction, (_, invoice, _) in zip(posted, batch)]
+            )
+
+    try:
+        post(payments)
+    except DatabaseError:
+        for payment in payments:
+            try:
+                post([payment])
+            except DatabaseError as e:
+                payment[0].error = str(e)
 
 
 @transaction.atomic
@@ -154,6 +284,23 @@ def _split_evenly(*, payment_amount: Decimal, split_by: int) -> Decimal:
     return Decimal(payment_amount / split_by).quantize(Decimal('.01'))  # Round to the nearest penny
 
 
+def _allocate_payment(*, amount: Decimal, balances: dict[int, Decimal], total_owing: Decimal) -> dict[int, Decimal]:
+    """Split a payment between enrolments in proportion to their balances, or evenly if nothing is owed"""
+    allocations: dict[int, Decimal] = {}
+    for enrolment_id, owing in balances.items():
+        if total_owing:
+            allocated = _split_by_owing(owing=owing, total_owing=total_owing, payment_amount=amount)
+        else:
+            allocated = _split_evenly(payment_amount=amount, split_by=len(balances))
+        allocations[enrolment_id] = allocated
+
+    # Check for a difference due to rounding
+    diff = sum(allocations.values()) - amount
+    # And allocate the difference to the first enrolment
+    allocations[next(iter(allocations))] -= diff
+    return allocations
+
+
 # todo: test that this will allocate correctly if an invoiced enrolment contains non-invoiced fees/balance
 @transaction.atomic
 def add_payment(
@@ -171,28 +318,16 @@ def add_payment(
     finance moves money about)
     """
 
-    queryset = Enrolment.objects.filter(ledger__invoice=invoice).with_balance()
+    queryset = Enrolment.objects.filter(ledger__invoice=invoice).with_ledger_balance()
     if enrolment:
         queryset = queryset.filter(id=enrolment.id)
     enrolments = list(queryset)
     if not enrolments:
         raise NoValidEnrolmentsError('Invoice has no enrolments')
 
-    total_owing = invoice.balance
-
-    allocations: dict[int, Decimal] = {}
-    for enr in enrolments:
-        if total_owing:
-            allocated = _split_by_owing(owing=enr.balance, total_owing=total_owing, payment_amount=amount)
-        else:
-            allocated = _split_evenly(payment_amount=amount, split_by=len(enrolments))
-        allocations[enr.id] = allocated
-
-    # Check for a difference due to rounding
-    diff = sum(allocations.values()) - amount
-    # And allocate the difference to the first enrolment
-    allocations[enrolments[0].id] -= diff
-
+    allocations = _allocate_payment(
+        amount=amount, balances={enr.id: enr.balance for enr in enrolments}, total_owing=invoice.balance
+    )
     ledger_transaction = finance_services.add_distributed_payment(
         narrative=narrative,
         amount=amount,
@@ -210,10 +345,70 @@ def attach_transaction_to_invoice(
     invoice: models.Invoice,
 ):
     """Attach a credit or payment transaction to an invoice"""
-    invoice.ledger_items.add(
-        *transaction.debtor_lines,
-        through_defaults={
-            'allocation': invoice,
-            'item_no': 0,  # payment/credit, not an invoiced line
-        },
+    attach_transactions_to_invoices([(transaction, invoice)])
+    invoice.refresh_from_db(fields=['balance'])
+
+
+@transaction.atomic
+def attach_transactions_to_invoices(attachments: list[tuple[finance_services.Transaction, models.Invoice]]) -> None:
+    """Attach credit or payment transactions to invoices, with a single insert and a single balance update"""
+    models.InvoiceLedger.objects.bulk_create(
+        models.InvoiceLedger(
+            ledger=line,
+            invoice=invoice,
+            allocation=invoice,
+            item_no=0,  # payment/credit, not an invoiced line
+        )
+        for ledger_transaction, invoice in attachments
+        for line in ledger_transaction.debtor_lines
+    )
+    totals: defaultdict[int, Decimal] = defaultdict(Decimal)
+    for ledger_transaction, invoice in attachments:
+        totals[invoice.pk] += sum(line.amount for line in ledger_transaction.debtor_lines)
+    # Updated in the database, rather than from the instances, in case of concurrent payments
+    models.Invoice.objects.filter(pk__in=totals).update(
+        balance=F('balance')
+        + Case(
+            *(When(pk=invoice_id, then=Value(total)) for invoice_id, total in totals.items()),
+            default=Value(Decimal(0)),
+            output_field=DecimalField(max_digits=19, decimal_places=4),
+        )
     )
+    _invalidate_documents(totals)
+
+
+def _invalidate_documents(invoice_ids: Iterable[int]) -> None:
+    """Mark invoices' cached PDFs (invoice and statement) as stale"""
+    invoice_ids = list(invoice_ids)
+    pdf_cache.invalidate(pdf_cache.INVOICE, invoice_ids)
+    pdf_cache.invalidate(pdf_cache.STATEMENT, invoice_ids)
+
+
+@transaction.atomic
+def refresh_balances(invoice_ids: list[int]) -> None:
+    """Recalculate invoices' stored balances from their allocated ledger items"""
+    # Lock the rows first, so payments can't change them between the recalculation and the update
+    list(models.Invoice.objects.select_for_update().filter(pk__in=invoice_ids).values_list('id'))
+    invoices = list(models.Invoice.objects.filter(pk__in=invoice_ids).with_ledger_balance().order_by())
+    for invoice in invoices:
+        invoice.balance = invoice.ledger_balance
+    models.Invoice.objects.bulk_update(invoices, fields=['balance'])
+    _invalidate_documents(invoice_ids)
+
+
+def drifted_balances() -> list[int]:
+    """Find the ids of invoices whose stored balance doesn't match their allocated ledger items, in a single query"""
+    return list(
+        models.Invoice.objects.with_ledger_balance()
+        .exclude(balance=F('ledger_balance'))
+        .order_by('id')
+        .values_list('id', flat=True)
+    )
+
+
+def reconcile_balances() -> list[int]:
+    """Repair any stored balances which have drifted from the ledger (or were never set), returning their ids"""
+    drifted = drifted_balances()
+    for start in range(0, len(drifted), finance_services.RECONCILE_CHUNK_SIZE):
+        refresh_balances(drifted[start : start + finance_services.RECONCILE_CHUNK_SIZE])
+    return drifted
@@ -2,11 +2,17 @@ import io
 from datetime import date
 
 import paramiko
+from celery_progress.backend import ProgressRecorder
+
+from django.conf import settings
+from django.core.mail import EmailMessage
+from django.template.loader import render_to_string
+from django.urls import reverse
 
 from redpot.celery import app
 from redpot.settings import WPM_FTP as CONFIG
 
-from . import services
+from . import batches, services
 
 
 @app.task(name="repeating_card_payment_download")
@@ -19,12 +25,25 @@ def repeating_card_payment_download(filename: str = None) -> str:
     # If unspecified, get today's payments file
     filename = filename or f'RCP_Payments_{date.today():%d%m%y}.csv'
     file = _get_file_from_wpm_sftp(filename)
-    payments_added = services.add_repeating_payments_from_file(file=file)
+    report = services.add_repeating_payments_from_file(file=file)
+    _mail_report(filename, report)
 
-    # Todo: Collect together basic payment info and send a summary to finance
     # Todo: Check the failures file and send info to finance
 
-    return f'{filename}: {payments_added} payments'
+    return f'{filename}: {len(report.succeeded)} payments, {len(report.failed)} failed'
+
+
+def _mail_report(filename: str, report: services.RepeatingPaymentReport) -> None:
+    """Email finance the outcome of every line of an RCP file"""
+    message = EmailMessage(
+        subject=f'RCP payments: {len(report.succeeded)} added, {len(report.failed)} failed ({filename})',
+        to=[settings.FINANCE_EMAIL],
+        bcc=[settings.SUPPORT_EMAIL],
+        from_email=settings.SUPPORT_EMAIL,
+        body=render_to_string('email/rcp_payment_report.html', {'filename': filename, 'report': report}),
+    )
+    message.content_subtype = 'html'
+    message.send()
 
 
 def _get_file_from_wpm_sftp(filename: str) -> io.BytesIO:
@@ -45,3 +64,22 @@ def _get_file_from_wpm_sftp(filename: str) -> io.BytesIO:
             sftp.getfo(remotepath=filename, fl=file)
             file.seek(0)
             return file
+
+
+@app.task(name='render_invoice_batch', bind=True)
+def render_batch(self, *, invoice_ids: list[int], document: str, output: str, created_by: str):
+    """Render the invoices or statements of a number of invoices to a single file, for download"""
+    recorder = ProgressRecorder(self)
+    root = batches.batch_root()
+    root.mkdir(parents=True, exist_ok=True)
+    filename = batches.batch_filename(document=document, output=output, created_by=created_by)
+    writer = batches.write_zip if output == batches.ZIP else batches.write_pdf
+    writer(
+        invoice_ids,
+        document,
+        root / filename,
+        progress=lambda count: recorder.set_progress(
+            current=count, total=len(invoice_ids), description=f'Rendering {document}'
+        ),
+    )
+    return {'redirect': reverse('invoice:download-batch', kwargs={'filename': filename})}
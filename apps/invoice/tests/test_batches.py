@@ -0,0 +1,98 @@
+import tempfile
+import zipfile
+from functools import partial
+from pathlib import Path
+from unittest.mock import Mock, patch
+
+import billiard
+from PyPDF2 import PdfFileReader
+
+from django import test
+
+from apps.core.utils.celery import process_map
+from apps.finance.tests.factories import LedgerFactory
+
+from .. import batches, models, pdfs, tasks
+from . import factories
+
+
+def _render_in_daemon(arguments: list[dict], results: billiard.Queue) -> None:
+    # Renders in a pool from a daemonic process, as the batch task does in a Celery prefork worker
+    try:
+        with process_map(2) as render:
+            results.put(list(render(partial(batches._render, batches.INVOICES), arguments)))
+    except Exception as error:
+        results.put(error)
+
+
+@test.override_settings(PDF_RENDER_PROCESSES=1)
+class TestBatchPrinting(test.TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.invoices = factories.InvoiceFactory.create_batch(size=3)
+        for invoice in cls.invoices:
+            invoice.ledger_items.add(LedgerFactory(), through_defaults={'item_no': 1, 'allocation': invoice})
+        payment_plan = factories.CustomPaymentPlanFactory(invoice=cls.invoices[0])
+        factories.ScheduledPaymentFactory.create_batch(size=2, payment_plan=payment_plan)
+        cls.invoice_ids = [invoice.id for invoice in cls.invoices]
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = Path(directory.name)
+
+    def test_prefetched_arguments(self):
+        with self.assertNumQueries(2):
+            arguments = pdfs.statement_arguments(self.invoices)
+        self.assertEqual([len(argument['scheduled_payments']) for argument in arguments], [2, 0, 0])
+        with self.assertNumQueries(1):
+            arguments = pdfs.invoice_arguments(self.invoices)
+        self.assertEqual([len(argument['fees']) for argument in arguments], [1, 1, 1])
+
+    def test_zip_of_documents(self):
+        path = self.directory / 'statements.zip'
+        progress = Mock()
+        with patch.object(batches, 'BATCH_CHUNK_SIZE', 2):
+            batches.write_zip(self.invoice_ids, batches.STATEMENTS, path, progress=progress)
+        with zipfile.ZipFile(path) as archive:
+            self.assertEqual(archive.namelist(), [pdfs.statement_filename(invoice) for invoice in self.invoices])
+        self.assertEqual([call.args[0] for call in progress.call_args_list], [1, 2, 3])
+
+    def test_merged_pdf(self):
+        path = self.directory / 'invoices.pdf'
+        batches.write_pdf(self.invoice_ids, batches.INVOICES, path)
+        with open(path, 'rb') as file:
+            bookmarks = PdfFileReader(file).getOutlines()
+        self.assertEqual([bookmark.title for bookmark in bookmarks], [str(invoice) for invoice in self.invoices])
+
+    @test.override_settings(PDF_RENDER_PROCESSES=2)
+    def test_rendered_in_process_pool(self):
+        documents = list(batches.render_documents(self.invoice_ids, batches.INVOICES))
+        self.assertEqual([invoice for invoice, _ in documents], self.invoices)
+        self.assertTrue(all(document.startswith(b'%PDF') for _, document in documents))
+
+    def test_rendered_in_pool_from_daemonic_process(self):
+        invoices = list(models.Invoice.objects.in_bulk(self.invoice_ids).values())
+        results = billiard.Queue()
+        process = billiard.Process(
+            target=_render_in_daemon, args=(pdfs.invoice_arguments(invoices), results), daemon=True
+        )
+        process.start()
+        documents = results.get(timeout=60)
+        process.join()
+        self.assertIsInstance(documents, list)
+        self.assertEqual(len(documents), 3)
+        self.assertTrue(all(document.startswith(b'%PDF') for document in documents))
+
+    def test_task_saves_file(self):
+        with test.override_settings(PROTECTED_MEDIA_ROOT=self.directory):
+            result = tasks.render_batch.apply(
+                kwargs={
+                    'invoice_ids': self.invoice_ids,
+                    'document': batches.INVOICES,
+                    'output': batches.ZIP,
+                    'created_by': 'testuser',
+                }
+            ).get()
+            filename = result['redirect'].rsplit('/', 1)[-1]
+            self.assertTrue((batches.batch_root() / filename).exists())
@@ -0,0 +1,39 @@
+import io
+
+from django import test
+from django.core.management import call_command
+
+from apps.finance.models import Ledger
+
+from .. import models
+
+
+class TestBenchmarkCommand(test.TestCase):
+    def test_benchmark_rolled_back(self):
+        stdout = io.StringIO()
+        call_command('benchmarkinvoicebalances', '--invoices=30', '--lines-per-invoice=3', stdout=stdout)
+
+        rows = {line[:40].strip(): line.split()[-1] for line in stdout.getvalue().splitlines()[2:]}
+        self.assertEqual(rows['outstanding (ledger aggregate)'], rows['outstanding (stored balance)'])
+        self.assertEqual(rows['overdue (ledger aggregate)'], rows['overdue (stored balance)'])
+        self.assertEqual(rows['reconciliation check'], '0')
+        self.assertFalse(models.Invoice.objects.exists())
+        self.assertFalse(Ledger.objects.exists())
+
+
+class TestBulkInvoicingBenchmark(test.TestCase):
+    def test_benchmark_rolled_back(self):
+        stdout = io.StringIO()
+        call_command('benchmarkbulkinvoicing', '--fees=20', '--students=5', stdout=stdout)
+
+        queries = {line[:40].strip(): int(line.split()[-1]) for line in stdout.getvalue().splitlines()[2:]}
+        self.assertLess(queries['create invoice (bulk insert)'], queries['create invoice (per-row inserts)'])
+        self.assertFalse(models.Invoice.objects.exists())
+        self.assertFalse(Ledger.objects.exists())
+
+
+class TestInvoicePDFBenchmark(test.SimpleTestCase):
+    def test_benchmark(self):
+        stdout = io.StringIO()
+        call_command('benchmarkinvoicepdfs', '--renders=2', stdout=stdout)
+        self.assertEqual(len(stdout.getvalue().splitlines()), 3)
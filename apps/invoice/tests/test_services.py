@@ -1,8 +1,12 @@
 import io
-from datetime import datetime
+from datetime import date, datetime, timedelta
 from decimal import Decimal
+from unittest.mock import patch
 
 from django import test
+from django.core.management import call_command
+from django.db import DatabaseError, connection
+from django.test.utils import CaptureQueriesContext
 
 import apps.finance.services as finance_services
 from apps.core.models import User
@@ -12,7 +16,7 @@ from apps.fee.tests.factories import FeeFactory
 from apps.finance.models import Accounts, TransactionTypes
 from apps.finance.tests.factories import LedgerFactory
 
-from .. import services
+from .. import models, services
 from . import factories
 
 
@@ -96,7 +100,7 @@ class TestRCP(test.TestCase):
     def setUpTestData(cls):
         UserFactory(username='service_user')  # todo: remove once service user added by migrations
         ledger_item = LedgerFactory(amount=100)
-        cls.invoice = factories.InvoiceFactory(number=10)
+        cls.invoice = factories.InvoiceFactory(number=10, balance=100)
         cls.invoice.ledger_items.add(ledger_item, through_defaults={'allocation': cls.invoice, 'item_no': 1})
 
     def test_valid_payment(self):
@@ -118,3 +122,117 @@ class TestRCP(test.TestCase):
         file = io.BytesIO(b'10,,,Name,1234,mc,-50.00,ref code,01/02/20 00:00,failure')
         services.add_repeating_payments_from_file(file=file)
         self.assertEqual(self.invoice.get_payments().count(), 0)
+
+    def _import(self, *lines: str) -> services.RepeatingPaymentReport:
+        return services.add_repeating_payments_from_file(file=io.BytesIO('\n'.join(lines).encode()))
+
+    def test_report_per_line(self):
+        report = self._import(
+            '10,,,Name,1234,mc,20.00,ref 1,01/02/20 00:00,success',
+            '11,,,Name,1234,mc,20.00,ref 2,01/02/20 00:00,success',
+            '10,,,Name,1234,mc,20.00,ref 3,01/02/20 00:00,failure',
+            '10,,,Name,1234,mc,30.00,ref 4,01/02/20 00:00,success',
+        )
+        self.assertEqual([line.line for line in report.succeeded], [1, 4])
+        self.assertEqual([line.line for line in report.failed], [2, 3])
+        self.assertIn('Invoice 11 not found', report.failed[0].error)
+        self.assertIn('status', report.failed[1].error)
+        self.assertEqual(self.invoice.get_payments().total(), -50)
+        self.invoice.refresh_from_db()
+        self.assertEqual(self.invoice.balance, 50)
+
+    def test_query_count_independent_of_lines(self):
+        line = '10,,,Name,1234,mc,1.00,ref code,01/02/20 00:00,success'
+        with CaptureQueriesContext(connection) as single:
+            self._import(line)
+        with CaptureQueriesContext(connection) as many:
+            self._import(*[line] * 10)
+        self.assertEqual(len(single), len(many))
+
+    def test_failed_line_isolated(self):
+        post_transactions = finance_services.post_transactions
+
+        def fail_bad_payments(postings, **kwargs):
+            if any('bad' in posting.narrative for posting in postings):
+                raise DatabaseError('Bad payment')
+            return post_transactions(postings, **kwargs)
+
+        with patch.object(finance_services, 'post_transactions', side_effect=fail_bad_payments):
+            report = self._import(
+                '10,,,Name,1234,mc,10.00,good,01/02/20 00:00,success',
+                '10,,,Name,1234,mc,10.00,bad,01/02/20 00:00,success',
+                '10,,,Name,1234,mc,10.00,good,01/02/20 00:00,success',
+            )
+        self.assertEqual([line.line for line in report.failed], [2])
+        self.assertEqual(report.failed[0].error, 'Bad payment')
+        self.assertEqual(self.invoice.get_payments().count(), 2)
+
+
+class TestInvoiceBalance(test.TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User(username='testuser')
+        fee = FeeFactory(amount=100)
+        cls.enrolment = EnrolmentFactory(module=fee.module)
+        cls.fee_transaction = finance_services.add_enrolment_fee(
+            enrolment_id=cls.enrolment.id, fee_id=fee.id, user=cls.user
+        )
+
+    def setUp(self):
+        self.invoice = services.create_invoice(
+            amount=Decimal(100),
+            fees=self.fee_transaction.debtor_lines,
+            user=self.user,
+            due_date=date.today() - timedelta(days=1),
+        )
+
+    def test_balance_maintained(self):
+        self.assertEqual(self.invoice.balance, 100)
+        self.assertQuerysetEqual(models.Invoice.objects.overdue(), [self.invoice])
+
+        services.add_payment(
+            invoice=self.invoice,
+            amount=Decimal(100),
+            type_id=TransactionTypes.CREDIT_CARD,
+            user=self.user,
+            narrative='Test payment',
+        )
+        self.assertEqual(self.invoice.balance, 0)
+        self.assertFalse(models.Invoice.objects.outstanding().exists())
+        self.assertEqual(services.drifted_balances(), [])
+
+    def test_reconcile(self):
+        models.Invoice.objects.update(balance=0)
+        call_command('reconcileinvoicebalances', '--dry-run', stdout=io.StringIO())
+        self.assertFalse(models.Invoice.objects.outstanding().exists())
+
+        call_command('reconcileinvoicebalances', stdout=io.StringIO())
+        self.assertQuerysetEqual(models.Invoice.objects.outstanding(), [self.invoice])
+        self.assertEqual(services.drifted_balances(), [])
+
+
+class TestModuleInvoicing(test.TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User(username='testuser')
+        cls.enrolments = EnrolmentFactory.create_batch(size=3)
+        cls.module = cls.enrolments[0].module
+        for enrolment in cls.enrolments[1:]:
+            enrolment.module = cls.module
+            enrolment.save()
+        cls.fees = [LedgerFactory(enrolment=enrolment, amount=100) for enrolment in cls.enrolments for _ in range(2)]
+        LedgerFactory(enrolment=EnrolmentFactory(), amount=100)  # another module
+
+    def test_gathers_cohort_fees(self):
+        with self.assertNumQueries(1):
+            fees = list(services.uninvoiced_module_fees(self.module))
+        self.assertEqual({fee.id for fee in fees}, {fee.id for fee in self.fees})
+
+    def test_fees_attached_with_one_insert(self):
+        fees = list(services.uninvoiced_module_fees(self.module))
+        with CaptureQueriesContext(connection) as queries:
+            invoice = services.create_invoice(amount=Decimal(600), fees=fees, user=self.user, invoiced_to='Sponsor')
+        self.assertEqual(len([query for query in queries if 'INSERT INTO "invoice_ledger"' in query['sql']]), 1)
+        self.assertEqual(list(invoice.get_fees().order_by('invoice_ledger__item_no')), fees)
+        self.assertEqual(invoice.balance, 600)
+        self.assertFalse(services.uninvoiced_module_fees(self.module).exists())
@@ -1,7 +1,10 @@
-from datetime import date
+from datetime import date, timedelta
 from unittest.mock import patch
 
+from freezegun import freeze_time
+
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.test import TestCase
 from django.urls import reverse
@@ -11,7 +14,7 @@ from apps.enrolment.tests.factories import EnrolmentFactory
 from apps.finance.tests.factories import LedgerFactory
 from apps.student.tests.factories import AddressFactory
 
-from .. import models
+from .. import models, services
 from . import factories
 
 
@@ -197,11 +200,72 @@ class TestPDFs(LoggedInMixin, TestCase):
             through_defaults={'item_no': 1, 'allocation': cls.invoice},
         )
 
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+
     def test_invoice(self):
         response = self.client.get(reverse('invoice:pdf', kwargs={'pk': self.invoice.id}))
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response['content-type'], 'application/pdf')
 
+    def test_invoice_cached(self):
+        url = reverse('invoice:pdf', kwargs={'pk': self.invoice.id})
+        first = self.client.get(url)
+        with patch('apps.invoice.pdfs.create_invoice') as create_invoice:
+            second = self.client.get(url)
+        create_invoice.assert_not_called()
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(second['ETag'], first['ETag'])
+
+    def test_unchanged_document_not_modified(self):
+        url = reverse('invoice:statement', kwargs={'pk': self.invoice.id})
+        etag = self.client.get(url)['ETag']
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+    def test_invalidated_by_balance_refresh(self):
+        url = reverse('invoice:statement', kwargs={'pk': self.invoice.id})
+        etag = self.client.get(url)['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            services.refresh_balances([self.invoice.id])
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_invalidated_only_on_commit(self):
+        url = reverse('invoice:statement', kwargs={'pk': self.invoice.id})
+        etag = self.client.get(url)['ETag']
+        with self.captureOnCommitCallbacks() as callbacks:
+            services.refresh_balances([self.invoice.id])
+            # Until the refresh commits, requests still get the cached document
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        for callback in callbacks:
+            callback()
+        self.assertNotEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag)['ETag'], etag)
+
+    def test_statement_rendered_again_next_day(self):
+        url = reverse('invoice:statement', kwargs={'pk': self.invoice.id})
+        with freeze_time(date.today() + timedelta(days=1)) as frozen:
+            etag = self.client.get(url)['ETag']
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+            frozen.tick(timedelta(days=1))
+            # The statement is printed with the date, so must not be served from yesterday's rendering
+            with patch('apps.invoice.pdfs.create_statement', return_value=b'%PDF') as create_statement:
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            create_statement.assert_called_once()
+            self.assertEqual(response.status_code, 200)
+            self.assertNotEqual(response['ETag'], etag)
+
+    def test_changed_address_not_cached(self):
+        url = reverse('invoice:pdf', kwargs={'pk': self.invoice.id})
+        etag = self.client.get(url)['ETag']
+        models.Invoice.objects.filter(pk=self.invoice.pk).update(
+            line1='1 New Street', modified_on=self.invoice.modified_on + timedelta(minutes=1)
+        )
+        self.assertNotEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag)['ETag'], etag)
+
     def test_statement_without_schedule(self):
         response = self.client.get(reverse('invoice:statement', kwargs={'pk': self.invoice.id}))
         self.assertEqual(response.status_code, 200)
@@ -213,3 +277,62 @@ class TestPDFs(LoggedInMixin, TestCase):
         response = self.client.get(reverse('invoice:statement', kwargs={'pk': self.invoice.id}))
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response['content-type'], 'application/pdf')
+
+
+class TestPrintBatch(LoggedInViewTestMixin, TestCase):
+    superuser = True
+    url = reverse('invoice:print-batch')
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.enrolment = EnrolmentFactory()
+        cls.invoice = factories.InvoiceFactory()
+        cls.invoice.ledger_items.add(
+            LedgerFactory(enrolment=cls.enrolment), through_defaults={'item_no': 1, 'allocation': cls.invoice}
+        )
+
+    def test_module_queued(self):
+        with patch('apps.invoice.tasks.render_batch.delay') as delay:
+            delay.return_value.id = '3fa85f64-5717-4562-b3fc-2c963f66afa6'
+            response = self.client.post(
+                self.get_url(), data={'document': 'statements', 'module': self.enrolment.module_id, 'output': 'pdf'}
+            )
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(delay.call_args.kwargs['invoice_ids'], [self.invoice.id])
+
+    def test_no_matching_invoices(self):
+        response = self.client.post(self.get_url(), data={'document': 'invoices', 'overdue': True, 'output': 'zip'})
+        self.assertEqual(response.status_code, 200)
+        self.assertFormError(response, 'form', None, 'No invoices match')
+
+
+class TestModuleInvoicing(LoggedInViewTestMixin, TestCase):
+    superuser = True
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.enrolment = EnrolmentFactory()
+        cls.fees = LedgerFactory.create_batch(size=2, enrolment=cls.enrolment)
+
+    def get_url(self):
+        return reverse('invoice:choose-module-fees', kwargs={'module_id': self.enrolment.module_id})
+
+    def test_create(self):
+        url = reverse('invoice:create-for-module', kwargs={'module_id': self.enrolment.module_id})
+        query = '&'.join(f'fee={fee.id}' for fee in self.fees)
+        self.assertEqual(self.client.get(f'{url}?{query}').status_code, 200)
+        response = self.client.post(
+            f'{url}?{query}',
+            data={
+                'due_date': '01/01/2030',
+                'invoiced_to': 'A sponsor',
+                'contact_person': 'Someone',
+                'contact_email': 'someone@example.com',
+                'contact_phone': '01865 000000',
+            },
+        )
+        invoice = models.Invoice.objects.get()
+        self.assertRedirects(response, invoice.get_absolute_url(), fetch_redirect_response=False)
+        self.assertEqual(invoice.get_fees().count(), 2)
@@ -14,10 +14,14 @@ urlpatterns = [
     path('payment/<int:pk>', views.Payment.as_view(), name='payment'),
     path('pdf/<int:pk>', views.PDF.as_view(), name='pdf'),
     path('statement/<int:pk>', views.StatementPDF.as_view(), name='statement'),
+    path('print-batch', views.PrintBatch.as_view(), name='print-batch'),
+    path('batch/<str:filename>', views.DownloadBatch.as_view(), name='download-batch'),
     # invoice creation steps
     path('choose-enrolments/<int:student_id>', views.ChooseEnrolments.as_view(), name='choose-enrolments'),
     path('choose-fees/<int:student_id>', views.ChooseFees.as_view(), name='choose-fees'),
     path('create/<int:student_id>', views.Create.as_view(), name='create'),
+    path('choose-module-fees/<int:module_id>', views.ChooseModuleFees.as_view(), name='choose-module-fees'),
+    path('create-for-module/<int:module_id>', views.CreateForModule.as_view(), name='create-for-module'),
     # payment plan urls
     path('create-payment-plan/<int:invoice_id>', views.CreatePaymentPlan.as_view(), name='create-payment-plan'),
     path('edit-payment-plan/<int:pk>', views.EditPaymentPlan.as_view(), name='edit-payment-plan'),
@@ -6,6 +6,7 @@ from django_filters.views import FilterView
 from django_tables2.views import SingleTableMixin
 
 from django import http
+from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth.mixins import LoginRequiredMixin, PermissionRequiredMixin
 from django.contrib.messages.views import SuccessMessageMixin
@@ -16,14 +17,15 @@ from django.urls import reverse
 from django.views import generic
 from django.views.generic.edit import FormMixin
 
-from apps.core.utils import strings
+from apps.core.utils import pdf_cache
 from apps.core.utils.urls import next_url_if_safe
 from apps.core.utils.views import AutoTimestampMixin, PageTitleMixin
 from apps.enrolment.models import Enrolment
 from apps.finance.models import Ledger
+from apps.module.models import Module
 from apps.student.models import Student
 
-from . import datatables, forms, models, pdfs, services
+from . import batches, datatables, forms, models, pdfs, services, tasks
 
 
 class Search(LoginRequiredMixin, PageTitleMixin, SingleTableMixin, FormMixin, FilterView):
@@ -208,6 +210,63 @@ class Create(LoginRequiredMixin, PageTitleMixin, generic.FormView):
         return redirect(invoice.get_absolute_url())
 
 
+class ChooseModuleFees(LoginRequiredMixin, PageTitleMixin, SingleTableMixin, generic.TemplateView):
+    """Step one for invoicing a sponsor for a module's cohort.
+    They pick from every uninvoiced fee on the module, across all its students, then get sent to CreateForModule"""
+
+    template_name = 'invoice/choose_module_fees.html'
+    table_class = datatables.ChooseModuleFeesTable
+    table_pagination = False  # Every fee is submitted together
+    title = 'Invoice'
+    subtitle = 'Create for a module – choose fees'
+
+    def dispatch(self, request, *args, **kwargs):
+        self.module = get_object_or_404(Module, pk=self.kwargs['module_id'])
+        return super().dispatch(request, *args, **kwargs)
+
+    def get_queryset(self):
+        return services.uninvoiced_module_fees(self.module)
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        return {**context, 'module': self.module}
+
+
+class CreateForModule(LoginRequiredMixin, PageTitleMixin, generic.FormView):
+    """Step two for invoicing a sponsor for a module's cohort.
+    Provide the invoice details in a standard form"""
+
+    form_class = forms.InvoiceForm
+    template_name = 'core/form.html'
+    title = 'Invoice'
+    subtitle = 'Create for a module – additional details'
+
+    def dispatch(self, request, *args, **kwargs):
+        self.module = get_object_or_404(Module, pk=kwargs['module_id'])
+        self.fees = list(services.uninvoiced_module_fees(self.module).filter(pk__in=request.GET.getlist('fee')))
+        if not self.fees:
+            raise http.Http404('No fees found')
+        return super().dispatch(request, *args, **kwargs)
+
+    def get_initial(self) -> dict:
+        return {
+            'due_date': datetime.today() + relativedelta(months=1),
+            'contact_person': self.request.user.get_full_name(),
+            'contact_email': self.module.email or self.module.portfolio.email,
+            'contact_phone': self.module.phone or self.module.portfolio.phone,
+        }
+
+    def form_valid(self, form):
+        invoice = services.create_invoice(
+            amount=sum(fee.amount for fee in self.fees),
+            fees=self.fees,
+            user=self.request.user,
+            **form.cleaned_data,
+        )
+        messages.success(self.request, f'Invoice created: {invoice} ({len(self.fees)} fees)')
+        return redirect(invoice.get_absolute_url())
+
+
 class UploadRCP(PermissionRequiredMixin, PageTitleMixin, generic.FormView):
     permission_required = 'invoice.upload_rcp'
     form_class = forms.UploadRCPForm
@@ -217,15 +276,17 @@ class UploadRCP(PermissionRequiredMixin, PageTitleMixin, generic.FormView):
 
     def form_valid(self, form):
         try:
-            payments_added = services.add_repeating_payments_from_file(file=form.cleaned_data['file'])
+            report = services.add_repeating_payments_from_file(file=form.cleaned_data['file'])
         except UnicodeDecodeError:
             form.add_error('file', 'Invalid file uploaded')
             return self.form_invalid(form)
 
-        if payments_added:
-            messages.success(self.request, f'{payments_added} payment(s) added')
+        if report.succeeded:
+            messages.success(self.request, f'{len(report.succeeded)} payment(s) added')
         else:
             messages.warning(self.request, 'No payments added.  Ensure you have a valid file')
+        for line in report.failed:
+            messages.warning(self.request, f'Line {line.line} not added: {line.error}')
 
         return super().form_valid(form)
 
@@ -384,6 +445,56 @@ class Payment(PermissionRequiredMixin, SuccessMessageMixin, PageTitleMixin, gene
         return next_url_if_safe(self.request) or self.invoice.get_absolute_url()
 
 
+class PrintBatch(PermissionRequiredMixin, PageTitleMixin, generic.FormView):
+    """Print the invoices or statements of every invoice for a module, or every overdue invoice, in one go"""
+
+    permission_required = 'invoice.print_invoice'
+    form_class = forms.PrintBatchForm
+    template_name = 'invoice/print_batch.html'
+    subtitle = 'Print batch'
+
+    def form_valid(self, form) -> http.HttpResponse:
+        invoices = models.Invoice.objects.all()
+        if form.cleaned_data['module']:
+            invoices = invoices.filter(
+                pk__in=models.Invoice.objects.filter(
+                    invoice_ledger__ledger__enrolment__module=form.cleaned_data['module']
+                ).values('pk')
+            )
+        if form.cleaned_data['overdue']:
+            invoices = invoices.overdue()
+        invoice_ids = list(invoices.order_by('number').values_list('id', flat=True))
+        if not invoice_ids:
+            form.add_error(None, 'No invoices match')
+            return self.form_invalid(form)
+
+        task = tasks.render_batch.delay(
+            invoice_ids=invoice_ids,
+            document=form.cleaned_data['document'],
+            output=form.cleaned_data['output'],
+            created_by=self.request.user.username,
+        )
+        return redirect('task:progress', task_id=task.id)
+
+    def get_context_data(self, **kwargs) -> dict:
+        context = super().get_context_data(**kwargs)
+        root = batches.batch_root()
+        root.mkdir(parents=True, exist_ok=True)
+        context['history'] = sorted((file.name for file in root.iterdir()), reverse=True)
+        return context
+
+
+class DownloadBatch(PermissionRequiredMixin, generic.View):
+    permission_required = 'invoice.print_invoice'
+
+    def get(self, request, filename: str, *args, **kwargs) -> http.HttpResponse:
+        path = settings.PROTECTED_MEDIA_URL + 'invoices/' + filename
+        return http.HttpResponse(
+            content_type='',
+            headers={'X-Accel-Redirect': path, 'Content-Disposition': f'attachment;filename={filename}'},
+        )
+
+
 class PDF(PermissionRequiredMixin, generic.View):
     """Generate a transcript for a single student"""
 
@@ -391,11 +502,13 @@ class PDF(PermissionRequiredMixin, generic.View):
 
     def get(self, request, pk: int, *args, **kwargs) -> http.HttpResponse:
         invoice = get_object_or_404(models.Invoice, pk=pk)
-        document = pdfs.create_invoice(invoice)
-
-        filename = strings.normalize(f'Invoice_{invoice}{invoice.invoiced_to}.pdf').replace(' ', '_')
-        return http.HttpResponse(
-            document, content_type='application/pdf', headers={'Content-Disposition': f'inline;filename={filename}'}
+        return pdf_cache.pdf_response(
+            request,
+            kind=pdf_cache.INVOICE,
+            document_id=invoice.pk,
+            last_modified=pdfs.invoice_modified(invoice),
+            render=lambda: pdfs.create_invoice(invoice),
+            filename=pdfs.invoice_filename(invoice),
         )
 
 
@@ -406,9 +519,11 @@ class StatementPDF(PermissionRequiredMixin, generic.View):
 
     def get(self, request, pk: int, *args, **kwargs) -> http.HttpResponse:
         invoice = get_object_or_404(models.Invoice, pk=pk)
-        document = pdfs.create_statement(invoice)
-
-        filename = f'Invoice_Statement_{invoice.prefix}{invoice.number}.pdf'
-        return http.HttpResponse(
-            document, content_type='application/pdf', headers={'Content-Disposition': f'inline;filename={filename}'}
+        return pdf_cache.pdf_response(
+            request,
+            kind=pdf_cache.STATEMENT,
+            document_id=invoice.pk,
+            last_modified=pdfs.statement_modified(invoice),
+            render=lambda: pdfs.create_statement(invoice),
+            filename=pdfs.statement_filename(invoice),
         )
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from apps.module import services
+
+
+class Command(BaseCommand):
+    help = (
+        "Checks every module's stored counts of places taken and rooms booked against its enrolments and "
+        'accommodation, and repairs any that differ (e.g. after enrolments made outside the services)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Only report the modules that differ')
+
+    def handle(self, *args, **options):
+        if options['dry_run']:
+            drifted = services.drifted_capacity()
+        else:
+            drifted = services.reconcile_capacity()
+        verb = 'differ' if options['dry_run'] else 'repaired'
+        self.stdout.write(f'{len(drifted)} module capacity counts {verb}')
+        if drifted and options['verbosity'] > 1:
+            self.stdout.write(', '.join(str(module_id) for module_id in drifted))
@@ -0,0 +1,55 @@
+# Generated by Django 3.2.13 on 2026-10-18 09:05
+
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+
+SINGLE, TWIN = 100, 200
+
+
+def populate_counts(apps, schema_editor):
+    Module = apps.get_model('module', 'Module')
+    Enrolment = apps.get_model('enrolment', 'Enrolment')
+
+    def count(**filters):
+        enrolments = (
+            Enrolment.objects.filter(module=models.OuterRef('pk'), **filters)
+            .order_by()
+            .values('module')
+            .annotate(count=models.Count('id'))
+            .values('count')
+        )
+        return Coalesce(models.Subquery(enrolments), 0)
+
+    Module.objects.update(
+        taken_places=count(status__takes_place=True),
+        booked_singles=count(accommodation__type=SINGLE),
+        booked_twins=count(accommodation__type=TWIN),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('booking', '0002_auto_20211005_1651'),
+        ('enrolment', '0008_data_futures_columns'),
+        ('module', '0020_data_futures_columns'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='module',
+            name='booked_singles',
+            field=models.IntegerField(db_index=True, default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='module',
+            name='booked_twins',
+            field=models.IntegerField(db_index=True, default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='module',
+            name='taken_places',
+            field=models.IntegerField(db_index=True, default=0, editable=False),
+        ),
+        migrations.RunPython(populate_counts, migrations.RunPython.noop),
+    ]
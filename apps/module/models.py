@@ -2,7 +2,7 @@ from __future__ import annotations
 
 import uuid
 from datetime import date, datetime
-from typing import Optional
+from typing import Callable, Optional
 
 from imagekit.models import ProcessedImageField
 from pilkit.processors import ResizeToFit
@@ -23,6 +23,8 @@ from apps.core.utils.dates import academic_year
 from apps.core.utils.models import PhoneField, UpperCaseCharField
 from redpot import storage_backends
 
+from . import page_cache
+
 
 class Statuses(models.IntegerChoices):
     UNPUBLISHED = 10
@@ -110,6 +112,9 @@ class ModuleManager(models.Manager):
         return super().get_queryset().defer(*self.defer_fields)
 
 
+# Stored counts, adjusted with relative updates or recounted, but never written by ordinary saves
+CAPACITY_COUNT_FIELDS = ['taken_places', 'booked_singles', 'booked_twins']
+
 # Common length limits for website text fields
 MAX_WEBFIELD_LENGTH = 10000
 webfield_attrs = {'validators': [validators.MaxLengthValidator(MAX_WEBFIELD_LENGTH)]}
@@ -173,6 +178,11 @@ class Module(SignatureModel):
 
     single_places = models.IntegerField(blank=True, null=True, verbose_name='Single rooms')
     twin_places = models.IntegerField(blank=True, null=True, verbose_name='Twin rooms')
+    # Stored counts of places taken and rooms booked, kept in step by the enrolment and booking services, and
+    #  repaired nightly before module statuses are updated (or by the reconcilemodulecapacity command)
+    taken_places = models.IntegerField(default=0, db_index=True, editable=False)
+    booked_singles = models.IntegerField(default=0, db_index=True, editable=False)
+    booked_twins = models.IntegerField(default=0, db_index=True, editable=False)
     location = models.ForeignKey('Location', models.DO_NOTHING, db_column='location', blank=True, null=True)
     room = models.ForeignKey('Room', models.PROTECT, db_column='room', blank=True, null=True)
     room_setup = models.CharField(max_length=12, choices=RoomSetups.choices, blank=True)
@@ -310,12 +320,43 @@ class Module(SignatureModel):
     def __str__(self) -> str:
         return self.title
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # The run group it was loaded in, so that moving it to another group also invalidates the old one's pages
+        if 'division_id' in instance.__dict__ and 'url' in instance.__dict__:
+            instance._loaded_run_group = (instance.division_id, instance.url)
+        return instance
+
     def save(self, *args, **kwargs):
         if not self.hash:
             self.hash = uuid.uuid4()  # todo: removable once modules have been back-filled with hashes
         if not self.url:
             self.url = slugify(self.title)
+        existing = self.pk is not None and not self._state.adding and not kwargs.get('force_insert')
+        if existing and kwargs.get('update_fields') is None:
+            # Leave out the capacity counts, which are adjusted in place, so a stale instance can't overwrite them
+            kwargs['update_fields'] = self._saved_fields()
         super().save(*args, **kwargs)
+        self._invalidate_page_cache()
+        self._loaded_run_group = (self.division_id, self.url)
+
+    def delete(self, *args, **kwargs):
+        self._invalidate_page_cache()
+        return super().delete(*args, **kwargs)
+
+    def _saved_fields(self) -> list[str]:
+        """The fields an ordinary save writes: those loaded, besides the primary key and capacity counts"""
+        excluded = self.get_deferred_fields() | set(CAPACITY_COUNT_FIELDS)
+        return [
+            field.attname
+            for field in self._meta.concrete_fields
+            if not field.primary_key and field.attname not in excluded
+        ]
+
+    def _invalidate_page_cache(self) -> None:
+        page_cache.invalidate([self.id])
+        page_cache.invalidate_runs({(self.division_id, self.url), getattr(self, '_loaded_run_group', None)} - {None})
 
     def get_absolute_url(self) -> str:
         return reverse('module:view', args=[self.id])
@@ -360,20 +401,29 @@ class Module(SignatureModel):
             return f'{self.code} - {self.title} ({self.start_date:%d %b %Y})'
         return f'{self.code} - {self.title}'
 
-    def places_taken(self) -> int:
-        return self.enrolments.filter(status__takes_place=True).count()
+    def places_taken(self, exact: bool = False) -> int:
+        """The stored count of places taken, or with `exact`, a fresh count of enrolments"""
+        if exact:
+            return self.enrolments.filter(status__takes_place=True).count()
+        return self.taken_places
 
-    def is_full(self) -> bool:
-        return bool(self.max_size and self.places_taken() >= self.max_size)
+    def is_full(self, exact: bool = False) -> bool:
+        return bool(self.max_size and self.places_taken(exact=exact) >= self.max_size)
 
-    def get_singles_left(self) -> int:
+    def get_singles_left(self, exact: bool = False) -> int:
         """Return [allocated places] - [booked places]"""
-        bookings = self.enrolments.filter(accommodation__type=Accommodation.Types.SINGLE).count()
+        if exact:
+            bookings = self.enrolments.filter(accommodation__type=Accommodation.Types.SINGLE).count()
+        else:
+            bookings = self.booked_singles
         return (self.single_places or 0) - bookings
 
-    def get_twins_left(self) -> int:
+    def get_twins_left(self, exact: bool = False) -> int:
         """Return [allocated places] - [booked places]"""
-        bookings = self.enrolments.filter(accommodation__type=Accommodation.Types.TWIN).count()
+        if exact:
+            bookings = self.enrolments.filter(accommodation__type=Accommodation.Types.TWIN).count()
+        else:
+            bookings = self.booked_twins
         return (self.twin_places or 0) - bookings
 
     @property
@@ -404,21 +454,41 @@ class Module(SignatureModel):
 
     @cached_property
     def _publish_check(self) -> dict:
+        return self.check_publishable(
+            has_overview=bool(self.overview),
+            has_programme=self.programmes.exists(),
+            has_marketing_type=self.marketing_types.exists(),
+            has_subject=self.subjects.exists(),
+            has_published_fee=self.fees.filter(is_visible=True, type__is_tuition=True, eu_fee=False).exists(),
+            has_incomplete_proposal=hasattr(self, 'proposal') and not self.proposal.is_complete,
+        )
+
+    def check_publishable(
+        self,
+        *,
+        has_overview: bool,
+        has_programme: bool,
+        has_marketing_type: bool,
+        has_subject: bool,
+        has_published_fee: bool,
+        has_incomplete_proposal: bool,
+    ) -> dict:
+        """Check the module can be published, given the facts which need other tables (or a deferred field)"""
         errors = {}
 
         if not self.snippet:
             errors['snippet'] = 'Snippet required'
-        if not self.overview:
+        if not has_overview:
             errors['overview'] = 'Overview required'
         if not self.email:
             errors['email'] = 'Email required'
-        if not self.programmes.exists():
+        if not has_programme:
             errors['programme'] = 'Not attached to a programme'
-        if not self.marketing_types.exists():
+        if not has_marketing_type:
             errors['marketing_type'] = 'Missing a marketing type'
-        if not self.subjects.exists():
+        if not has_subject:
             errors['subject'] = 'Missing a marketing subject'
-        if not self.custom_fee and not self.fees.filter(is_visible=True, type__is_tuition=True, eu_fee=False).exists():
+        if not self.custom_fee and not has_published_fee:
             errors['fee'] = 'Published non-EU programme fee required'
         if not self.location_id:
             errors['location'] = 'Location required'
@@ -426,7 +496,7 @@ class Module(SignatureModel):
             errors['format'] = 'Format required'
         if self.enrol_online and not self.finance_code:
             errors['enrol_online'] = 'Finance code components required for online enrolment'
-        if hasattr(self, 'proposal') and not self.proposal.is_complete:
+        if has_incomplete_proposal:
             errors['proposal'] = 'Proposal unapproved'
 
         return {
@@ -496,45 +566,16 @@ class Module(SignatureModel):
     def update_status(self) -> dict:
         """Routine to update module status and is_published if set to automatic publication"""
 
-        now = datetime.now()
-        today = now.date()
-
         # Store initial values to check for changes
         initial_status = self.status_id
         initial_pub = self.is_published
 
         if self.auto_publish:
-            # Automatic only, and we require start and end dates
-            if self.publish_date and self.start_date and self.end_date:
-                # Default dates (unpublish is not required, and so is set later)
-                if not self.open_date:
-                    self.open_date = self.publish_date
-                if not self.closed_date:
-                    # If undefined, default our closing to midnight the day the course starts
-                    self.closed_date = datetime.combine(self.start_date, datetime.min.time())
-
-                self.status_id = self._get_auto_status()
-
-                # Full courses overrides current statuses
-                if self.status_id in (Statuses.CLOSED, Statuses.OPEN, Statuses.RUNNING_AND_OPEN) and self.is_full():
-                    self.status_id = Statuses.FULL
-
-                self.is_published = (
-                    (not self.unpublish_date or self.unpublish_date >= today)
-                    # Status flagged as publishable
-                    and self.status.publish
-                    # Only do publishable check if not already publishable
-                    and (self.is_published or self.is_publishable)
-                )
-
-                # Notify weeklyclasses if a course isn't published ONLY because of a proposal being incomplete
-                # todo: determine usefulness of this check
-                # if not self.is_published and idb.module_status(self.status_id).publish:  # noqa: E800
-                #     _check_ongoing_proposal(self.id)  # noqa: E800
-            else:
-                # Lacks required fields for auto
-                self.is_published = False
-
+            self.apply_auto_status(
+                is_full=self.is_full,
+                is_publishable=lambda: self.is_publishable,
+                publishes=lambda status_id: self.status.publish,
+            )
         else:
             # Manual. Unpublish if it fails the check
             self.is_published = self.is_published and self.is_publishable
@@ -552,6 +593,51 @@ class Module(SignatureModel):
             'new_published': self.is_published,
         }
 
+    def apply_auto_status(
+        self,
+        *,
+        is_full: Callable[[], bool],
+        is_publishable: Callable[[], bool],
+        publishes: Callable[[int], bool],
+    ) -> None:
+        """Set the status and is_published of an automatically published module, without saving.
+
+        The checks needing other tables are passed in as callables, and only called when needed, so they can either
+        query for this module alone or look up results fetched in bulk (as services.update_auto_statuses() does)
+        """
+        today = datetime.now().date()
+
+        # Automatic only, and we require start and end dates
+        if self.publish_date and self.start_date and self.end_date:
+            # Default dates (unpublish is not required, and so is set later)
+            if not self.open_date:
+                self.open_date = self.publish_date
+            if not self.closed_date:
+                # If undefined, default our closing to midnight the day the course starts
+                self.closed_date = datetime.combine(self.start_date, datetime.min.time())
+
+            self.status_id = self._get_auto_status()
+
+            # Full courses overrides current statuses
+            if self.status_id in (Statuses.CLOSED, Statuses.OPEN, Statuses.RUNNING_AND_OPEN) and is_full():
+                self.status_id = Statuses.FULL
+
+            self.is_published = (
+                (not self.unpublish_date or self.unpublish_date >= today)
+                # Status flagged as publishable
+                and publishes(self.status_id)
+                # Only do publishable check if not already publishable
+                and (self.is_published or is_publishable())
+            )
+
+            # Notify weeklyclasses if a course isn't published ONLY because of a proposal being incomplete
+            # todo: determine usefulness of this check
+            # if not self.is_published and idb.module_status(self.status_id).publish:  # noqa: E800
+            #     _check_ongoing_proposal(self.id)  # noqa: E800
+        else:
+            # Lacks required fields for auto
+            self.is_published = False
+
     def clean(self) -> None:
         # Check both term start/end date fields are filled, or neither
         if bool(self.hilary_start) != bool(self.michaelmas_end):
@@ -673,6 +759,14 @@ class Book(models.Model):
     def __str__(self) -> str:
         return str(self.title)
 
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        page_cache.invalidate([self.module_id])
+
+    def delete(self, *args, **kwargs):
+        page_cache.invalidate([self.module_id])
+        return super().delete(*args, **kwargs)
+
     def get_absolute_url(self) -> str:
         return self.module.get_absolute_url() + '#reading-list'
 
@@ -0,0 +1,61 @@
+"""Versions for the cached fragments of the module view page.
+
+The page's slow-changing panels (fees, books and other runs) are cached as template fragments, keyed by:
+ - the module's version, replaced by `invalidate()` whenever the module, or any of its fees or books, is saved or
+   deleted
+ - for the other runs panel, the version of its run group (the modules sharing its division and url), replaced by
+   `invalidate_runs()` whenever any module in the group is saved or deleted, or leaves the group
+
+Versions are replaced once the change is committed, so a concurrent page view can't cache fragments of the
+uncommitted rows under the new version.  They're timestamps, so a version evicted from the cache is replaced by a new
+one rather than bringing back a fragment cached before the last invalidation.
+"""
+from __future__ import annotations
+
+import hashlib
+import time
+from functools import partial
+from typing import Iterable, Optional
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+
+def _module_key(module_id: int) -> str:
+    return f'module-page-version:{module_id}'
+
+
+def _runs_key(division_id: Optional[int], url: Optional[str]) -> str:
+    # Urls are free text, so are hashed to give a safe key
+    digest = hashlib.sha1((url or '').encode()).hexdigest()
+    return f'module-runs-version:{division_id}:{digest}'
+
+
+def _version(key: str) -> int:
+    return cache.get_or_set(key, time.time_ns, settings.MODULE_PAGE_CACHE_TIMEOUT)
+
+
+def module_version(module_id: int) -> int:
+    return _version(_module_key(module_id))
+
+
+def runs_version(division_id: Optional[int], url: Optional[str]) -> int:
+    return _version(_runs_key(division_id, url))
+
+
+def _replace_versions(keys: list[str]) -> None:
+    version = time.time_ns()
+    cache.set_many({key: version for key in keys}, settings.MODULE_PAGE_CACHE_TIMEOUT)
+
+
+def invalidate(module_ids: Iterable[int]) -> None:
+    """Mark the cached fragments of some modules' pages as stale, once the current transaction commits"""
+    transaction.on_commit(partial(_replace_versions, [_module_key(module_id) for module_id in module_ids]))
+
+
+def invalidate_runs(groups: Iterable[tuple[Optional[int], Optional[str]]]) -> None:
+    """Mark the cached other runs panels of some run groups, as (division_id, url) pairs, as stale, once the current
+    transaction commits
+    """
+    transaction.on_commit(partial(_replace_versions, [_runs_key(*group) for group in groups]))
@@ -1,12 +1,24 @@
 from __future__ import annotations
 
 from datetime import datetime
+from functools import partial
 from typing import Any
 
 from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import BooleanField, Case, Count, Exists, F, OuterRef, Q, QuerySet, Subquery, Value, When
+from django.db.models.functions import Coalesce
 from django.template.loader import render_to_string
 
-from .models import Book, Module
+from apps.booking.models import Accommodation, Catering
+from apps.discount.models import Discount
+from apps.enrolment.models import Enrolment
+from apps.fee.models import Fee
+from apps.programme.models import ProgrammeModule
+from apps.proposal.models import Proposal
+from apps.proposal.models import Statuses as ProposalStatuses
+
+from .models import CAPACITY_COUNT_FIELDS, Book, Module, ModuleMarketingType, ModuleStatus, ModuleSubject
 
 WEB_FIELDS = [
     # Text fields used for website copy.  Used in both clone_fields and copy_web_fields
@@ -163,3 +175,196 @@ def build_recommended_reading(*, module: Module) -> None:
         'module/components/recommended_reading_template.html',
         context={'module': module, 'reading_list': reading_list},
     )
+
+
+def with_status_checks(modules: QuerySet) -> QuerySet:
+    """Annotate modules with everything their publish check needs from other tables (and deferred fields)"""
+    # The snippet is deferred by default, but is short, and loading it on access would overwrite any unsaved changes
+    deferred = [field for field in Module.objects.defer_fields if field != 'snippet']
+    return (
+        modules.defer(None)
+        .defer(*deferred)
+        .annotate(
+            has_overview=Case(
+                When(Q(overview__isnull=False) & ~Q(overview=''), then=Value(True)),
+                default=Value(False),
+                output_field=BooleanField(),
+            ),
+            has_programme=Exists(ProgrammeModule.objects.filter(module=OuterRef('pk'))),
+            has_marketing_type=Exists(ModuleMarketingType.objects.filter(module=OuterRef('pk'))),
+            has_subject=Exists(ModuleSubject.objects.filter(module=OuterRef('pk'))),
+            has_published_fee=Exists(
+                Fee.objects.filter(module=OuterRef('pk'), is_visible=True, type__is_tuition=True, eu_fee=False)
+            ),
+            has_incomplete_proposal=Exists(
+                Proposal.objects.filter(module=OuterRef('pk')).exclude(status=ProposalStatuses.COMPLETE)
+            ),
+        )
+    )
+
+
+def _annotated_publish_check(module: Module) -> dict:
+    return module.check_publishable(
+        has_overview=module.has_overview,
+        has_programme=module.has_programme,
+        has_marketing_type=module.has_marketing_type,
+        has_subject=module.has_subject,
+        has_published_fee=module.has_published_fee,
+        has_incomplete_proposal=module.has_incomplete_proposal,
+    )
+
+
+def _annotated_is_publishable(module: Module) -> bool:
+    return _annotated_publish_check(module)['success']
+
+
+def update_auto_statuses(modules: QuerySet) -> list[tuple[Module, int]]:
+    """Update the status and publication of automatically published modules, returning (module, old status) for each
+    one changed.
+
+    The modules, and everything their statuses depend on (with places taken from the stored count), are read in one
+    query, and the changes saved with one
+    bulk update, rather than the dozen or so queries per module that Module.update_status() makes
+    """
+    statuses = ModuleStatus.objects.in_bulk()
+    changes = []
+    for module in with_status_checks(modules):
+        initial_status, initial_pub = module.status_id, module.is_published
+        module.apply_auto_status(
+            is_full=module.is_full,
+            is_publishable=partial(_annotated_is_publishable, module),
+            publishes=lambda status_id: statuses[status_id].publish,
+        )
+        if module.status_id != initial_status or module.is_published != initial_pub:
+            module.status = statuses[module.status_id]
+            changes.append((module, initial_status))
+
+    Module.objects.bulk_update(
+        [module for module, _ in changes], fields=['status', 'is_published', 'open_date', 'closed_date']
+    )
+    return changes
+
+
+# Modules recounted per query when reconciling capacity counts
+RECONCILE_CHUNK_SIZE = 500
+
+# The stored count adjusted by each type of accommodation booking
+BOOKING_COUNTS = {Accommodation.Types.SINGLE: 'singles', Accommodation.Types.TWIN: 'twins'}
+
+
+def adjust_capacity(module_id: int, *, places: int = 0, singles: int = 0, twins: int = 0) -> None:
+    """Adjust a module's stored counts of places taken and rooms booked.
+
+    The update is relative to the stored value (SET taken_places = taken_places + 1), so concurrent adjustments can't
+    overwrite each other.  Instances already in memory aren't updated, but saving them leaves the counts alone
+    """
+    changes = {
+        field: F(field) + change
+        for field, change in [('taken_places', places), ('booked_singles', singles), ('booked_twins', twins)]
+        if change
+    }
+    if changes:
+        Module.objects.filter(pk=module_id).update(**changes)
+
+
+def with_exact_capacity(modules: QuerySet) -> QuerySet:
+    """Annotate modules with fresh counts of places taken and rooms booked, to compare with the stored counts"""
+
+    def count(**filters) -> Coalesce:
+        enrolments = (
+            Enrolment.objects.filter(module=OuterRef('pk'), **filters)
+            .order_by()
+            .values('module')
+            .annotate(count=Count('id'))
+            .values('count')
+        )
+        return Coalesce(Subquery(enrolments), 0)
+
+    return modules.annotate(
+        exact_taken_places=count(status__takes_place=True),
+        exact_booked_singles=count(accommodation__type=Accommodation.Types.SINGLE),
+        exact_booked_twins=count(accommodation__type=Accommodation.Types.TWIN),
+    )
+
+
+def drifted_capacity() -> list[int]:
+    """Find the ids of modules whose stored counts don't match their enrolments and bookings, in a single query"""
+    return list(
+        with_exact_capacity(Module.objects.all())
+        .filter(
+            ~Q(taken_places=F('exact_taken_places'))
+            | ~Q(booked_singles=F('exact_booked_singles'))
+            | ~Q(booked_twins=F('exact_booked_twins'))
+        )
+        .order_by('id')
+        .values_list('id', flat=True)
+    )
+
+
+@transaction.atomic
+def refresh_capacity(module_ids: list[int]) -> None:
+    """Recount modules' places taken and rooms booked"""
+    # Lock the rows first, so enrolments can't adjust them between the recount and the update
+    list(Module.objects.select_for_update().filter(pk__in=module_ids).values_list('id'))
+    modules = list(with_exact_capacity(Module.objects.filter(pk__in=module_ids)).only('id').order_by())
+    for module in modules:
+        module.taken_places = module.exact_taken_places
+        module.booked_singles = module.exact_booked_singles
+        module.booked_twins = module.exact_booked_twins
+    Module.objects.bulk_update(modules, fields=CAPACITY_COUNT_FIELDS)
+
+
+def reconcile_capacity() -> list[int]:
+    """Repair any stored counts which have drifted from the enrolments and bookings, returning the modules' ids"""
+    drifted = drifted_capacity()
+    for start in range(0, len(drifted), RECONCILE_CHUNK_SIZE):
+        refresh_capacity(drifted[start : start + RECONCILE_CHUNK_SIZE])
+    return drifted
+
+
+def view_page_data(module: Module) -> dict[str, Any]:
+    """Everything the module page shows besides the module itself, with each panel read in a fixed number of queries.
+
+    `module` should be read with `with_status_checks()`, so its publish check needs no further queries.  Panels are
+    returned as unevaluated querysets, so those served from the page's fragment cache (see page_cache) aren't read
+    """
+    module._publish_check = _annotated_publish_check(module)
+
+    catering_counts = (
+        Catering.objects.filter(fee=OuterRef('pk'), enrolment__status__takes_place=True)
+        .order_by()
+        .values('fee')
+        .annotate(count=Count('id'))
+        .values('count')
+    )
+    fees = (
+        module.fees.select_related('type')
+        .annotate(catering_count=Coalesce(Subquery(catering_counts), 0))
+        .order_by('-type__display_order', 'description')
+    )
+
+    return {
+        'enrolments': module.enrolments.select_related('result', 'status', 'qa__student').order_by(
+            'qa__student__surname', 'qa__student__firstname'
+        ),
+        'fees': fees,
+        # Bookings change independently of the fees, so the cached fees panel also varies on their counts
+        'catering_counts': list(fees.filter(is_catering=True).values_list('id', 'catering_count')),
+        'discounts': Discount.objects.matching_module(module),
+        'programmes': module.programmes.select_related('qualification').order_by('title'),
+        'tutors': (
+            module.tutor_modules.select_related('tutor__student')
+            .prefetch_related('contracts')
+            .order_by(Coalesce('display_order', 999), 'id')
+        ),
+        'waitlist': module.waitlists.select_related('student'),
+        'books': module.books.all(),
+        'other_runs': module.other_runs(),
+        'next_run': module.next_run(),
+        'applications': module.applications.exclude(firstname__isnull=True).select_related('student'),
+        'subjects': module.subjects.all(),
+        'hecos_subjects': module.hecos_subjects.all(),
+        'payment_plans': module.payment_plans.all(),
+        'marketing_types': module.marketing_types.all(),
+        'statuses': ModuleStatus.objects.all(),
+    }
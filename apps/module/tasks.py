@@ -1,3 +1,4 @@
+from collections import defaultdict
 from datetime import datetime
 
 from django.conf import settings
@@ -7,13 +8,17 @@ from django.template.loader import render_to_string
 from apps.core.utils.celery import mail_on_failure
 from redpot.celery import app
 
+from . import services
 from .models import Module
 
 
 @app.task(name='update_module_statuses')
 @mail_on_failure
 def update_module_statuses() -> int:
-    """Routine to loop through modules set for automatic management update their statuses"""
+    """Routine to update the statuses of modules set for automatic management, emailing a summary of the changes"""
+    # Statuses use the stored counts of places taken, so first repair any drift (e.g. from website enrolments)
+    services.reconcile_capacity()
+
     modules = (
         Module.objects.filter(
             auto_publish=True,  # Set for automatic
@@ -33,26 +38,31 @@ def update_module_statuses() -> int:
         .order_by('id')
     )
 
-    for module in modules:
-        result = module.update_status()
-        if result['changed'] and module.email and 'conted' in module.email:  # Don't email non-departmental addresses
-            # Email the update
-            context = {
-                'module': module,
-                'new_status': module.status.description,
-                'canonical_url': settings.CANONICAL_URL,
-            }
-            body = render_to_string('email/module_status_change.html', context=context)
-
-            message = EmailMessage(
-                subject='Module status change: %s' % module.title,
-                # Only send to dev while testing
-                to=[settings.SUPPORT_EMAIL if settings.DEBUG else module.email],
-                bcc=[settings.SUPPORT_EMAIL],
-                from_email=settings.SUPPORT_EMAIL,
-                body=body,
-            )
-            message.content_subtype = 'html'
-            message.send(fail_silently=True)
-
-    return len(modules)
+    changes = services.update_auto_statuses(modules)
+
+    # One email per address, listing all its modules which changed
+    changed_by_email = defaultdict(list)
+    for module, _ in changes:
+        if module.email and 'conted' in module.email:  # Don't email non-departmental addresses
+            changed_by_email[module.email].append(module)
+
+    for email, changed in changed_by_email.items():
+        context = {'modules': changed, 'canonical_url': settings.CANONICAL_URL}
+        body = render_to_string('email/module_status_changes.html', context=context)
+
+        message = EmailMessage(
+            subject=(
+                f'Module status change: {changed[0].title}'
+                if len(changed) == 1
+                else f'Module status changes: {len(changed)} modules'
+            ),
+            # Only send to dev while testing
+            to=[settings.SUPPORT_EMAIL if settings.DEBUG else email],
+            bcc=[settings.SUPPORT_EMAIL],
+            from_email=settings.SUPPORT_EMAIL,
+            body=body,
+        )
+        message.content_subtype = 'html'
+        message.send(fail_silently=True)
+
+    return modules.count()
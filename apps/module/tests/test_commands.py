@@ -0,0 +1,18 @@
+import io
+
+from django import test
+from django.core.management import call_command
+
+from .. import models
+
+
+class TestStatusBenchmark(test.TestCase):
+    def test_benchmark_rolled_back(self):
+        stdout = io.StringIO()
+        call_command('benchmarkmodulestatuses', '--modules=30', stdout=stdout)
+
+        rows = {line[:40].strip(): line.split()[-3:] for line in stdout.getvalue().splitlines()[2:]}
+        # The same modules change either way, in far fewer queries
+        self.assertEqual(rows['per module'][2], rows['set-based'][2])
+        self.assertLess(int(rows['set-based'][1]), int(rows['per module'][1]))
+        self.assertFalse(models.Module.objects.filter(code__startswith='BENCH').exists())
@@ -5,7 +5,8 @@ from parameterized import parameterized
 
 from django.test import TestCase
 
-from ..models import Statuses
+from .. import services
+from ..models import Module, Statuses
 from . import factories
 
 
@@ -41,6 +42,16 @@ class TestModuleModel(TestCase):
     def test_next_run(self):
         self.assertEqual(self.next_run, self.object.next_run())
 
+    def test_save_keeps_capacity_counts(self):
+        module = Module.objects.get(pk=self.object.pk)
+        services.adjust_capacity(module.pk, places=2, singles=1)
+        # A stale instance, as when editing a module while someone enrols
+        module.title = 'New title'
+        module.save()
+        module.refresh_from_db()
+        self.assertEqual(module.title, 'New title')
+        self.assertEqual((module.taken_places, module.booked_singles), (2, 1))
+
 
 class TestUpdateModuleStatus(TestCase):
     @classmethod
@@ -1,12 +1,18 @@
-from datetime import datetime
+import io
+from datetime import date, datetime
 from unittest.mock import MagicMock
 
+from freezegun import freeze_time
+
+from django.core.management import call_command
 from django.test import SimpleTestCase, TestCase
 
+from apps.enrolment.tests.factories import EnrolmentFactory
 from apps.fee.tests.factories import FeeFactory
 
 from .. import models, services
 from . import factories
+from .utils import make_publishable
 
 
 class TestClone(SimpleTestCase):
@@ -57,3 +63,84 @@ class TestRebuildRecommendedReading(TestCase):
         for book in books:
             self.assertIn(book.title, module.recommended_reading)
             self.assertIn(book.author, module.recommended_reading)
+
+
+@freeze_time(date(2020, 3, 1))
+class TestUpdateAutoStatuses(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.dates = dates = {
+            'auto_publish': True,
+            'publish_date': date(2020, 1, 1),
+            'start_date': date(2020, 4, 1),
+            'end_date': date(2020, 5, 1),
+        }
+        cls.publishable = factories.ModuleFactory(**dates)
+        make_publishable(cls.publishable)
+        cls.full = factories.ModuleFactory(max_size=1, **dates)
+        make_publishable(cls.full)
+        EnrolmentFactory(module=cls.full)
+        services.refresh_capacity([cls.full.id])
+        cls.unpublishable = factories.ModuleFactory(**dates)
+        cls.without_dates = factories.ModuleFactory(
+            auto_publish=True, publish_date=date(2020, 1, 1), is_published=True
+        )
+        cls.unchanged = factories.ModuleFactory(status_id=models.Statuses.OPEN, **dates)
+
+    def test_same_results_as_update_status(self):
+        modules = models.Module.objects.filter(auto_publish=True).order_by('id')
+        changes = services.update_auto_statuses(modules)
+        self.assertEqual(
+            [(module.id, old_status) for module, old_status in changes],
+            [
+                (module.id, models.Statuses.UNPUBLISHED)
+                for module in [self.publishable, self.full, self.unpublishable, self.without_dates]
+            ],
+        )
+        updated = list(modules.values_list('status', 'is_published', 'open_date', 'closed_date'))
+
+        modules.update(status=models.Statuses.UNPUBLISHED, is_published=False, open_date=None, closed_date=None)
+        models.Module.objects.filter(id=self.without_dates.id).update(is_published=True)
+        models.Module.objects.filter(id=self.unchanged.id).update(status=models.Statuses.OPEN)
+        # Loading a deferred field reloads every field, losing the changes update_status() has made so far
+        for module in modules.defer(None):
+            module.update_status()
+        self.assertEqual(list(modules.values_list('status', 'is_published', 'open_date', 'closed_date')), updated)
+
+        self.publishable.refresh_from_db()
+        self.assertEqual(self.publishable.status_id, models.Statuses.OPEN)
+        self.assertTrue(self.publishable.is_published)
+        self.full.refresh_from_db()
+        self.assertEqual(self.full.status_id, models.Statuses.FULL)
+        self.unpublishable.refresh_from_db()
+        self.assertFalse(self.unpublishable.is_published)
+
+    def test_queries_independent_of_module_count(self):
+        for module in factories.ModuleFactory.create_batch(10, **self.dates):
+            make_publishable(module)
+        # Statuses, modules and a bulk update
+        with self.assertNumQueries(3):
+            changes = services.update_auto_statuses(models.Module.objects.filter(auto_publish=True))
+        self.assertEqual(len(changes), 14)
+
+
+class TestReconcileCapacity(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.module = factories.ModuleFactory(max_size=2)
+        # Enrolments made outside the services, as by the website
+        EnrolmentFactory.create_batch(2, module=cls.module)
+
+    def test_reconcile(self):
+        self.assertEqual(services.drifted_capacity(), [self.module.id])
+        self.assertFalse(self.module.is_full())
+        self.assertTrue(self.module.is_full(exact=True))
+
+        call_command('reconcilemodulecapacity', '--dry-run', stdout=io.StringIO())
+        self.module.refresh_from_db()
+        self.assertEqual(self.module.places_taken(), 0)
+
+        call_command('reconcilemodulecapacity', stdout=io.StringIO())
+        self.module.refresh_from_db()
+        self.assertEqual(self.module.places_taken(), 2)
+        self.assertEqual(services.drifted_capacity(), [])
@@ -1,13 +1,15 @@
 from datetime import date
-from unittest import mock
 
 import freezegun
 
 from django import test
 from django.core import mail
 
-from .. import tasks
+from apps.enrolment.tests.factories import EnrolmentFactory
+
+from .. import models, tasks
 from . import factories
+from .utils import make_publishable
 
 
 class TestMassModuleStatusUpdate(test.TestCase):
@@ -22,9 +24,9 @@ class TestMassModuleStatusUpdate(test.TestCase):
             is_published=False,
             email='test@conted.ox.ac.uk',
         )
+        make_publishable(cls.module)
 
     @freezegun.freeze_time(date(2020, 2, 1))
-    @mock.patch('apps.module.models.Module.is_publishable', True)  # Avoids building a complete, publishable module
     def test_auto_publish(self):
         modules_checked = tasks.update_module_statuses()
         self.assertEqual(modules_checked, 1)
@@ -33,3 +35,13 @@ class TestMassModuleStatusUpdate(test.TestCase):
         # Check the email was sent
         self.assertEqual(len(mail.outbox), 1)
         self.assertIn(self.module.title, mail.outbox[0].body)
+
+    @freezegun.freeze_time(date(2020, 1, 15))
+    def test_recounts_places_taken(self):
+        # Filled by enrolments made outside the services, so the stored count is stale
+        models.Module.objects.filter(pk=self.module.pk).update(max_size=1)
+        EnrolmentFactory(module=self.module)
+        tasks.update_module_statuses()
+        self.module.refresh_from_db()
+        self.assertEqual(self.module.taken_places, 1)
+        self.assertEqual(self.module.status_id, models.Statuses.FULL)
@@ -2,9 +2,11 @@ from datetime import date
 from decimal import Decimal
 
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
 from django.test import TestCase
 from django.urls import reverse
 
+from apps.booking.models import Catering
 from apps.core.utils.tests import LoggedInMixin, LoggedInViewTestMixin
 from apps.enrolment.tests.factories import EnrolmentFactory
 from apps.fee.models import FeeTypes
@@ -13,7 +15,9 @@ from apps.hesa.models import HECoSSubject
 from apps.invoice.models import PaymentPlanType
 from apps.programme.models import ProgrammeModule
 from apps.programme.tests.factories import ProgrammeFactory
+from apps.student.tests.factories import StudentFactory
 from apps.tutor.tests.factories import TutorModuleFactory
+from apps.waitlist.models import Waitlist
 
 from ..models import Module, ModuleStatus
 from . import factories
@@ -116,6 +120,89 @@ class TestViewsWithLogin(TestCase):
         self.assertEqual(Module.objects.last().code, 'T12T123TTT')
 
 
+class TestViewPage(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user(username='testuser')
+        cls.module = factories.ModuleFactory(url='test-module', portfolio_id=32, start_date=date(2000, 1, 1))
+        for _ in range(3):
+            enrolment = EnrolmentFactory(module=cls.module)
+            fee = FeeFactory(module=cls.module, is_catering=True)
+            Catering.objects.create(fee=fee, enrolment=enrolment)
+            TutorModuleFactory(module=cls.module)
+            factories.BookFactory(module=cls.module)
+            Waitlist.objects.create(module=cls.module, student=StudentFactory())
+            ProgrammeModule.objects.create(module=cls.module, programme=ProgrammeFactory())
+            factories.ModuleFactory(url='test-module', is_published=True, start_date=date(2001, 1, 1))
+        cls.fee = fee
+        cls.tuition_fee = FeeFactory(module=cls.module)
+        cls.other_run = cls.module.other_runs().first()
+        cls.url = reverse('module:view', args=[cls.module.pk])
+
+    def setUp(self):
+        self.client.force_login(self.user)
+        cache.clear()
+
+    def test_query_count(self):
+        # The same for any number of enrolments, fees, tutors, etc.
+        with self.assertNumQueries(23):
+            self.client.get(self.url)
+        # Fees, books and other runs are then served from the cache
+        with self.assertNumQueries(20):
+            self.client.get(self.url)
+
+    def test_catering_counts(self):
+        response = self.client.get(self.url)
+        self.assertContains(response, '(1/∞)', count=3)
+
+        # A new booking changes the count, without any change to the fee
+        Catering.objects.create(fee=self.fee, enrolment=EnrolmentFactory(module=self.module))
+        response = self.client.get(self.url)
+        self.assertContains(response, '(2/∞)', count=1)
+
+    def test_fee_change_invalidates_cache(self):
+        self.client.get(self.url)
+        self.tuition_fee.description = 'Changed fee'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.tuition_fee.save()
+        response = self.client.get(self.url)
+        self.assertContains(response, 'Changed fee')
+
+    def test_cache_invalidated_only_on_commit(self):
+        self.client.get(self.url)
+        self.tuition_fee.description = 'Changed fee'
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.tuition_fee.save()
+            # Until the change commits, the page still shows the cached fees
+            self.assertNotContains(self.client.get(self.url), 'Changed fee')
+        for callback in callbacks:
+            callback()
+        self.assertContains(self.client.get(self.url), 'Changed fee')
+
+    def test_book_change_invalidates_cache(self):
+        self.client.get(self.url)
+        with self.captureOnCommitCallbacks(execute=True):
+            factories.BookFactory(module=self.module, title='New book')
+        response = self.client.get(self.url)
+        self.assertContains(response, 'New book')
+
+    def test_other_run_change_invalidates_cache(self):
+        self.client.get(self.url)
+        self.other_run.title = 'Renamed run'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.other_run.save()
+        response = self.client.get(self.url)
+        self.assertContains(response, 'Renamed run')
+
+        # Leaving the run group removes it from the panel
+        other_run = Module.objects.get(pk=self.other_run.pk)
+        other_run.url = 'another-module'
+        with self.captureOnCommitCallbacks(execute=True):
+            other_run.save()
+        response = self.client.get(self.url)
+        self.assertNotContains(response, 'Renamed run')
+
+
 class TestCloneView(TestCase):
     @classmethod
     def setUpTestData(cls):
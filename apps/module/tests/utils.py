@@ -0,0 +1,18 @@
+from apps.fee.tests.factories import FeeFactory
+from apps.programme.tests.factories import ProgrammeFactory
+
+from .. import models
+
+
+def make_publishable(module: models.Module) -> None:
+    """Give a module everything it needs to pass the publish check"""
+    module.snippet = 'A test module'
+    module.overview = '<p>A test module</p>'
+    module.email = 'test@conted.ox.ac.uk'
+    module.location = models.Location.objects.create(building='Rewley House', longitude=0, latitude=0)
+    module.format = models.ModuleFormat.objects.create(description='Online')
+    module.save()
+    module.programmes.add(ProgrammeFactory())
+    module.marketing_types.add(models.MarketingType.objects.get_or_create(id=1, name='Online')[0])
+    module.subjects.add(models.Subject.objects.create(name='History', area='Humanities'))
+    FeeFactory(module=module, is_visible=True, eu_fee=False)
@@ -4,12 +4,12 @@ from django_filters.views import FilterView
 from django_tables2.views import SingleTableMixin
 
 from django import http
+from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth.mixins import LoginRequiredMixin, PermissionRequiredMixin
 from django.contrib.messages.views import SuccessMessageMixin
 from django.db import transaction
 from django.db.models import FilteredRelation, Q, QuerySet
-from django.db.models.functions import Coalesce
 from django.shortcuts import get_object_or_404, redirect
 from django.utils.text import slugify
 from django.views import generic
@@ -18,7 +18,6 @@ from apps.core.utils.dates import academic_year
 from apps.core.utils.mail_merge import MailMergeView
 from apps.core.utils.urls import next_url_if_safe
 from apps.core.utils.views import AutoTimestampMixin, ErrorBannerMixin, ExcelExportView, PageTitleMixin
-from apps.discount.models import Discount
 from apps.enrolment.models import CONFIRMED_STATUSES, Enrolment
 from apps.fee.models import FeeTypes
 from apps.invoice.models import ModulePaymentPlan
@@ -26,7 +25,7 @@ from apps.tutor.utils import expense_forms
 from apps.tutor_payment.models import Statuses as PaymentStatuses
 from apps.tutor_payment.models import TutorPayment
 
-from . import datatables, exports, forms, models, services
+from . import datatables, exports, forms, models, page_cache, services
 
 
 class Clone(LoginRequiredMixin, PageTitleMixin, SuccessMessageMixin, AutoTimestampMixin, generic.CreateView):
@@ -172,8 +171,10 @@ class Search(LoginRequiredMixin, PageTitleMixin, SingleTableMixin, FilterView):
 
 
 class View(LoginRequiredMixin, PageTitleMixin, generic.DetailView):
-    queryset = models.Module.objects.defer(None).select_related(  # defer(None) to get all fields
-        'portfolio', 'division', 'format', 'location', 'room', 'status'
+    queryset = (
+        services.with_status_checks(models.Module.objects.all())
+        .defer(None)  # all fields
+        .select_related('portfolio', 'division', 'format', 'location', 'room', 'status')
     )
     template_name = 'module/view.html'
 
@@ -182,55 +183,15 @@ class View(LoginRequiredMixin, PageTitleMixin, generic.DetailView):
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-
-        enrolments = self.object.enrolments.select_related('result', 'status', 'qa__student').order_by(
-            'qa__student__surname', 'qa__student__firstname'
-        )
-
-        fees = self.object.fees.order_by('-type__display_order', 'description').select_related('type').all()
-        programmes = self.object.programmes.order_by('title').select_related('qualification').all()
-
-        tutors = (
-            self.object.tutor_modules.select_related('tutor__student')
-            .prefetch_related('contracts')
-            .order_by(Coalesce('display_order', 999), 'id')
-        )
-
-        expense_form_options = expense_forms.template_options(self.object)
-
-        waitlist_table = datatables.WaitlistTable(self.object.waitlists.all(), request=self.request)
-        book_table = datatables.BookTable(self.object.books.all(), request=self.request)
-
-        discounts = Discount.objects.matching_module(self.object)
-
-        other_runs = self.object.other_runs()
-        next_run = self.object.next_run()
-
-        applications = self.object.applications.exclude(firstname__isnull=True).select_related('student')
-        subjects = self.object.subjects.all()
-        hecos_subjects = self.object.hecos_subjects.all()
-        payment_plans = self.object.payment_plans.all()
-        marketing_types = self.object.marketing_types.all()
-
-        statuses = models.ModuleStatus.objects.all()
-
+        data = services.view_page_data(self.object)
         return {
-            'enrolments': enrolments,
-            'fees': fees,
-            'programmes': programmes,
-            'tutors': tutors,
-            'expense_form_options': expense_form_options,
-            'waitlist_table': waitlist_table,
-            'payment_plans': payment_plans,
-            'book_table': book_table,
-            'other_runs': other_runs,
-            'next_run': next_run,
-            'discounts': discounts,
-            'statuses': statuses,
-            'applications': applications,
-            'subjects': subjects,
-            'hecos_subjects': hecos_subjects,
-            'marketing_types': marketing_types,
+            **data,
+            'expense_form_options': expense_forms.template_options(self.object),
+            'waitlist_table': datatables.WaitlistTable(data['waitlist'], request=self.request),
+            'book_table': datatables.BookTable(data['books'], request=self.request),
+            'page_version': page_cache.module_version(self.object.id),
+            'runs_version': page_cache.runs_version(self.object.division_id, self.object.url),
+            'page_cache_timeout': settings.MODULE_PAGE_CACHE_TIMEOUT,
             **context,
         }
 
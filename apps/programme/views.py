@@ -4,14 +4,13 @@ from django_tables2.views import SingleTableMixin
 from django.contrib import messages
 from django.contrib.auth.mixins import LoginRequiredMixin, PermissionRequiredMixin
 from django.contrib.messages.views import SuccessMessageMixin
-from django.db.models import Count, OuterRef, Subquery
 from django.shortcuts import get_object_or_404
 from django.urls import reverse_lazy
 from django.views import generic
 
 from apps.core.utils.urls import next_url_if_safe
 from apps.core.utils.views import AutoTimestampMixin, DeletionFailedMessageMixin, PageTitleMixin
-from apps.module.models import Module, ModuleStatus
+from apps.module.models import ModuleStatus
 
 from .datatables import ProgrammeSearchFilter, ProgrammeSearchTable
 from .forms import AttachModuleForm, ProgrammeEditForm, ProgrammeNewForm
@@ -26,20 +25,8 @@ class View(LoginRequiredMixin, PageTitleMixin, generic.DetailView):
         context = super(View, self).get_context_data(**kwargs)
         programme = self.object
 
-        # Get 100 most recent child modules, with a count of enrolment places taken
-        # Subquery to get places_taken per module
-        enrolment_count = (
-            Module.objects.filter(id=OuterRef('id'))
-            .filter(enrolment__status__takes_place=True)
-            .annotate(count=Count('enrolment__id'))
-            .values('count')
-        )
-
-        modules = (
-            programme.modules.annotate(enrolment_count=Subquery(enrolment_count))
-            .select_related('status')
-            .order_by('-start_date')[:100]
-        )
+        # Get 100 most recent child modules (with their stored count of places taken)
+        modules = programme.modules.select_related('status').order_by('-start_date')[:100]
 
         module_count = programme.modules.count()
         students = programme.qualification_aims.select_related('student').order_by('-start_date')[:200]
@@ -1,3 +1,4 @@
+import tempfile
 from pathlib import Path
 
 import environs
@@ -179,6 +180,23 @@ DATABASES = {
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# The number of values each process reserves at once from a database sequence, where gaps in the sequence don't matter.
+# Sequences not listed here (e.g. invoice numbers) are allocated strictly, as needed
+SEQUENCE_BLOCK_SIZES = {
+    'ledger_allocation_sequence': env.int('LEDGER_ALLOCATION_BLOCK_SIZE', default=50),
+}
+
+# How long rendered invoice, statement and receipt PDFs are kept in the cache (seconds).  Services invalidate cached
+# documents when they change, so this only limits the space used by documents which are rarely fetched
+PDF_CACHE_TIMEOUT = env.int('PDF_CACHE_TIMEOUT', default=60 * 60 * 24 * 7)
+# Processes used to render batches of invoices or statements.  1 renders in the task's own process
+PDF_RENDER_PROCESSES = env.int('PDF_RENDER_PROCESSES', default=4)
+# How long the slow-changing panels of module pages are kept in the cache (seconds).  They're invalidated when the
+# module, its fees or its books change
+MODULE_PAGE_CACHE_TIMEOUT = env.int('MODULE_PAGE_CACHE_TIMEOUT', default=60 * 60 * 24)
+# A writable directory for the legacy PDF generator's parsed font metrics, shared by all processes
+FPDF_FONT_CACHE_DIR: Path = env.path('FPDF_FONT_CACHE_DIR', default=Path(tempfile.gettempdir()) / 'redpot_fpdf_fonts')
+
 MESSAGE_TAGS = {
     # Overriding the error tag to match bootstrap 3
     messages.ERROR: 'danger'
@@ -310,6 +328,8 @@ DEFAULT_FROM_EMAIL = env('DEFAULT_FROM_EMAIL', default='redpot-support@conted.ox
 # custom email settings
 SUPPORT_EMAIL = env('SUPPORT_EMAIL', default='redpot-support@conted.ox.ac.uk', validate=validate.Email())
 PERSONNEL_EMAIL = env('PERSONNEL_EMAIL', 'personnel@conted.ox.ac.uk', validate=validate.Email())
+# Receives the daily repeating card payment (RCP) import reports
+FINANCE_EMAIL = env('FINANCE_EMAIL', default=SUPPORT_EMAIL, validate=validate.Email())
 
 # custom url settings
 ANALYTICS_URL = env('ANALYTICS_URL', default=None, validate=validate.URL())